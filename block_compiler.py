@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+'''Compile a block's YAML, order CSV and kernels into one binary block file
+
+Launching a block used to parse the YAML, the order CSV and the whole kernel
+file, and we'd only find out about a missing code when we hit a KeyError
+halfway through. Here we do all of that once, ahead of time, and write the
+fully resolved trial list (condition, formatted value, wrapped description
+lines, avi name and the kernel's Format) to <block>.blk next to the YAML
+file.
+numeric_questions_fast.py memory-maps that file and can start right away.
+
+The layout is simple (all little-endian):
+
+    header : magic 'NQBK', uint16 version, uint32 number of trials
+    log_file : string
+    sources : uint8 number of sources, then for each: path and md5
+              strings, uint64 size and float64 mtime
+    offsets : uint32 per trial, from the start of the file
+    trials : condition, value, uint8 number of lines, lines..., avi name,
+             format
+
+where every string is a uint16 length followed by the bytes.
+
+The sources are the YAML, the kernel file and the order CSV the block was
+compiled from, with paths relative to the .blk. If any of them has changed
+since, the .blk is stale - open_block recompiles it before we use it. We only
+read a source through to check its md5 if its size or mtime is different
+(a touched file gets read every launch until it's recompiled, but that's no
+worse than not having the mtimes).
+
+Launching from the YAML uses the .blk next to it too (see cached_block),
+compiling it first if there isn't one.
+'''
+
+from csv import reader
+from textwrap import wrap
+from os import stat
+from os.path import abspath, dirname, exists, join, normpath, relpath, \
+                    splitext
+from struct import Struct
+from hashlib import md5
+import mmap
+
+import yaml
+
+
+MAGIC = 'NQBK'
+# Bump this whenever the layout changes - old files will refuse to load
+VERSION = 4
+
+CONDITIONS = ('I', 'E', 'EI', 'EM')
+
+header_struct = Struct('<4sHI')
+len_struct = Struct('<H')
+count_struct = Struct('<B')
+stat_struct = Struct('<Qd')
+
+
+class BlockError(Exception):
+    '''A block that doesn't make sense, or a .blk we can't use'''
+    pass
+
+
+# TODO: would be nice if this could also handle scientific notation
+def format_num(x):
+    '''Take a number, put commas for a number in the millions, otherwise write
+    "Trillions", "Billions", etc.
+
+    x - a STRING of 0-9's'''
+    def float_num(x, exponent):
+        '''Format a big number to look nice
+
+        x: the number
+        exponent: e.g. 12 for trillion'''
+        units = x[:-exponent]
+        if len(units) < 3:
+            # Get a few digits after the decimal point
+            frac = x[-exponent:(-exponent + 3 - len(units))]
+            frac = frac.rstrip('0')
+            if len(frac) > 0:
+                units = units + '.' + frac
+
+        return units
+
+    if x.lower().find('e') != -1:
+        # Get rid of scientific notation
+        x = str(int(float(x)))
+    elif x.find('.') != -1:
+        # This is a reasonable decimal number...
+        return x
+
+    if len(x) > 12:
+        return float_num(x, 12) + ' Trillion'
+    if len(x) > 9:
+        return float_num(x, 9) + ' Billion'
+
+    i = 3
+    final = x[-i:]
+    while i < len(x):
+        final = x[-(i+3):-i] + ',' + final
+        i += 3
+
+    return final
+
+
+def wrap_description(desc_text, line_width=53):
+    '''Split a description into (at most) the 4 lines we have stimuli for'''
+    desc_lines = wrap(desc_text, line_width)
+    if len(desc_lines) > 4:
+        desc_lines = desc_lines[0:4]
+        print "description doesn't wrap to 4 lines:\n***"
+        print desc_text, '\n***'
+
+    return desc_lines
+
+
+def open_and_check(fname, expected_header):
+    csv_iter = reader(open(fname))
+    csv_header = csv_iter.next()
+    if csv_header != expected_header:
+        raise BlockError("%s header should be: %s" %
+                         (fname, expected_header))
+
+    return csv_iter
+
+
+def read_kernels(kern_file):
+    '''Returns a dict of code -> (value, description text, format). The
+    format goes on the end of the description too, so people can see it.'''
+    kernels_in = open_and_check(kern_file,
+                     ['Item.code', 'Value', 'Description', 'Format'] )
+
+    kernels = {}
+    for code, value, desc_text, format in kernels_in:
+        if format:
+            desc_text = '%s [%s]' % (desc_text, format)
+        kernels[code] = (value, desc_text, format)
+
+    return kernels
+
+
+def read_parms(yaml_file):
+    '''Returns (parms, base), where base is the directory everything in the
+    YAML is relative to'''
+    try:
+        parms = yaml.load(open(yaml_file))
+    except (IOError, yaml.YAMLError), e:
+        raise BlockError("Problem with the YAML file %s: %s" % (yaml_file, e))
+    base = dirname(yaml_file)
+    if not base:
+        base = '.'
+
+    return parms, base
+
+
+def load_block(yaml_file, kern_file='shorter-kernels.csv'):
+    '''Resolve a block from its sources
+
+    Returns (log_file, trials), where each trial is a tuple of
+    (condition, value_text, desc_lines, avi name, format). The avi name is
+    relative to the directory of the block.
+
+    All missing codes and unknown conditions are reported together (in one
+    BlockError), before anything gets presented.'''
+    parms, base = read_parms(yaml_file)
+    kernels = read_kernels(kern_file)
+
+    order_in = open_and_check(join(base, parms['subj_order_file']),
+                                ['Item.code', 'Condition'])
+
+    trials = []
+    problems = []
+    for code, cond in order_in:
+        if cond not in CONDITIONS:
+            problems.append('unknown condition %s for %s' % (cond, code))
+        try:
+            value, desc_text, fmt = kernels[code]
+        except KeyError:
+            problems.append('missing code %s' % code)
+            continue
+        fname = 'trial%02d.avi' % len(trials)
+        trials.append( (cond, format_num(value),
+                        wrap_description(desc_text), fname, fmt) )
+
+    if problems:
+        raise BlockError('\n    '.join(["%s doesn't match %s:" %
+                                            (yaml_file, kern_file)] +
+                                          problems))
+
+    return parms['log_file'], trials
+
+
+def pack_str(s):
+    return len_struct.pack(len(s)) + s
+
+
+def unpack_str(buf, pos):
+    '''returns the string at pos, and the position just after it'''
+    length, = len_struct.unpack_from(buf, pos)
+    pos += len_struct.size
+    return buf[pos:pos + length], pos + length
+
+
+def file_md5(fname):
+    f = open(fname, 'rb')
+    try:
+        return md5(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
+def write_block(fname, log_file, trials, sources=()):
+    '''sources are the files the block came from (see the top of this
+    file)'''
+    base = dirname(fname) or '.'
+    head_sources = [count_struct.pack(len(sources))]
+    for source in sources:
+        st = stat(source)
+        head_sources.append(pack_str(relpath(source, base)) +
+                            pack_str(file_md5(source)) +
+                            stat_struct.pack(st.st_size, st.st_mtime))
+
+    records = []
+    for cond, value_text, desc_lines, avi_name, fmt in trials:
+        records.append(''.join([pack_str(cond), pack_str(value_text),
+                                count_struct.pack(len(desc_lines))] +
+                               [pack_str(l) for l in desc_lines] +
+                               [pack_str(avi_name), pack_str(fmt)]))
+
+    head = header_struct.pack(MAGIC, VERSION, len(records)) + \
+           pack_str(log_file) + ''.join(head_sources)
+    offsets_struct = Struct('<%dI' % len(records))
+
+    offsets = []
+    pos = len(head) + offsets_struct.size
+    for r in records:
+        offsets.append(pos)
+        pos += len(r)
+
+    out = open(fname, 'wb')
+    out.write(head)
+    out.write(offsets_struct.pack(*offsets))
+    out.writelines(records)
+    out.close()
+
+
+def compile_block(yaml_file, kern_file='shorter-kernels.csv', blk_file=None):
+    '''Writes blk_file (by default, <yaml_file minus .yaml>.blk) and returns
+    its name'''
+    log_file, trials = load_block(yaml_file, kern_file)
+    parms, base = read_parms(yaml_file)
+    sources = [yaml_file, kern_file, join(base, parms['subj_order_file'])]
+    if blk_file is None:
+        blk_file = splitext(yaml_file)[0] + '.blk'
+    write_block(blk_file, log_file, trials, sources)
+
+    return blk_file
+
+
+class CompiledBlock:
+    '''Read-only, memory-mapped view of a .blk file
+
+    Behaves like the list of trial tuples returned by load_block - trials are
+    only decoded when you ask for them.'''
+    log_file = None
+    # [(path, md5, size, mtime)] - the paths are relative to fname
+    sources = None
+    offsets = None
+
+    def __init__(self, fname):
+        self.fname = fname
+        f = open(fname, 'rb')
+        self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+
+        magic, version, num = header_struct.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise BlockError('%s is not a compiled block' % fname)
+        if version != VERSION:
+            raise BlockError('%s is version %d, we need %d - recompile it' %
+                             (fname, version, VERSION))
+
+        self.log_file, pos = unpack_str(self.buf, header_struct.size)
+        num_sources, = count_struct.unpack_from(self.buf, pos)
+        pos += count_struct.size
+        self.sources = []
+        for i in range(num_sources):
+            path, pos = unpack_str(self.buf, pos)
+            digest, pos = unpack_str(self.buf, pos)
+            size, mtime = stat_struct.unpack_from(self.buf, pos)
+            pos += stat_struct.size
+            self.sources.append((path, digest, size, mtime))
+        self.offsets = Struct('<%dI' % num).unpack_from(self.buf, pos)
+
+    def source_paths(self):
+        '''Where our sources are, relative to the current directory'''
+        return [normpath(join(dirname(self.fname), source[0]))
+                    for source in self.sources]
+
+    def changed(self):
+        '''Sources that are missing or have changed since we were
+        compiled - only ones whose size or mtime is different get read'''
+        changed = []
+        for source, (path, digest, size, mtime) in \
+                zip(self.source_paths(), self.sources):
+            if not exists(source):
+                changed.append(source)
+                continue
+            st = stat(source)
+            if (st.st_size, st.st_mtime) == (size, mtime):
+                continue
+            if st.st_size != size or file_md5(source) != digest:
+                changed.append(source)
+
+        return changed
+
+    def close(self):
+        self.buf.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        pos = self.offsets[i]
+        cond, pos = unpack_str(self.buf, pos)
+        value_text, pos = unpack_str(self.buf, pos)
+        num_lines, = count_struct.unpack_from(self.buf, pos)
+        pos += count_struct.size
+        desc_lines = []
+        for j in range(num_lines):
+            line, pos = unpack_str(self.buf, pos)
+            desc_lines.append(line)
+        avi_name, pos = unpack_str(self.buf, pos)
+        fmt, pos = unpack_str(self.buf, pos)
+
+        return cond, value_text, desc_lines, avi_name, fmt
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def open_block(blk_file):
+    '''A CompiledBlock for blk_file, which gets recompiled first if any of its
+    sources have changed since it was compiled'''
+    return up_to_date(CompiledBlock(blk_file))
+
+
+def up_to_date(block):
+    '''block, or a freshly compiled one if its sources have changed'''
+    blk_file = block.fname
+    changed = block.changed()
+    if not changed:
+        return block
+
+    block.close()
+    yaml_file, kern_file = block.source_paths()[:2]
+    if not exists(yaml_file) or not exists(kern_file):
+        raise BlockError("%s can't be recompiled - %s missing" %
+                         (blk_file, ', '.join(changed)))
+    print '%s changed since %s was compiled - recompiling' % \
+            (', '.join(changed), blk_file)
+    compile_block(yaml_file, kern_file, blk_file)
+
+    return CompiledBlock(blk_file)
+
+
+def cached_block(yaml_file, kern_file='shorter-kernels.csv'):
+    '''A CompiledBlock for yaml_file - the .blk next to it, if that was
+    compiled from yaml_file and kern_file (recompiled if it's stale, as in
+    open_block). If there isn't one, or it's from somewhere else or an
+    older version of this file, we compile it first.'''
+    blk_file = splitext(yaml_file)[0] + '.blk'
+    if exists(blk_file):
+        try:
+            block = CompiledBlock(blk_file)
+        except BlockError:
+            # An older version - we'll replace it
+            block = None
+        if block is not None:
+            if [abspath(source) for source in block.source_paths()[:2]] == \
+                    [abspath(yaml_file), abspath(kern_file)]:
+                return up_to_date(block)
+            block.close()
+
+    compile_block(yaml_file, kern_file, blk_file)
+
+    return CompiledBlock(blk_file)
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    if len(argv) < 2:
+        print "usage: ./block_compiler.py <block>.yaml [<block>.yaml ...]"
+        print "   e.g. ./block_compiler.py subject01/*/*.yaml"
+        exit(1)
+
+    for yaml_file in argv[1:]:
+        try:
+            blk_file = compile_block(yaml_file)
+        except BlockError, e:
+            print e
+            exit(1)
+        print 'wrote', blk_file
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+'''calibrate_display.py
+
+Measure how this machine's display really behaves (see cognac.DisplayProfile)
+and save a profile that numeric_questions_fast.py picks up. Run it with the
+same VisionEgg settings (screen, refresh, etc.) that you run experiments
+with, and again whenever you change them. Those settings get saved in the
+profile too, and from then on numeric_questions_fast.py uses them directly,
+without the VisionEgg configuration dialog.'''
+
+import VisionEgg
+from VisionEgg.Text import Text
+
+from cognac.SimpleVisionEgg import SimpleVisionEgg
+from cognac.DisplayProfile import DisplayProfile, measure
+
+
+def calibrate(frames=3000):
+    vision_egg = SimpleVisionEgg()
+    xlim, ylim = vision_egg.screen.size
+    # Something on the screen, so we're actually drawing
+    message = Text(text='Calibrating display...', anchor='center',
+                   position=(xlim/2, ylim/2), color=(0,0,0), font_size=55)
+    vision_egg.set_stimuli([message])
+
+    ifis = measure(vision_egg, frames)
+    vision_egg.quit()
+
+    profile = DisplayProfile.from_ifis(ifis,
+                                VisionEgg.config.VISIONEGG_MONITOR_REFRESH_HZ)
+    profile.screen = DisplayProfile.screen_config(VisionEgg.config)
+
+    return profile
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    if len(argv) > 3:
+        print "usage: ./calibrate_display.py [<frames> [<profile file>]]"
+        exit(1)
+
+    frames = 3000
+    if len(argv) > 1:
+        frames = int(argv[1])
+    fname = None
+    if len(argv) > 2:
+        fname = argv[2]
+
+    profile = calibrate(frames)
+    print profile.summary()
+    print 'wrote', profile.save(fname)
@@ -0,0 +1,256 @@
+"""Adaptive.py picks the next trial's kernel while the current one is running.
+
+An adaptive block chooses each kernel from how the participant has done so
+far - but the choice can't happen on the render thread, and it can't wait
+until the last response of the current trial either, as the next trial
+starts on the very next frame. So an AdaptiveSelector plans ahead, in a
+worker process:
+
+    - when trial n starts, the worker already has everything up to n - 1,
+      and works out what trial n + 1 should be for each way trial n could
+      turn out (each surprise rating, say) - that's a plan
+    - when trial n is logged, StimController tells us (trial_done), and
+      picking trial n + 1 is just a dict lookup in the plan for n's outcome
+
+So the worker has a whole trial's worth of time to do however much work the
+model needs. If a plan still isn't ready (or doesn't cover what happened),
+we take the next candidate in the order file, and log that we did, rather
+than hold up the frame. Once a condition's kernels are all used (an order
+file can list a code twice), its candidates are the ones used least.
+
+The choices only depend on the seed, so a block with the same seed makes
+the same ones on any machine.
+
+A model needs to pickle (it goes to the worker), and have:
+
+    outcome(row) - what we branch on, from a logged row (hashable)
+    outcomes(code, condition) - everything outcome could be for that trial
+    update(code, outcome) - learn from a trial
+    choose(candidates, rng) - the code to use next
+
+SurpriseModel is one of those."""
+
+import copy
+from hashlib import md5
+import math
+import multiprocessing as mp
+import random
+import Queue
+
+
+class SurpriseModel:
+    '''Learns how surprising each order of magnitude is, and goes for the
+    kernels we know least about.
+
+    Surprise ratings (1-3) for kernels whose value is in the same power of 10
+    share a Dirichlet posterior. We choose by Thompson sampling: draw the
+    chance of a 3 for each candidate's group from its posterior, and take
+    the biggest. Trials without a surprise rating don't teach us anything.'''
+    ratings = ('1', '2', '3')
+    prior = 1.0
+    # Which conditions get rated - see PresentKernel
+    rated = ('I', 'EI')
+
+    def __init__(self, values):
+        '''values is kernel code -> value (a float)'''
+        self.groups = dict((code, self.group(value))
+                           for code, value in values.iteritems())
+        # group -> {rating: count}
+        self.counts = {}
+
+    def group(self, value):
+        if not value:
+            return 0
+        return int(math.floor(math.log10(abs(value))))
+
+    def outcome(self, row):
+        response = row.get('surprise.response')
+        if response is None:
+            return None
+        # The keypad gives us '[3]'
+        return response.strip('[]')
+
+    def outcomes(self, code, condition):
+        if condition in self.rated:
+            return self.ratings + (None,)
+        return (None,)
+
+    def update(self, code, outcome):
+        if outcome not in self.ratings:
+            return
+        counts = self.counts.setdefault(self.groups[code], {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    def choose(self, candidates, rng):
+        best = None
+        best_draw = -1.0
+        for code in candidates:
+            counts = self.counts.get(self.groups[code], {})
+            high = counts.get('3', 0) + self.prior
+            rest = sum(counts.values()) - counts.get('3', 0) + \
+                   self.prior * (len(self.ratings) - 1)
+            draw = rng.betavariate(high, rest)
+            if draw > best_draw:
+                best, best_draw = code, draw
+
+        return best
+
+
+class Planner:
+    '''The worker's side - kept separate from the process stuff so you can
+    try it out directly'''
+
+    def __init__(self, model, codes, conditions, seed=None):
+        '''codes is the block's kernel codes, with the condition each one is
+        run in (code -> condition) - conditions is the condition for each
+        trial, in order'''
+        self.model = model
+        self.codes = codes
+        self.conditions = conditions
+        self.seed = seed
+        self.used = []
+
+    def candidates(self, n, used):
+        '''Codes we could use for trial n, in a stable order - the ones in its
+        condition that aren't in used yet, or if there aren't any, the ones
+        used least (from its condition, if it has any codes at all)'''
+        condition = self.conditions[n]
+        pool = [code for code in sorted(self.codes)
+                    if self.codes[code] == condition]
+        fresh = [code for code in pool if code not in used]
+        if fresh:
+            return fresh
+
+        if not pool:
+            pool = sorted(self.codes)
+        counts = dict((code, 0) for code in pool)
+        for code in used:
+            if code in counts:
+                counts[code] += 1
+        fewest = min(counts.values())
+        return [code for code in pool if counts[code] == fewest]
+
+    def rng(self, n):
+        # Plans come out the same whenever (and wherever) they're made -
+        # hash() isn't the same on every machine
+        return random.Random(int(md5('%s %d' % (self.seed, n)).hexdigest(),
+                                 16))
+
+    def first(self):
+        return self.model.choose(self.candidates(0, ()), self.rng(0))
+
+    def start(self, n, code):
+        '''Trial n is code - returns the plan for trial n + 1 (outcome ->
+        code), or None if there isn't one'''
+        self.used.append(code)
+        if n + 1 >= len(self.conditions):
+            return None
+        candidates = self.candidates(n + 1, self.used)
+        if not candidates:
+            return None
+
+        plan = {}
+        for outcome in self.model.outcomes(code, self.conditions[n]):
+            model = copy.deepcopy(self.model)
+            model.update(code, outcome)
+            plan[outcome] = model.choose(candidates, self.rng(n + 1))
+
+        return plan
+
+    def done(self, n, outcome):
+        self.model.update(self.used[n], outcome)
+
+
+def plan_worker(planner, requests, plans, child_setup=None):
+    if child_setup is not None:
+        child_setup()
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        kind, n, value = request
+        if kind == 'start':
+            plans.put((n + 1, planner.start(n, value)))
+        elif kind == 'done':
+            planner.done(n, value)
+
+
+class AdaptiveSelector:
+    '''Give this to StimController as both its trials and its selector.
+
+    make(condition, n) gives us an empty trial for trial n, and fill(trial,
+    code, n) puts kernel code in it (calling its reset). We log which kernel
+    each trial got, and whether it came from a plan.'''
+    # Something to call first thing in the worker, like Recording's
+    child_setup = None
+
+    def __init__(self, model, codes, conditions, make, fill, seed=None):
+        self.planner = Planner(model, codes, conditions, seed)
+        self.conditions = conditions
+        self.make = make
+        self.fill = fill
+        self.model = model
+
+        self.trials = []
+        self.codes = []
+        self.plans = {}
+        self.requests = self.results = self.worker = None
+
+    def __len__(self):
+        return len(self.conditions)
+
+    def start(self):
+        self.requests = mp.Queue()
+        self.results = mp.Queue()
+        self.worker = mp.Process(target=plan_worker,
+                                 args=(self.planner, self.requests,
+                                       self.results, self.child_setup))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def close(self):
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join(5)
+            self.worker = None
+
+    def __iter__(self):
+        if self.worker is None:
+            self.start()
+        for n, condition in enumerate(self.conditions):
+            trial = self.make(condition, n)
+            self.trials.append(trial)
+            if n == 0:
+                # Nothing's on the screen yet, so we can take our time
+                self.use(trial, 0, self.planner.first(), True)
+            yield trial
+
+    def use(self, trial, n, code, planned):
+        self.fill(trial, code, n)
+        trial.log['kernel'] = code
+        trial.log['kernel_planned'] = planned
+        self.codes.append(code)
+        self.requests.put(('start', n, code))
+
+    def trial_done(self, trial, row):
+        '''StimController calls this as each trial is logged, and before the
+        next one starts'''
+        n = len(self.codes) - 1
+        outcome = self.model.outcome(row)
+        self.requests.put(('done', n, outcome))
+        if n + 1 >= len(self.conditions):
+            return
+
+        while True:
+            try:
+                plan_n, plan = self.results.get_nowait()
+            except Queue.Empty:
+                break
+            self.plans[plan_n] = plan
+
+        plan = self.plans.pop(n + 1, None)
+        if plan is not None and outcome in plan:
+            self.use(self.trials[n + 1], n + 1, plan[outcome], True)
+        else:
+            self.use(self.trials[n + 1], n + 1,
+                     self.planner.candidates(n + 1, self.codes)[0], False)
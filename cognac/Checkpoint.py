@@ -0,0 +1,134 @@
+"""Checkpoint.py saves where a block has got to after every trial.
+
+If numeric_questions_fast.py crashes (or the participant bails) on trial 25,
+we don't want to run the whole block again. StimController saves a
+Checkpoint after each trial: how many trials are done, the log rows so far,
+the files (recordings) those trials made, and what t the next trial would
+have started at. To resume, build the same trial list, skip the ones that
+are done, and hand the checkpoint to StimController.resume - the rows we
+already had go back in the log, and t carries on from where it was, so the
+log comes out the same as if we'd never stopped.
+
+Rewriting everything after every trial gets slower as the block goes on,
+and it happens between one trial's last frame and the next one's first. So
+the checkpoint file is a journal: a snapshot of the whole state, followed by
+one small pickle per trial with just what's new (its rows, its files, and
+the new trials_done and t). Every compact_every trials we write a fresh
+snapshot instead - to a temporary file that's renamed over the checkpoint,
+so a crash in the middle of that leaves the last one intact. A crash in the
+middle of appending leaves a partial record at the end, which load skips."""
+
+import cPickle as pickle
+import os
+from os.path import exists
+
+
+class Checkpoint:
+    path = None
+    # So we don't resume the wrong block
+    block = None
+    num_trials = 0
+    # Trials between snapshots
+    compact_every = 50
+
+    def __init__(self, path, block=None, num_trials=0):
+        self.path = path
+        self.block = block
+        self.num_trials = num_trials
+        # Rows don't change once they're written, so we keep them rather
+        # than getting them all out of the TrialLog every time
+        self.rows = []
+        # The checkpoint file we append records to (None until we've written
+        # a snapshot), how many files it has, and how many records are after
+        # the snapshot
+        self.journal = None
+        self.num_files = 0
+        self.records = 0
+
+    def save(self, stim_control, t):
+        trial_log = stim_control.trial_log
+        new_rows = []
+        for row in range(len(self.rows), stim_control.curr_row):
+            new_rows.append(trial_log.row(row))
+        self.rows.extend(new_rows)
+
+        if self.journal is None or self.records >= self.compact_every:
+            self.snapshot(stim_control.trials_done, stim_control.files, t)
+            return
+
+        record = {'trials_done': stim_control.trials_done,
+                  'rows': new_rows,
+                  'files': stim_control.files[self.num_files:],
+                  't': t}
+        pickle.dump(record, self.journal, pickle.HIGHEST_PROTOCOL)
+        # We don't fsync - that's for power cuts, and it could cost us a
+        # frame. Once it's flushed, it survives a crash.
+        self.journal.flush()
+        self.num_files = len(stim_control.files)
+        self.records += 1
+
+    def snapshot(self, trials_done, files, t):
+        '''Write the whole state, and start appending records after it'''
+        self.close()
+        state = {'block': self.block,
+                 'num_trials': self.num_trials,
+                 'trials_done': trials_done,
+                 'rows': self.rows,
+                 'files': files,
+                 't': t}
+        tmp_path = self.path + '.tmp'
+        f = open(tmp_path, 'wb')
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+        # No fsync here either (see save) - the rename is enough to survive
+        # a crash
+        os.rename(tmp_path, self.path)
+
+        self.journal = open(self.path, 'ab')
+        self.num_files = len(files)
+        self.records = 0
+
+    def load(self):
+        '''The saved state (a dict), or None if there isn't one. If it's for
+        a different block, that's a ValueError.'''
+        if not exists(self.path):
+            return None
+        f = open(self.path, 'rb')
+        try:
+            state = pickle.load(f)
+            state['files'] = list(state['files'])
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception:
+                    # The one we were appending when we crashed
+                    break
+                state['rows'].extend(record['rows'])
+                state['files'].extend(record['files'])
+                state['trials_done'] = record['trials_done']
+                state['t'] = record['t']
+        finally:
+            f.close()
+        if (state['block'], state['num_trials']) != \
+                (self.block, self.num_trials):
+            raise ValueError('%s is for %s (%d trials), not %s (%d trials)' %
+                             (self.path, state['block'], state['num_trials'],
+                              self.block, self.num_trials))
+        self.rows = state['rows']
+        # The next save writes a new snapshot, rather than appending to a
+        # file that might end in half a record
+        self.close()
+
+        return state
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def remove(self):
+        self.close()
+        if exists(self.path):
+            os.remove(self.path)
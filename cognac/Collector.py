@@ -0,0 +1,360 @@
+"""Collector.py gathers the logs from all of our testing stations in one place,
+as they're being written.
+
+Each station has a CollectorClient, which StimController hands every row as
+soon as its trial is done (and the experiment script can send other things,
+like recording file names). The client sends them from a background thread,
+so the display loop never waits on the network, and keeps sending anything
+that hasn't been acknowledged until it is.
+
+The Collector is a little asyncore server (we're on python 2, so no asyncio)
+that any number of clients can talk to at once. It writes messages in
+batches, one JSON object per line, to <store_dir>/<cohort>.jsonl, and only
+acknowledges them once they're written. Every message has a (station,
+session, seq) that's unique, so when a client sends something again because
+an acknowledgement got lost, we just acknowledge it again.
+
+The wire protocol is a JSON object per line from the client, and
+"ack <session> <seq>" lines back. A {"type": "status"} message gets a line of
+JSON back with what we've heard from each station - see collect_logs.py
+--status.
+
+Run collect_logs.py for the server."""
+
+import asyncore
+import asynchat
+import json
+import os
+from os.path import join, exists
+import select
+import socket
+import threading
+import time
+import Queue
+
+
+DEFAULT_PORT = 8642
+
+
+def message_key(msg):
+    return (msg['station'], msg['session'], msg['seq'])
+
+
+def ack_line(session, seq):
+    # session comes out of json as unicode, which asynchat would send as
+    # whatever python has in memory
+    return str('ack %s %d\n' % (session, seq))
+
+
+def read_store(fname):
+    '''The messages in a store file, in the order they were written'''
+    for line in open(fname):
+        if line.strip():
+            yield json.loads(line)
+
+
+def store_logs(fname):
+    '''{(station, block, session): [row dicts, in order]} from a store file'''
+    logs = {}
+    for msg in read_store(fname):
+        if msg['type'] == 'row':
+            log = logs.setdefault((msg['station'], msg['block'],
+                                   msg['session']), {})
+            log[msg['row']] = msg['data']
+
+    return dict((k, [log[row] for row in sorted(log)])
+                    for k, log in logs.iteritems())
+
+
+class CollectorChannel(asynchat.async_chat):
+    '''One connection to a client'''
+
+    def __init__(self, sock, collector):
+        asynchat.async_chat.__init__(self, sock, map=collector.map)
+        self.collector = collector
+        self.buffer = []
+        self.set_terminator('\n')
+
+    def collect_incoming_data(self, data):
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self.buffer)
+        self.buffer = []
+        try:
+            msg = json.loads(line)
+        except ValueError:
+            self.push('error bad message\n')
+            return
+
+        self.collector.receive(msg, self)
+
+    def handle_close(self):
+        self.collector.forget(self)
+        self.close()
+
+
+class Collector(asyncore.dispatcher):
+    store_dir = None
+    batch_size = 100
+    # seconds we'll sit on a partial batch
+    flush_interval = 1.0
+    # cohort -> list of JSON lines to write
+    pending = None
+    # (channel, (session, seq)) to acknowledge once pending is written
+    acks = None
+    # message_keys we've written to a store
+    seen = None
+    # message_keys in pending, which we haven't written yet
+    unwritten = None
+    # station -> dict of what we last heard from it
+    progress = None
+    last_flush = 0
+
+    def __init__(self, store_dir, host='localhost', port=DEFAULT_PORT,
+                 batch_size=None, flush_interval=None):
+        # Our own socket map, so a Collector can share a process with other
+        # asyncore users
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.store_dir = store_dir
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        self.pending = {}
+        self.acks = []
+        self.seen = set()
+        self.unwritten = set()
+        self.progress = {}
+
+        if not exists(store_dir):
+            os.makedirs(store_dir)
+        for fname in os.listdir(store_dir):
+            if fname.endswith('.jsonl'):
+                for msg in read_store(join(store_dir, fname)):
+                    self.seen.add(message_key(msg))
+                    self.update_progress(msg)
+
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(5)
+        self.last_flush = time.time()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            CollectorChannel(pair[0], self)
+
+    def store_file(self, cohort):
+        # Cohort names become file names, so we keep them tame
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_'
+                       for c in cohort)
+        return join(self.store_dir, safe + '.jsonl')
+
+    def update_progress(self, msg):
+        station = self.progress.setdefault(msg['station'], {'rows': 0})
+        station['cohort'] = msg['cohort']
+        station['block'] = msg['block']
+        station['last_type'] = msg['type']
+        station['last_time'] = msg.get('time')
+        if msg['type'] == 'row':
+            station['rows'] += 1
+            station['last_row'] = msg['row']
+
+    def receive(self, msg, channel):
+        if msg.get('type') == 'status':
+            channel.push(json.dumps(self.progress) + '\n')
+            return
+
+        try:
+            key = message_key(msg)
+            cohort = msg['cohort']
+        except KeyError:
+            channel.push('error incomplete message\n')
+            return
+
+        if key in self.seen:
+            # A retry of something we've already written
+            channel.push(ack_line(*key[1:]))
+            return
+        if key in self.unwritten:
+            # A retry of something we've got, but not written yet (say the
+            # station reconnected, and we forgot its old channel) - it gets
+            # its ack with everything else, once it's written
+            self.acks.append((channel, key[1:]))
+            return
+
+        self.unwritten.add(key)
+        self.update_progress(msg)
+        self.pending.setdefault(cohort, []).append(json.dumps(msg))
+        self.acks.append((channel, key[1:]))
+        if len(self.acks) >= self.batch_size:
+            self.flush()
+
+    def forget(self, channel):
+        '''channel's gone - it'll have to retry anything we haven't acked'''
+        self.acks = [(c, ack) for c, ack in self.acks if c is not channel]
+
+    def flush(self):
+        for cohort, lines in self.pending.iteritems():
+            f = open(self.store_file(cohort), 'a')
+            f.write('\n'.join(lines) + '\n')
+            f.close()
+        self.pending.clear()
+        self.seen.update(self.unwritten)
+        self.unwritten.clear()
+
+        for channel, ack in self.acks:
+            channel.push(ack_line(*ack))
+        self.acks = []
+        self.last_flush = time.time()
+
+    def serve(self, duration=None):
+        '''Handle clients for duration seconds (or forever)'''
+        stop = None
+        if duration is not None:
+            stop = time.time() + duration
+        try:
+            while stop is None or time.time() < stop:
+                asyncore.loop(timeout=self.flush_interval / 4, count=1,
+                              map=self.map)
+                if self.acks and \
+                        time.time() - self.last_flush >= self.flush_interval:
+                    self.flush()
+        finally:
+            if self.acks:
+                self.flush()
+
+    def shutdown(self):
+        if self.acks:
+            self.flush()
+        for channel in self.map.values():
+            channel.close()
+
+
+class CollectorClient:
+    '''Sends messages to a Collector at address, a (host, port)
+
+    Everything happens in a background thread - send just puts things on a
+    queue. If we can't connect, or the connection goes away, we keep trying
+    every retry_interval, and send everything that hasn't been acknowledged
+    yet.'''
+    address = None
+    station = None
+    cohort = None
+    block = None
+    session = None
+    seq = 0
+    retry_interval = 1.0
+    # (session, seq) -> JSON line, only touched by the background thread
+    unacked = None
+    # Keeps going until close
+    thread = None
+    # Something to call first thing in the thread, like Recording's
+    # child_setup (e.g. cognac.RealTime.RealTime.child_setup)
+    thread_setup = None
+
+    def __init__(self, address, station=None, cohort='default',
+                 retry_interval=None, thread_setup=None):
+        self.address = address
+        if station is None:
+            station = socket.gethostname()
+        self.station = station
+        self.cohort = cohort
+        if retry_interval is not None:
+            self.retry_interval = retry_interval
+        self.thread_setup = thread_setup
+        self.queue = Queue.Queue()
+        self.unacked = {}
+        self.sock = None
+        self.received = ''
+
+        self.start_block('')
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def start_block(self, block):
+        '''Everything after this is for block - the session keeps reruns of a
+        block apart'''
+        self.block = block
+        self.session = '%.6f' % time.time()
+        self.seq = 0
+
+    def send(self, kind, data, **extra):
+        self.seq += 1
+        msg = {'type': kind, 'station': self.station, 'cohort': self.cohort,
+               'block': self.block, 'session': self.session, 'seq': self.seq,
+               'time': time.time(), 'data': data}
+        msg.update(extra)
+        self.queue.put(((self.session, self.seq), json.dumps(msg)))
+
+    def send_row(self, row, data):
+        '''StimController calls this with each row of its TrialLog'''
+        self.send('row', data, row=row)
+
+    def send_recording(self, fname, **data):
+        data['fname'] = fname
+        self.send('recording', data)
+
+    def close(self, timeout=None):
+        '''Wait up to timeout seconds for everything to be acknowledged'''
+        self.queue.put(None)
+        self.thread.join(timeout)
+        return not self.thread.isAlive()
+
+    ## Everything below here runs in the background thread
+
+    def run(self):
+        if self.thread_setup is not None:
+            self.thread_setup()
+        closing = False
+        while not (closing and not self.unacked):
+            try:
+                item = self.queue.get(timeout=self.retry_interval / 4)
+            except Queue.Empty:
+                item = False
+
+            if item is None:
+                closing = True
+            elif item:
+                key, line = item
+                self.unacked[key] = line
+
+            try:
+                if self.sock is None:
+                    self.connect()
+                elif item:
+                    self.sock.sendall(line + '\n')
+                self.read_acks()
+            except socket.error:
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                time.sleep(self.retry_interval)
+
+        if self.sock is not None:
+            self.sock.close()
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address,
+                                             self.retry_interval)
+        self.received = ''
+        for key in sorted(self.unacked):
+            self.sock.sendall(self.unacked[key] + '\n')
+
+    def read_acks(self):
+        while select.select([self.sock], [], [], 0)[0]:
+            data = self.sock.recv(4096)
+            if not data:
+                raise socket.error('collector hung up')
+            self.received += data
+
+        lines = self.received.split('\n')
+        self.received = lines.pop()
+        for line in lines:
+            if line.startswith('ack '):
+                session, seq = line[4:].split()
+                self.unacked.pop((session, int(seq)), None)
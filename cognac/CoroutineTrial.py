@@ -0,0 +1,205 @@
+"""CoroutineTrial.py lets you write a trial as a script, instead of a schedule.
+
+A regular Trial is a fixed list of Events, and every frame we check every
+event's start and stop times, and poll the current Response. That's fine for
+a fixed sequence, but anything adaptive means building Trials on the fly.
+Here a trial is a generator function that gets the trial (plus whatever
+arguments you gave) and yields what it's waiting for:
+
+    def staircase(trial, level):
+        trial.show(instruction, text='READY?')
+        yield Delay(0.5)
+        trial.show(value, text=str(level.value))
+        response = yield Respond(Response('guess', limit=('1', '2')),
+                                 timeout=2.0)
+        trial.hide(value)
+        if response.response == '1':
+            level.value *= 2
+            trial.show(instruction, text='HIGHER')
+            yield Delay(1.0)
+
+    trials = [CoroutineTrial(staircase, level) for i in range(20)]
+
+Python 2 has no async/await, so this is the generator version of it: yield
+is await, and Delay and Respond are what you can await. A Respond evaluates
+to its Response - if it timed out, response is None and rt is how long it
+waited, just like a Response whose timelimit runs out.
+Everything you show is hidden again when the script ends, and the trial is
+done when the script is.
+
+Nothing happens on a frame unless something is due: a Delay is one
+comparison against its wake-up time, and we don't walk a list of events.
+While you're waiting on a Respond, its record_response gets called each
+frame, as it would in a regular Trial - that's the only way to hear about
+key presses, and it means Responses that override it work here too. A
+timeout is just a wake-up time. It all runs
+inside StimController's usual loop, so these mix with regular Trials, get
+logged the same way and work with Telemetry, Replay and checkpoints."""
+
+from cognac.StimController import Trial
+
+
+class Delay(object):
+    '''Wait for seconds (from when you yield it)'''
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+
+class Respond(object):
+    '''Wait for response (a cognac.StimController.Response) - or timeout
+    seconds, if you give one. It goes in the log under its label, like any
+    other Response.'''
+    __slots__ = ('response', 'timeout')
+
+    def __init__(self, response, timeout=None):
+        self.response = response
+        if timeout is None:
+            timeout = response.timelimit
+        self.timeout = timeout
+
+
+class CoroutineTrial(Trial):
+    __slots__ = (
+        'script',
+        'args',
+        # The running script - None until our first frame
+        'coroutine',
+        # When we go on with the script (None if we're waiting on a
+        # response with no timeout) and what we go on with
+        'wake_time',
+        'resume_value',
+        'finished',
+        # Everything we've shown, so we can hide it when we're done
+        'shown',
+        # The responses we've used, so reset can reset them
+        'responses',
+        # The batch for this frame, and when the script started
+        'batch',
+        'start_time',
+        )
+
+    def __init__(self, script, *args, **kwargs):
+        '''script gets called as script(trial, *args) each time we run. Give
+        unlogged=True to leave this trial out of the log.'''
+        self.script = script
+        self.args = args
+        self.responses = []
+        Trial.__init__(self, [], kwargs.get('unlogged'))
+
+    def reset(self):
+        for response in self.responses:
+            response.reset()
+        Trial.reset(self)
+        self.coroutine = None
+        self.wake_time = None
+        self.resume_value = None
+        self.finished = False
+        self.shown = []
+        self.batch = None
+        self.start_time = None
+
+    ## What you use in your script
+
+    def show(self, target, **parms):
+        '''Turn target on (and set any other parms you give)'''
+        parms.setdefault('on', True)
+        self._set(target, parms)
+        if target not in self.shown:
+            self.shown.append(target)
+
+    def hide(self, target):
+        self._set(target, {'on': False})
+        if target in self.shown:
+            self.shown.remove(target)
+
+    def _set(self, target, parms):
+        if self.batch is not None:
+            self.batch.set(target, parms)
+        else:
+            target.set(**parms)
+
+    ## What StimController calls
+
+    def deactivate_events(self, t, batch=None):
+        pass
+
+    def log_response(self, t):
+        response = self.curr_response
+        if response is not None and response.record_response(t):
+            self.curr_response = None
+            self.resume_value = response
+            # We go on this frame (in activate_events)
+            self.wake_time = t
+
+    def activate_events(self, t, batch=None):
+        if self.finished:
+            return
+        if self.coroutine is None:
+            self.coroutine = self.script(self, *self.args)
+            self.start_time = t
+            self.wake_time = t
+        if self.wake_time is None or not self.due(t):
+            return
+
+        if self.curr_response is not None:
+            # We timed out
+            response = self.curr_response
+            response.expire(t)
+            self.curr_response = None
+            self.resume_value = response
+
+        self.batch = batch
+        try:
+            while self.wake_time is not None and self.due(t):
+                value = self.resume_value
+                self.resume_value = None
+                self.wake_time = None
+                try:
+                    self.wait(self.coroutine.send(value), t)
+                except StopIteration:
+                    self.finish()
+        finally:
+            self.batch = None
+
+    def due(self, t):
+        '''Like Trial.event_ready - with a frame_period, we count whole
+        frames from when the script started, so a Delay lands on the closest
+        flip'''
+        if self.frame_period is None:
+            return t >= self.wake_time
+        return round((t - self.start_time) / self.frame_period) >= \
+               round((self.wake_time - self.start_time) / self.frame_period)
+
+    def wait(self, command, t):
+        if isinstance(command, Delay):
+            self.wake_time = t + command.seconds
+        elif isinstance(command, Respond):
+            response = command.response
+            if response not in self.responses:
+                self.responses.append(response)
+            response.reset()
+            # Make sure we only get presses from now on
+            response.device.clear()
+            response.ref_time = t
+            self.log[response.label] = response
+            self.curr_response = response
+            if command.timeout is not None:
+                self.wake_time = t + command.timeout
+        else:
+            raise TypeError('CoroutineTrial scripts can only yield Delay or '
+                            'Respond, not %r' % (command,))
+
+    def finish(self):
+        for target in self.shown:
+            self._set(target, {'on': False})
+        self.shown = []
+        self.finished = True
+        self.curr_response = None
+
+    def done(self):
+        return self.finished
+
+    def prepare(self):
+        pass
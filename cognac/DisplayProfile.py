@@ -0,0 +1,261 @@
+"""DisplayProfile.py keeps track of how a machine's display actually behaves.
+
+VisionEgg.log keeps telling us that we measured 58.97 Hz while
+VISIONEGG_MONITOR_REFRESH_HZ says 60, and that it can't sync to vblank. So we
+measure: calibrate_display.py draws a few thousand frames, and we look at the
+distribution of inter-frame intervals (IFIs). If swaps are locked to vsync,
+nearly every IFI is the refresh period (or a multiple of it, when we drop
+one). Otherwise the IFIs are just however long drawing took, which is usually
+short and all over the place.
+
+The result gets saved as a little YAML file per machine. Give it to a
+StimController, and it'll schedule in whole frames (if we're vsync-locked),
+and use a TimingWatch to warn when a block's timing is a lot worse than it
+was at calibration.
+
+The profile also keeps the VisionEgg settings we calibrated with (screen
+size, fullscreen, etc.). apply() puts those straight into VisionEgg.config
+and turns off the configuration dialog, so a machine that's been calibrated
+starts up with exactly the settings its timing was measured with, and
+without waiting on anyone to click OK. Profiles saved before we kept the
+settings still get the dialog (with a warning to recalibrate), as we don't
+know what the screen should be."""
+
+import socket
+import time
+from warnings import warn
+from os import environ, makedirs
+from os.path import exists, expanduser, dirname, join
+
+import numpy as np
+import yaml
+
+
+def default_path():
+    '''NUMERICVID_DISPLAY_PROFILE, or a file for this machine in
+    ~/.numericvid'''
+    try:
+        return environ['NUMERICVID_DISPLAY_PROFILE']
+    except KeyError:
+        return join(expanduser('~'), '.numericvid',
+                    'display-%s.yaml' % socket.gethostname())
+
+
+def measure(vision_egg, frames=3000, warmup=30):
+    '''Draw frames frames with vision_egg (a SimpleVisionEgg with its stimuli
+    set) and return the IFIs in seconds. We skip the first warmup frames, as
+    things are still getting going.'''
+    times = []
+
+    def update(t):
+        times.append(t)
+        if len(times) > warmup + frames:
+            vision_egg.pause()
+
+    vision_egg.set_functions(update=update)
+    vision_egg.go()
+
+    return np.diff(times[warmup:])
+
+
+class DisplayProfile:
+    '''What we found out about a display - mostly just plain attributes, so
+    that it reads easily as YAML'''
+    hostname = None
+    # When we measured, as a string
+    measured = None
+    frames = 0
+    # The typical IFI - this is what StimController schedules with
+    frame_period = None
+    refresh_hz = None
+    mean_ifi = None
+    ifi_sd = None
+    longest_ifi = None
+    # Fraction of frames that took more than 1.5 frame_periods
+    long_frame_rate = None
+    vsync_locked = False
+    # What VisionEgg thought the refresh was
+    nominal_hz = None
+    # The VisionEgg.config settings we calibrated with (name -> value)
+    screen = None
+
+    fields = ('hostname', 'measured', 'frames', 'frame_period', 'refresh_hz',
+              'mean_ifi', 'ifi_sd', 'longest_ifi', 'long_frame_rate',
+              'vsync_locked', 'nominal_hz', 'screen')
+
+    # The settings that make a difference to the display - anything else
+    # (logging, etc.) is up to whoever's running things
+    screen_settings = ('VISIONEGG_SCREEN_W', 'VISIONEGG_SCREEN_H',
+                       'VISIONEGG_FULLSCREEN', 'VISIONEGG_FRAMELESS_WINDOW',
+                       'VISIONEGG_HIDE_MOUSE', 'VISIONEGG_PREFERRED_BPP',
+                       'VISIONEGG_REQUEST_RED_BITS',
+                       'VISIONEGG_REQUEST_GREEN_BITS',
+                       'VISIONEGG_REQUEST_BLUE_BITS',
+                       'VISIONEGG_REQUEST_ALPHA_BITS',
+                       'VISIONEGG_SYNC_SWAP', 'VISIONEGG_MONITOR_REFRESH_HZ')
+
+    # No refresh goes faster than this, so anything shorter isn't synced
+    max_hz = 250.0
+
+    def __init__(self, **values):
+        for name, value in values.iteritems():
+            if name not in self.fields:
+                raise TypeError('DisplayProfile has no %s' % name)
+            setattr(self, name, value)
+
+    @classmethod
+    def screen_config(cls, config):
+        '''The settings from config (VisionEgg.config) that we keep'''
+        screen = {}
+        for name in cls.screen_settings:
+            if hasattr(config, name):
+                screen[name] = getattr(config, name)
+
+        return screen
+
+    @classmethod
+    def from_ifis(cls, ifis, nominal_hz=None):
+        ifis = np.asarray(ifis, dtype=float)
+        median = np.median(ifis)
+        # Vsync locked means a tight peak at a plausible refresh period - we
+        # allow for a few dropped frames, which land on multiples of it
+        near_median = np.abs(ifis - median) < 0.1 * median
+        locked = bool(median >= 1.0 / cls.max_hz and
+                      near_median.mean() >= 0.9)
+        # The mean of the IFIs in the peak is a better period than the median
+        frame_period = float(ifis[near_median].mean())
+
+        return cls(hostname=socket.gethostname(),
+                   measured=time.strftime('%Y-%m-%d %H:%M:%S'),
+                   frames=len(ifis),
+                   frame_period=frame_period,
+                   refresh_hz=1.0 / frame_period,
+                   mean_ifi=float(ifis.mean()),
+                   ifi_sd=float(ifis.std()),
+                   longest_ifi=float(ifis.max()),
+                   long_frame_rate=float((ifis > 1.5 * frame_period).mean()),
+                   vsync_locked=locked,
+                   nominal_hz=nominal_hz)
+
+    @classmethod
+    def load(cls, fname=None):
+        '''Returns None if there's no profile'''
+        if fname is None:
+            fname = default_path()
+        if not exists(fname):
+            return None
+
+        return cls(**yaml.safe_load(open(fname)))
+
+    def apply(self, config):
+        '''Set up config (VisionEgg.config) as we were at calibration, with
+        no configuration dialog - call this before getting the screen. If we
+        don't have the settings, the dialog stays.'''
+        if self.screen:
+            config.VISIONEGG_GUI_INIT = 0
+            for name, value in self.screen.iteritems():
+                setattr(config, name, value)
+        else:
+            warn('The display profile from %s has no screen settings - run '
+                 'calibrate_display.py again to skip the configuration '
+                 'dialog' % self.measured)
+        # We know better than whatever the refresh was set to
+        if self.vsync_locked and self.refresh_hz:
+            config.VISIONEGG_MONITOR_REFRESH_HZ = self.refresh_hz
+
+    def save(self, fname=None):
+        if fname is None:
+            fname = default_path()
+        if dirname(fname) and not exists(dirname(fname)):
+            makedirs(dirname(fname))
+        values = dict((name, getattr(self, name)) for name in self.fields)
+        yaml.safe_dump(values, open(fname, 'w'), default_flow_style=False)
+
+        return fname
+
+    def summary(self):
+        lines = ['%d frames: %.3f Hz (frame period %.2f ms), %s' %
+                    (self.frames, self.refresh_hz, 1e3 * self.frame_period,
+                     'vsync locked' if self.vsync_locked else
+                     'NOT vsync locked')]
+        lines.append('mean IFI %.2f ms, sd %.2f ms, longest %.2f ms, '
+                     '%.2f%% long frames' % (1e3 * self.mean_ifi,
+                        1e3 * self.ifi_sd, 1e3 * self.longest_ifi,
+                        100 * self.long_frame_rate))
+        if self.nominal_hz and \
+                abs(self.refresh_hz - self.nominal_hz) > 0.5:
+            lines.append('VISIONEGG_MONITOR_REFRESH_HZ is %.1f - you might '
+                         'set it to %.3f' % (self.nominal_hz,
+                                             self.refresh_hz))
+
+        return '\n'.join(lines)
+
+
+# What we take a frame to be on a machine that hasn't been calibrated
+uncalibrated_frame_period = 1 / 60.0
+
+def default_frame_period(fname=None):
+    '''The frame_period from this machine's profile, or
+    uncalibrated_frame_period if there isn't one - for anything that needs
+    to know how long a frame is and hasn't been told'''
+    profile = DisplayProfile.load(fname)
+    if profile is None or not profile.frame_period:
+        return uncalibrated_frame_period
+
+    return profile.frame_period
+
+
+class TimingWatch:
+    '''Keeps an eye on frame timing during a block, and compares it with the
+    profile. StimController calls frame every frame (it's just a bit of
+    arithmetic) and check between go's.'''
+    profile = None
+    # How much worse than calibration is worth a warning
+    long_frame_factor = 2.0
+    min_long_frame_rate = 0.01
+    period_tolerance = 0.02
+
+    frames = 0
+    long_frames = 0
+    total = 0.0
+    last_t = None
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.long_ifi = 1.5 * profile.frame_period
+
+    def frame(self, t):
+        if self.last_t is not None and t > self.last_t:
+            ifi = t - self.last_t
+            self.frames += 1
+            self.total += ifi
+            if ifi > self.long_ifi:
+                self.long_frames += 1
+        self.last_t = t
+
+    def check(self):
+        '''A list of warnings (hopefully empty) about the frames since the
+        last check - which also starts counting again'''
+        warnings = []
+        profile = self.profile
+        if self.frames:
+            rate = float(self.long_frames) / self.frames
+            allowed = max(self.long_frame_factor * profile.long_frame_rate,
+                          self.min_long_frame_rate)
+            if rate > allowed:
+                warnings.append('%.1f%% of frames were long (%.1f%% at '
+                                'calibration)' % (100 * rate,
+                                100 * profile.long_frame_rate))
+            mean = self.total / self.frames
+            if abs(mean - profile.frame_period) > \
+                    self.period_tolerance * profile.frame_period:
+                warnings.append('mean frame period was %.2f ms (%.2f ms at '
+                                'calibration)' % (1e3 * mean,
+                                1e3 * profile.frame_period))
+
+        self.frames = self.long_frames = 0
+        self.total = 0.0
+        self.last_t = None
+
+        return warnings
+
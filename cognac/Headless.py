@@ -0,0 +1,107 @@
+"""Headless.py has stand-ins for the display side of things, so that
+StimController, Trials and Responses can run with no window and no camera -
+as fast as the CPU allows, on a simulated clock.
+
+Responses still read pygame's event queue, so we start pygame with SDL's
+dummy video driver. Something has to put key events in there - see
+cognac.Replay."""
+
+import os
+
+import pygame
+
+
+class NullParameters:
+    pass
+
+
+class NullStim:
+    '''Stands in for a VisionEgg stimulus, or anything else we set(), like a
+    Recording. It just remembers its parameters.'''
+
+    def __init__(self, **parms):
+        self.parameters = NullParameters()
+        self.set(**parms)
+
+    def set(self, **parms):
+        self.parameters.__dict__.update(parms)
+
+
+class NullScreen:
+    size = (1024, 768)
+
+
+class HeadlessVisionEgg:
+    '''Enough of SimpleVisionEgg for a StimController
+
+    Every "frame", we call each of frame_hooks with t, then the update function,
+    and then move the clock on by frame_period. Like VisionEgg, t starts from 0
+    on each go.'''
+    frame_period = 1 / 60.0
+    screen = None
+    stimuli = None
+    update = None
+    pause_update = None
+    # Things to call at the start of every frame, before update
+    frame_hooks = None
+    # Frames since we were made, over all go's
+    frames = 0
+    running = False
+    # A cognac.RealTime.RealTime, if we're in real-time mode
+    realtime = None
+    # A cognac.Startup.StartupTrace, if we're timing startup
+    startup = None
+
+    def __init__(self, frame_period=None, display_profile=None, startup=None):
+        '''There's no display, so display_profile doesn't change anything'''
+        if frame_period is not None:
+            self.frame_period = frame_period
+        self.screen = NullScreen()
+        self.frame_hooks = []
+        self.startup = startup
+
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        pygame.display.init()
+        if startup:
+            startup.mark('screen')
+
+    def set_stimuli(self, stimuli, trigger=None, kb_controller=False):
+        self.stimuli = stimuli
+        if self.startup:
+            self.startup.mark('stimuli')
+
+    def set_functions(self, update=None, pause_update=None):
+        self.update = update
+        self.pause_update = pause_update
+
+    def set_realtime(self, realtime):
+        self.realtime = realtime
+        return realtime.setup()
+
+    def go(self, go_duration=('forever',)):
+        self.running = True
+        t = 0.0
+        if self.realtime:
+            self.realtime.start_go()
+        try:
+            while self.running:
+                for hook in self.frame_hooks:
+                    hook(t)
+                if self.startup and not self.frames:
+                    self.startup.mark('first frame')
+                if self.update:
+                    self.update(t)
+                self.frames += 1
+                t += self.frame_period
+        finally:
+            if self.realtime:
+                self.realtime.end_go()
+
+        if self.pause_update:
+            self.pause_update()
+
+    def pause(self):
+        self.running = False
+
+    def quit(self):
+        self.running = False
@@ -0,0 +1,85 @@
+"""KeyState.py post-processes the key samples from VisionEgg's
+KeyboardResponseController with NumPy.
+
+The controller gives us a list of the keys that are down at every sample, so a
+key held for a second at 1 kHz shows up 1000 times. We turn that into a boolean
+samples x keys matrix, and find where each key goes down and comes back up
+with a couple of vectorized diffs. A gap in the samples of more than
+min_interval counts as everything being released (the controller only
+records samples where something is down).
+
+Minutes of 1 kHz samples take milliseconds - comparing neighbouring samples
+happens inside numpy, and we only look at the keys in samples where
+something changed."""
+
+import numpy as np
+
+
+def _samples(responses):
+    '''A 1-d object array of the per-sample key lists. The trailing None
+    stops numpy from making a 2-d array of strings when every sample has the
+    same number of keys'''
+    return np.array(list(responses) + [None], dtype=object)[:-1]
+
+
+def change_points(responses, times, min_interval=2.0/60):
+    '''Indices of the samples where the list of keys changes, or that come
+    after a gap of more than min_interval'''
+    samples = _samples(responses)
+    changed = samples[1:] != samples[:-1]
+    gaps = np.diff(times) > min_interval
+
+    return np.flatnonzero(changed | gaps) + 1
+
+
+def key_matrix(responses):
+    '''Returns (key_names, down), where down is a boolean samples x keys
+    matrix, and key_names labels its columns'''
+    samples = _samples(responses)
+    if not len(samples):
+        return [], np.zeros((0, 0), dtype=bool)
+
+    # Keys are usually held for many samples, so we only look inside the
+    # first sample of each run of identical samples
+    new_run = np.ones(len(samples), dtype=bool)
+    new_run[1:] = samples[1:] != samples[:-1]
+    run_starts = np.flatnonzero(new_run)
+    patterns = samples[run_starts]
+
+    key_names = sorted(set(k for r in patterns for k in r))
+    index = dict((k, i) for i, k in enumerate(key_names))
+    rows = np.repeat(np.arange(len(patterns)), [len(r) for r in patterns])
+    cols = np.array([index[k] for r in patterns for k in r], dtype=int)
+    run_down = np.zeros((len(patterns), len(key_names)), dtype=bool)
+    run_down[rows, cols] = True
+
+    run_lengths = np.diff(np.append(run_starts, len(samples)))
+    return key_names, np.repeat(run_down, run_lengths, axis=0)
+
+
+def key_events(responses, times, time_to_subtract=0, min_interval=2.0/60):
+    '''Returns (key_names, keys, onsets, offsets), sorted by onset
+
+    keys indexes key_names, and onsets / offsets are the times of the first
+    and last samples of each press (all numpy arrays).'''
+    times = np.asarray(times, dtype=float) - time_to_subtract
+    if not len(responses):
+        empty = np.zeros(0)
+        return [], np.zeros(0, dtype=int), empty, empty
+
+    key_names, down = key_matrix(responses)
+    # still_down[i] - is down[i] part of the same press as down[i + 1]?
+    joined = (np.diff(times) <= min_interval)[:, None]
+    no_keys = np.zeros((1, len(key_names)), dtype=bool)
+    still_down = np.vstack((down[:-1] & down[1:] & joined, no_keys))
+    was_down = np.vstack((no_keys, still_down[:-1]))
+
+    # np.nonzero goes in row order, so transposing gives us each key's
+    # presses together and in order - making onsets and offsets line up
+    keys, on_samples = np.nonzero((down & ~was_down).T)
+    off_samples = np.nonzero((down & ~still_down).T)[1]
+
+    order = np.argsort(on_samples, kind='mergesort')
+
+    return (key_names, keys[order], times[on_samples[order]],
+            times[off_samples[order]])
@@ -0,0 +1,435 @@
+"""Mirror.py shows the experimenter what the participant sees, from another
+process.
+
+A second Viewport would mean drawing everything twice, on the participant's
+frame. Instead, like cognac.Telemetry, we publish to memory-mapped files
+(usually in /dev/shm) and let someone else do the drawing:
+
+    - a Mirror, which StimController hands each frame, snapshots the screen
+      every interval seconds (10 times a second, say) and publishes it, a
+      good deal smaller, with the trial state (row, condition, the response
+      we're waiting on and what's been typed)
+    - a Recording can publish what the camera sees the same way, from its
+      own process (see visionegg_cam_capture.py)
+
+mirror_view.py puts them both up in a window.
+
+The participant's frames only pay a bounded cost for this. On most frames,
+all we do is compare t with when the next snapshot's due. A snapshot is
+taken by a GPUGrabber. It shrinks the screen on the graphics card (a
+framebuffer blit), then starts reading the small copy back into a pixel
+buffer object. That returns straight away, and we pick the pixels up on the
+next frame, by when the transfer's long done - so we never wait on the GL
+pipeline, and we only ever copy the small image. We also don't start a
+snapshot when an event is about to come on. Each snapshot is timed like
+Telemetry times its publishes. If one takes more than budget seconds, we
+wait twice as long before the next, and if that happens at max_interval, we
+stop taking screen snapshots altogether (the trial state still goes out).
+
+Each file is a FrameSlot: a seqlock (see cognac.Telemetry), the image size,
+a fixed-size record and the pixels (rows from the top, RGB)."""
+
+import ctypes
+import logging
+import mmap
+from os.path import exists, getsize, join
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+
+# seq, height, width
+HEADER = struct.Struct('<IHH')
+
+STATE = struct.Struct('<iIddddd8s16s32s')
+STATE_FIELDS = ('row', 'snapshots', 't', 'trial_t', 'interval', 'cost_mean',
+                'cost_max', 'condition', 'label', 'response')
+
+CAMERA = struct.Struct('<Id')
+CAMERA_FIELDS = ('frames', 'time')
+
+
+def default_path(name='mirror'):
+    shm = '/dev/shm'
+    if not exists(shm):
+        shm = tempfile.gettempdir()
+    return join(shm, 'numericvid-' + name)
+
+
+class GPUGrabber:
+    '''Shrinks what's on the screen to size on the graphics card, and reads
+    it back without waiting - call request on one frame and collect on the
+    next. Needs framebuffer objects (with blit) and pixel buffer objects,
+    i.e., OpenGL 3.0 or the EXT/ARB extensions.'''
+    # Our framebuffer, renderbuffer and pixel buffer
+    fbo = rbo = pbo = None
+    # Set if we couldn't set up, and so won't try again
+    failed = None
+
+    def __init__(self, screen_size, size):
+        self.screen_size = screen_size
+        self.size = size
+
+    def setup(self):
+        from OpenGL import GL
+
+        width, height = self.size
+        self.fbo = GL.glGenFramebuffers(1)
+        self.rbo = GL.glGenRenderbuffers(1)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.rbo)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGB8, width, height)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, 0)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.fbo)
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER,
+                                     GL.GL_COLOR_ATTACHMENT0,
+                                     GL.GL_RENDERBUFFER, self.rbo)
+        complete = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) == \
+                   GL.GL_FRAMEBUFFER_COMPLETE
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        if not complete:
+            raise RuntimeError('incomplete framebuffer')
+
+        self.pbo = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.pbo)
+        GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, width * height * 3, None,
+                        GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+    def request(self):
+        '''Start a snapshot of the last frame we drew - False if we can't'''
+        if self.failed:
+            return False
+        from OpenGL import GL
+
+        if self.fbo is None:
+            try:
+                self.setup()
+            except Exception, e:
+                self.failed = str(e) or e.__class__.__name__
+                logging.getLogger('VisionEgg').warning(
+                        'Mirror: no screen snapshots (%s)' % self.failed)
+                return False
+
+        width, height = self.size
+        screen_width, screen_height = self.screen_size
+        # Shrink the front buffer into ours - upside down, so rows come out
+        # from the top
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
+        GL.glReadBuffer(GL.GL_FRONT)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, self.fbo)
+        GL.glBlitFramebuffer(0, 0, screen_width, screen_height,
+                             0, height, width, 0,
+                             GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR)
+
+        # Read it into the pixel buffer - with a pack buffer bound, this
+        # just queues the transfer
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.fbo)
+        GL.glReadBuffer(GL.GL_COLOR_ATTACHMENT0)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.pbo)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        GL.glReadPixels(0, 0, width, height, GL.GL_RGB, GL.GL_UNSIGNED_BYTE,
+                        ctypes.c_void_p(0))
+
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        GL.glReadBuffer(GL.GL_BACK)
+        GL.glDrawBuffer(GL.GL_BACK)
+
+        return True
+
+    def collect(self):
+        '''The pixels from the last request (rows from the top, RGB)'''
+        from OpenGL import GL
+
+        width, height = self.size
+        nbytes = width * height * 3
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.pbo)
+        address = GL.glMapBuffer(GL.GL_PIXEL_PACK_BUFFER, GL.GL_READ_ONLY)
+        try:
+            mapped = (ctypes.c_ubyte * nbytes).from_address(address)
+            pixels = np.frombuffer(mapped, dtype=np.uint8).reshape(
+                                        height, width, 3).copy()
+        finally:
+            GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        return pixels
+
+
+class FrameSlot:
+    '''The latest image (and a record about it) in a file everyone can map.
+    Give shape to write, leave it out to read.'''
+    retries = 100
+
+    def __init__(self, path, record, shape=None):
+        self.path = path
+        self.record = record
+        self.writing = shape is not None
+        if self.writing:
+            height, width = shape[:2]
+            size = HEADER.size + record.size + height * width * 3
+            # Another writer may have it mapped - so we only make a new file
+            # if it's not the right size already
+            if not exists(path) or getsize(path) != size:
+                f = open(path, 'w+b')
+                f.write('\0' * size)
+                f.close()
+            f = open(path, 'r+b')
+            self.buf = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_WRITE)
+            HEADER.pack_into(self.buf, 0, 0, height, width)
+        else:
+            f = open(path, 'rb')
+            self.buf = mmap.mmap(f.fileno(), getsize(path),
+                                 access=mmap.ACCESS_READ)
+            seq, height, width = HEADER.unpack_from(self.buf, 0)
+        f.close()
+
+        self.shape = (height, width, 3)
+        self.pixels = np.ndarray(self.shape, dtype=np.uint8, buffer=self.buf,
+                                 offset=HEADER.size + record.size)
+        self.seq = 0
+
+    def put(self, pixels, *values):
+        '''pixels can be None, to just update the record'''
+        buf = self.buf
+        height, width = self.shape[:2]
+        self.seq += 1
+        HEADER.pack_into(buf, 0, self.seq, height, width)
+        self.record.pack_into(buf, HEADER.size, *values)
+        if pixels is not None:
+            self.pixels[...] = pixels
+        self.seq += 1
+        HEADER.pack_into(buf, 0, self.seq, height, width)
+
+    def get(self):
+        '''(seq, record values, a copy of the pixels), or None if nothing's
+        been put yet (or we kept catching the writer in the middle)'''
+        buf = self.buf
+        for i in range(self.retries):
+            seq = HEADER.unpack_from(buf, 0)[0]
+            if not seq:
+                return None
+            if seq % 2:
+                continue
+            values = self.record.unpack_from(buf, HEADER.size)
+            pixels = self.pixels.copy()
+            if HEADER.unpack_from(buf, 0)[0] == seq:
+                return seq, values, pixels
+
+        return None
+
+    def close(self):
+        self.pixels = None
+        self.buf.close()
+
+
+class Mirror:
+    '''Give one of these to a StimController
+
+    size is the screen's size - we publish it step times smaller. grabber
+    takes the snapshots (see GPUGrabber) - with no grabber, we only publish
+    the trial state.'''
+    path = None
+    interval = 0.1
+    max_interval = 1.0
+    step = 4
+    # Seconds a snapshot can take before we slow down
+    budget = 0.002
+    # We don't start a snapshot if an event's due within this many seconds
+    onset_guard = 0.025
+    grabber = None
+
+    # The t of the last snapshot - t starts again each go, so anything
+    # before it counts as due too
+    last_t = None
+    # Whether the grabber has a snapshot for us to collect, and how long
+    # starting it took
+    waiting = False
+    request_cost = 0.0
+
+    snapshots = 0
+    cost_total = 0.0
+    cost_max = 0.0
+
+    def __init__(self, size, path=None, interval=None, step=None,
+                 grabber=None):
+        if path is None:
+            path = default_path()
+        self.path = path
+        if interval is not None:
+            self.interval = interval
+        if step is not None:
+            self.step = step
+        width, height = size
+        # Rounding up, so we cover the whole screen
+        self.small_size = (-(-width // self.step), -(-height // self.step))
+        self.grabber = grabber
+        self.slot = FrameSlot(path, STATE, self.small_size[::-1])
+
+    def frame(self, stim_control, t):
+        if self.waiting:
+            self.waiting = False
+            start = time.time()
+            self.publish(stim_control, self.last_t, self.grabber.collect(),
+                         start, self.request_cost)
+            return
+        if self.last_t is not None and 0 <= t - self.last_t < self.interval:
+            return
+        if self.onset_pending(stim_control, t):
+            # We'll try again next frame
+            return
+
+        self.last_t = t
+        start = time.time()
+        if self.grabber is not None and self.grabber.request():
+            self.waiting = True
+            self.request_cost = time.time() - start
+        else:
+            self.publish(stim_control, t, None, start)
+
+    def onset_pending(self, stim_control, t):
+        '''Whether the current trial's next event (or CoroutineTrial wake up)
+        is due within onset_guard'''
+        trial = stim_control.curr_trial
+        if trial is None:
+            return False
+        due = getattr(trial, 'wake_time', None)
+        if due is None and getattr(trial, 'events', None):
+            start = trial.events[0].start
+            ref_time = trial.ref_time(start)
+            if ref_time is not None:
+                due = ref_time + start.offset
+        return due is not None and due - t < self.onset_guard
+
+    def publish(self, stim_control, t, pixels, start, extra_cost=0.0):
+        row = stim_control.curr_row
+        condition = label = response = ''
+        trial_t = float('nan')
+        trial = stim_control.curr_trial
+        if trial is not None:
+            condition = getattr(trial, 'condition', None) or \
+                        trial.log.get('condition', '')
+            trial_start = trial.log.get('trial_start')
+            if trial_start is not None:
+                trial_t = t - trial_start
+            if trial.curr_response is not None:
+                label = trial.curr_response.label
+                response = str(trial.curr_response.response or '')
+        cost_mean = self.cost_total / self.snapshots if self.snapshots \
+                    else 0.0
+        # An interval of inf tells mirror_view.py the screen's off
+        interval = self.interval if self.grabber is not None else \
+                   float('inf')
+
+        self.slot.put(pixels, row, self.snapshots, t, trial_t, interval,
+                      cost_mean, self.cost_max, condition, label,
+                      response[-32:])
+
+        if pixels is None:
+            return
+        # What the participant's frames paid, over the two we were in
+        cost = time.time() - start + extra_cost
+        self.snapshots += 1
+        self.cost_total += cost
+        if cost > self.cost_max:
+            self.cost_max = cost
+        if cost > self.budget:
+            if self.interval >= self.max_interval:
+                # Even once a second is too much - just the state from now on
+                self.grabber = None
+                logging.getLogger('VisionEgg').warning(
+                        'Mirror: screen snapshots took %.1f ms - stopped'
+                        % (1e3 * cost))
+            self.interval = min(2 * self.interval, self.max_interval)
+
+    def close(self):
+        self.slot.close()
+
+
+class CameraMirror:
+    '''For the process that reads the camera - put each frame in frame, and
+    we publish every step'th pixel every interval seconds'''
+    interval = 0.1
+    step = 2
+    last_time = 0.0
+    frames = 0
+
+    def __init__(self, size, path=None, interval=None, step=None):
+        if path is None:
+            path = default_path('camera')
+        if interval is not None:
+            self.interval = interval
+        if step is not None:
+            self.step = step
+        width, height = size
+        self.slot = FrameSlot(path, CAMERA,
+                              (len(range(0, height, self.step)),
+                               len(range(0, width, self.step))))
+
+    def due(self):
+        '''So you don't have to convert frames we won't use'''
+        return time.time() - self.last_time >= self.interval
+
+    def frame(self, pixels):
+        '''pixels is rows from the top, RGB'''
+        self.last_time = time.time()
+        self.frames += 1
+        self.slot.put(pixels[::self.step, ::self.step], self.frames,
+                      self.last_time)
+
+    def close(self):
+        self.slot.close()
+
+
+class MirrorReader:
+    '''Reads the latest screen and camera images - either can be missing'''
+
+    def __init__(self, path=None, camera_path=None):
+        if path is None:
+            path = default_path()
+        if camera_path is None:
+            camera_path = default_path('camera')
+        self.screen = self.camera = None
+        self.paths = path, camera_path
+
+    def open(self):
+        '''Map whatever's there now - the camera only turns up once it's
+        recording'''
+        path, camera_path = self.paths
+        if self.screen is None and exists(path):
+            self.screen = FrameSlot(path, STATE)
+        if self.camera is None and exists(camera_path):
+            self.camera = FrameSlot(camera_path, CAMERA)
+
+    def read_screen(self):
+        '''(state dict, pixels), or None'''
+        self.open()
+        got = self.screen and self.screen.get()
+        if not got:
+            return None
+        seq, values, pixels = got
+        state = dict(zip(STATE_FIELDS, values))
+        for name in ('condition', 'label', 'response'):
+            state[name] = state[name].rstrip('\0')
+        state['seq'] = seq
+
+        return state, pixels
+
+    def read_camera(self):
+        '''(state dict, pixels), or None'''
+        self.open()
+        got = self.camera and self.camera.get()
+        if not got:
+            return None
+        seq, values, pixels = got
+        state = dict(zip(CAMERA_FIELDS, values))
+        state['seq'] = seq
+
+        return state, pixels
+
+    def close(self):
+        for slot in (self.screen, self.camera):
+            if slot is not None:
+                slot.close()
@@ -0,0 +1,137 @@
+"""Profiler.py finds out where the python time goes during a block.
+
+It's a sampling profiler: every interval seconds of CPU time, the kernel
+sends us SIGPROF, and we note the stack we were in the middle of. That's all
+the work there is (no tracing every call, like cProfile), so it's cheap
+enough to leave on - and we only sample during the trials you ask for.
+
+Each sample is tagged with the row and condition of the trial it landed in,
+and write() puts them out as "collapsed stacks" - one line per stack, frames
+separated by ;, then the count - which is what flamegraph.pl (or speedscope,
+etc.) wants:
+
+    row003;EI;numeric_questions_fast.py:main;StimController.py:update;... 12
+
+Which trials to profile is a spec like the ones you'd put after profile: in a
+block's YAML (or NUMERICVID_PROFILE) - "all", or a comma separated list of
+conditions, rows and ranges of rows, e.g. "EI,0-4,10".
+
+Because it's CPU time, waiting for a flip doesn't count - but anything python
+does to get there does. We're unix only (setitimer), and have to be set up
+from the main thread."""
+
+import signal
+from os.path import basename
+
+
+def parse_spec(spec):
+    '''(conditions, rows) for a spec - None for conditions means all'''
+    spec = str(spec).strip()
+    if spec.lower() in ('all', '1', 'true', 'yes'):
+        return None, set()
+
+    conditions = set()
+    rows = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        if first.isdigit() and (not dash or last.isdigit()):
+            rows.update(range(int(first), int(last or first) + 1))
+        else:
+            conditions.add(part)
+
+    return conditions, rows
+
+
+class SamplingProfiler:
+    # Seconds of CPU time between samples
+    interval = 0.005
+
+    # Whether the timer's going, and what we're tagging samples with
+    running = False
+    tag = None
+    samples = 0
+
+    def __init__(self, spec='all', interval=None):
+        if interval is not None:
+            self.interval = interval
+        self.spec = spec
+        self.conditions, self.rows = parse_spec(spec)
+        # (tag, code objects from the outermost in) -> count
+        self.counts = {}
+        self.installed = False
+
+    def wanted(self, row, condition):
+        if self.conditions is None:
+            return True
+        return row in self.rows or condition in self.conditions
+
+    def install(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        # Don't make system calls (reads, selects, sleeps) give up with EINTR
+        # when we go off in the middle of them
+        signal.siginterrupt(signal.SIGPROF, False)
+        self.installed = True
+
+    def start_trial(self, row, condition):
+        '''StimController calls this as each trial starts - we only start
+        sampling if it's one we want'''
+        if not self.wanted(row, condition):
+            return
+        if not self.installed:
+            self.install()
+        self.tag = 'row%03d;%s' % (row, condition)
+        self.running = True
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop_trial(self):
+        if self.running:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            self.running = False
+
+    def sample(self, signum, frame):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        key = (self.tag, tuple(codes))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def collapsed(self):
+        '''(stack, count) with the stacks as flamegraph.pl wants them'''
+        names = {}
+        lines = {}
+        for (tag, codes), count in self.counts.iteritems():
+            frames = [tag]
+            for code in codes:
+                try:
+                    name = names[code]
+                except KeyError:
+                    name = names[code] = '%s:%s' % \
+                            (basename(code.co_filename), code.co_name)
+                frames.append(name)
+            stack = ';'.join(frames)
+            lines[stack] = lines.get(stack, 0) + count
+
+        return sorted(lines.items())
+
+    def write(self, fname):
+        f = open(fname, 'w')
+        for stack, count in self.collapsed():
+            f.write('%s %d\n' % (stack, count))
+        f.close()
+
+    def top(self, num=10):
+        '''The num functions we saw at the top of the stack most, as (count,
+        name)'''
+        totals = {}
+        for stack, count in self.collapsed():
+            name = stack.rsplit(';', 1)[-1]
+            totals[name] = totals.get(name, 0) + count
+
+        return sorted(((count, name) for name, count in totals.iteritems()),
+                      reverse=True)[:num]
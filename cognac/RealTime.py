@@ -0,0 +1,202 @@
+"""RealTime.py keeps python and the OS from getting in the way of our frames.
+
+All of this is opt-in (see SimpleVisionEgg.set_realtime), and all of it needs
+Linux - and for some of it, root or the right rlimits. We report what actually
+took effect rather than failing, so you can run the same script anywhere:
+
+    garbage collection - off while frames are being drawn. Once a trial,
+        StimController collects the young generations on a frame where it's
+        only waiting on a response (see between_trials), as a block is
+        usually just one go, and we do a full collection when each go is
+        done. Cycles only get made by accident here, and Trials
+        get reused, so there's very little to collect anyway.
+    CPU affinity - the render thread gets a core to itself, and child
+        processes (like the Recording's camera loop) get the rest. Threads
+        started after setup inherit the render thread's core and priority,
+        so they need child_setup too (see CollectorClient's and
+        SerialButtonBox's thread_setup).
+    SCHED_FIFO - so nothing at normal priority can preempt us. If we can't
+        get that, we try for a lower nice value.
+    mlockall - so nothing we touch in the middle of a block gets paged out
+
+Python 2 doesn't have os.sched_setaffinity and friends, so we get them from
+libc with ctypes."""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+
+
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+_libc = None
+
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return _libc
+
+
+def _check(result):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+class _SchedParam(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+
+# Room for 1024 CPUs, like glibc's cpu_set_t
+_CpuSet = ctypes.c_ulong * (1024 // (8 * ctypes.sizeof(ctypes.c_ulong)))
+_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+
+def get_affinity(pid=0):
+    cpu_set = _CpuSet()
+    _check(libc().sched_getaffinity(pid, ctypes.sizeof(cpu_set),
+                                    ctypes.byref(cpu_set)))
+    return [cpu for cpu in range(len(cpu_set) * _BITS)
+                if cpu_set[cpu // _BITS] & (1 << (cpu % _BITS))]
+
+
+def set_affinity(cpus, pid=0):
+    cpu_set = _CpuSet()
+    for cpu in cpus:
+        cpu_set[cpu // _BITS] |= 1 << (cpu % _BITS)
+    _check(libc().sched_setaffinity(pid, ctypes.sizeof(cpu_set),
+                                    ctypes.byref(cpu_set)))
+
+
+def set_scheduler(policy, priority=0, pid=0):
+    param = _SchedParam(priority)
+    _check(libc().sched_setscheduler(pid, policy, ctypes.byref(param)))
+
+
+def lock_memory():
+    _check(libc().mlockall(MCL_CURRENT | MCL_FUTURE))
+
+
+class RealTime:
+    '''Do setup once, before the first go - then call start_go and end_go
+    around each go (SimpleVisionEgg does this for you)'''
+    # Which CPU the render process gets - None means the last one we're
+    # allowed on (the first is more likely to be handling interrupts)
+    render_cpu = None
+    # SCHED_FIFO priority (1 - 99). Keep it below the kernel's threaded
+    # interrupts, which default to 50
+    priority = 40
+    # What we try if we can't get SCHED_FIFO
+    nice = -10
+    lock = True
+
+    # What we've got - see setup
+    report = None
+    cpus = None
+    child_cpus = None
+    realtime_scheduler = False
+    gc_was_enabled = True
+
+    def __init__(self, render_cpu=None, priority=None, lock=None):
+        if render_cpu is not None:
+            self.render_cpu = render_cpu
+        if priority is not None:
+            self.priority = priority
+        if lock is not None:
+            self.lock = lock
+        self.report = []
+
+    def _try(self, what, func, *args):
+        try:
+            func(*args)
+        except (OSError, AttributeError), e:
+            # AttributeError is libc not having it (i.e., not Linux)
+            self.report.append((what, False, str(e)))
+            return False
+
+        return True
+
+    def setup(self):
+        '''Returns (and keeps in self.report) a list of (what, ok, details)'''
+        self.report = []
+
+        # Affinity
+        try:
+            self.cpus = get_affinity()
+        except (OSError, AttributeError), e:
+            self.report.append(('cpu affinity', False, str(e)))
+        else:
+            render_cpu = self.render_cpu
+            if render_cpu is None:
+                render_cpu = self.cpus[-1]
+            if len(self.cpus) < 2:
+                self.report.append(('cpu affinity', False,
+                                    'only one cpu available'))
+            elif self._try('cpu affinity', set_affinity, [render_cpu]):
+                self.child_cpus = [c for c in self.cpus if c != render_cpu]
+                self.report.append(('cpu affinity', True,
+                                    'render on cpu %d, children on %s' %
+                                    (render_cpu, self.child_cpus)))
+
+        # Scheduling
+        if self._try('SCHED_FIFO', set_scheduler, SCHED_FIFO, self.priority):
+            self.realtime_scheduler = True
+            self.report.append(('SCHED_FIFO', True,
+                                'priority %d' % self.priority))
+        else:
+            try:
+                os.nice(self.nice - os.nice(0))
+            except OSError, e:
+                self.report.append(('nice', False, str(e)))
+            else:
+                self.report.append(('nice', True, 'now %d' % os.nice(0)))
+
+        # Memory
+        if self.lock and self._try('mlockall', lock_memory):
+            self.report.append(('mlockall', True, 'current and future'))
+
+        self.report.append(('gc', True, 'disabled during go, collected '
+                                        'once a trial'))
+        return self.report
+
+    def summary(self):
+        return '\n'.join('%-12s %-4s %s' % (what, ok and 'ok' or 'FAIL',
+                                             details)
+                            for what, ok, details in self.report)
+
+    def start_go(self):
+        self.gc_was_enabled = gc.isenabled()
+        gc.collect()
+        gc.disable()
+
+    def between_trials(self):
+        '''StimController calls this once a trial, on a frame where nothing's
+        starting - just the young generations, which is quick, and all that
+        Trials make'''
+        gc.collect(1)
+
+    def end_go(self):
+        if self.gc_was_enabled:
+            gc.enable()
+        gc.collect()
+
+    def child_setup(self):
+        '''Run this first thing in a child process (e.g., Recording's) or a
+        thread (e.g., CollectorClient's) so it doesn't inherit our core or
+        our priority - on Linux, both are per thread'''
+        if self.realtime_scheduler:
+            try:
+                set_scheduler(SCHED_OTHER, 0)
+            except OSError:
+                pass
+        if self.child_cpus:
+            try:
+                set_affinity(self.child_cpus)
+            except OSError:
+                pass
@@ -0,0 +1,219 @@
+"""Replay.py plays a block back from its log, with no display and as fast as
+the CPU will go.
+
+A StimController log has the ref_time, rt and response of every Response, so
+we know which keys the participant pressed and when. We run the same Trials
+through a StimController on a cognac.Headless.HeadlessVisionEgg, and a
+ScriptedInput posts pygame key events so that each Response completes at its
+logged time. Then we can diff the new log against the original - so changes
+to the control loop can be checked against real sessions.
+
+Usage is something like:
+
+    vision_egg = HeadlessVisionEgg()
+    ... make Trials with stimuli that are cognac.Headless.NullStims ...
+    original = list(DictReader(open('block1-E-log.csv')))
+    replayed, gave_up = replay(trials, vision_egg, original)
+    for diff in compare_logs(original, replayed, 2 * vision_egg.frame_period):
+        print diff
+
+replay_block.py does all of this for the numeric questions blocks.
+
+Key presses are scheduled relative to the start of the trial, not the start
+of the response, so that being a frame late on one response doesn't push
+everything after it later and later."""
+
+from csv import DictReader
+from StringIO import StringIO
+
+import pygame
+
+from cognac.StimController import StimController
+from cognac.ResponseDevices import key_codes
+
+
+def typed_keys(text):
+    '''The key names that type text into something like an EstimateResponse'''
+    return ['space' if c == ' ' else c for c in text]
+
+
+def _float(line, name):
+    try:
+        return float(line[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class LogScript:
+    '''Works out the key presses for a Response from a log (a list of dicts,
+    as from csv.DictReader - one for each logged trial)'''
+    rows = None
+    # What ends a typed response
+    enter_key = 'return'
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def keys(self, row, response, trial=None):
+        '''(seconds after trial_start, key name) pairs, in order
+
+        Responses that timed out, or never finished, get no keys.'''
+        try:
+            line = self.rows[row]
+        except IndexError:
+            return []
+        label = response.label
+        ref_time = _float(line, label + '.ref_time')
+        rt = _float(line, label + '.rt')
+        pressed = line.get(label + '.response')
+        if ref_time is None or rt is None or not pressed:
+            return []
+
+        done = ref_time - _float(line, 'trial_start') + rt
+        if 'start_time' not in response.log_fields:
+            return [(done, pressed)]
+
+        # A typed response - we spread the characters from the first one
+        # (start_time) up to the enter key
+        keys = typed_keys(pressed)
+        first = _float(line, label + '.start_time')
+        if first is None:
+            first = rt
+        first += done - rt
+        step = (done - first) / len(keys)
+        times = [first + i * step for i in range(len(keys))]
+
+        return zip(times, keys) + [(done, self.enter_key)]
+
+
+class ScriptedInput:
+    '''A frame hook for HeadlessVisionEgg - presses the scripted keys for
+    whatever Response stim_control is waiting on
+
+    script can be anything with a keys(row, response, trial) like LogScript's
+    (cognac.Synthetic makes them up instead).
+
+    Responses like EstimateResponse only look at one key per frame, so we
+    never press more than one. Unlogged trials have no row in the log, so
+    they get no keys. If we're out of keys and a response still hasn't
+    finished after give_up (simulated) seconds, we quit and set gave_up.'''
+    stim_control = None
+    script = None
+    codes = None
+    # The response our pending keys are for
+    response = None
+    pending = None
+    give_up = 600.0
+    gave_up = False
+
+    def __init__(self, stim_control, script, give_up=None):
+        self.stim_control = stim_control
+        self.script = script
+        self.codes = key_codes()
+        self.pending = []
+        if give_up is not None:
+            self.give_up = give_up
+
+    def __call__(self, t):
+        trial = self.stim_control.curr_trial
+        response = trial and trial.curr_response
+        if response is not self.response:
+            self.response = response
+            if response is None or trial.unlogged:
+                self.pending = []
+            else:
+                self.pending = self.script.keys(self.stim_control.curr_row,
+                                                response, trial)
+
+        # The small fudge stops us from missing a frame from rounding error
+        if self.pending and \
+                t - trial.log['trial_start'] >= self.pending[0][0] - 1e-6:
+            when, key = self.pending.pop(0)
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN,
+                                                 key=self.codes[key]))
+        elif response is not None and not self.pending and \
+                t - response.ref_time > self.give_up:
+            self.gave_up = True
+            self.stim_control.vision_egg.quit()
+
+
+def replay(trials, vision_egg, rows, pause_event=None, frame_period=None,
+           give_up=None):
+    '''Run trials on vision_egg (a HeadlessVisionEgg), with the keys from rows,
+    and return (the new log, the same way it would come back from a csv,
+    gave_up). If we had to give up on a response (see ScriptedInput),
+    gave_up is True and the log stops there.'''
+    stim_control = StimController(trials, vision_egg, pause_event,
+                                  frame_period)
+    hook = ScriptedInput(stim_control, LogScript(rows), give_up)
+    vision_egg.frame_hooks.append(hook)
+    try:
+        stim_control.run_trials()
+    finally:
+        vision_egg.frame_hooks.remove(hook)
+
+    log = StringIO()
+    stim_control.writelog(log)
+    log.seek(0)
+
+    return list(DictReader(log)), hook.gave_up
+
+
+def _value(s):
+    try:
+        return float(s)
+    except (TypeError, ValueError):
+        return s
+
+
+def _relative(rows, row, name):
+    '''Times that pile up over a block are compared to where they start from
+    - ref_times to trial_start, and trial_start to the last trial_start'''
+    value = _value(rows[row].get(name))
+    if not isinstance(value, float):
+        return value
+
+    if name == 'trial_start':
+        if row:
+            value -= _value(rows[row - 1]['trial_start'])
+    elif name.endswith('.ref_time'):
+        value -= _value(rows[row]['trial_start'])
+
+    return value
+
+
+def compare_logs(original, replayed, tolerance=0.0, skip_new=False):
+    '''Returns a list of (row, column, original value, replayed value) for
+    everything that doesn't match. Numbers within tolerance of each other
+    match. Missing values come back as None, and a missing row gives a
+    column of None, with the row that's there (in a list). If skip_new,
+    columns that the original log doesn't have at all (it's from before we
+    logged them) are skipped.'''
+    diffs = []
+    for row in range(max(len(original), len(replayed))):
+        if row >= len(original) or row >= len(replayed):
+            diffs.append((row, None, original[row:row + 1] or None,
+                          replayed[row:row + 1] or None))
+            continue
+
+        names = set(original[row])
+        if not skip_new:
+            names |= set(replayed[row])
+        for name in sorted(names):
+            orig = original[row].get(name) or None
+            new = replayed[row].get(name) or None
+            if orig is None or new is None:
+                if orig != new:
+                    diffs.append((row, name, orig, new))
+                continue
+
+            orig_val = _relative(original, row, name)
+            new_val = _relative(replayed, row, name)
+            if isinstance(orig_val, float) and isinstance(new_val, float):
+                if abs(orig_val - new_val) <= tolerance:
+                    continue
+            elif orig_val == new_val:
+                continue
+            diffs.append((row, name, orig, new))
+
+    return diffs
@@ -0,0 +1,236 @@
+"""ResponseDevices.py has the things Responses get their key presses from.
+
+A device gives us (code, timestamp) pairs, where code is an integer and
+timestamp is time.time() when the press happened - or None, if the device
+doesn't know, in which case the press happened "this frame". Responses turn
+their limit into a set of codes once, when they're made (see codes), so
+checking a press is just a set lookup. We only need the name of the one press
+we actually log.
+
+Devices:
+
+    PygameKeyboard - the keyboard, through pygame's event queue, as we've
+        always done it. No timestamps, so RTs are to the frame.
+    EvdevDevice - any Linux input device (keyboard, USB button box) straight
+        from /dev/input/event*, with the kernel's timestamps
+    SerialButtonBox - a button box on a serial port that sends a byte per
+        press. A thread timestamps bytes as they arrive. You can try it out
+        with a pty from os.openpty() - write to the master end, and give us
+        the name of the slave.
+
+Responses share a PygameKeyboard unless you give them something else."""
+
+import os
+import select
+import struct
+import termios
+import threading
+import time
+import tty
+from collections import deque
+
+import pygame
+
+
+def key_codes():
+    '''key name (as from pygame.key.name) -> pygame key code'''
+    codes = {}
+    for name in dir(pygame):
+        if name.startswith('K_'):
+            code = getattr(pygame, name)
+            codes.setdefault(pygame.key.name(code), code)
+
+    return codes
+
+
+class ResponseDevice:
+    '''What all devices do - subclasses need at least poll and name'''
+
+    def poll(self):
+        '''A list of (code, timestamp) for the presses since the last poll'''
+        raise NotImplementedError
+
+    def clear(self):
+        '''Forget anything that's been pressed'''
+        self.poll()
+
+    def name(self, code):
+        '''What we log for a code'''
+        raise NotImplementedError
+
+    def all_codes(self):
+        '''Every code we might give you'''
+        raise NotImplementedError
+
+    def codes(self, names):
+        '''The set of codes that have any of names'''
+        names = set(names)
+        return frozenset(code for code in self.all_codes()
+                            if self.name(code) in names)
+
+
+class PygameKeyboard(ResponseDevice):
+    event_type = pygame.KEYDOWN
+
+    def __init__(self, event_type=None):
+        if event_type is not None:
+            self.event_type = event_type
+
+    def poll(self):
+        events = pygame.event.get(self.event_type)
+        # We're keeping our event queue tidy - which might be bad depending on
+        # your experiment!
+        pygame.event.clear()
+        return [(e.key, None) for e in events]
+
+    def clear(self):
+        pygame.event.clear()
+
+    def name(self, code):
+        return pygame.key.name(code)
+
+    def all_codes(self):
+        return set(getattr(pygame, name) for name in dir(pygame)
+                        if name.startswith('K_'))
+
+
+_keyboards = {}
+
+def keyboard(event_type=pygame.KEYDOWN):
+    '''The PygameKeyboard that everyone shares'''
+    try:
+        return _keyboards[event_type]
+    except KeyError:
+        device = _keyboards[event_type] = PygameKeyboard(event_type)
+        return device
+
+
+## Linux input devices
+
+EV_KEY = 1
+# struct input_event: a struct timeval, then type, code and value
+INPUT_EVENT = struct.Struct('llHHi')
+
+# Linux key codes (from linux/input.h), named the way pygame names them, so
+# logs and limits look the same whatever device we're on
+LINUX_KEY_NAMES = {1: 'escape', 14: 'backspace', 15: 'tab', 28: 'return',
+                   57: 'space', 12: '-', 13: '=', 51: ',', 52: '.', 53: '/',
+                   96: 'enter', 83: '[.]', 111: 'delete'}
+for code, name in zip(range(2, 12), '1234567890'):
+    LINUX_KEY_NAMES[code] = name
+for first, row in ((16, 'qwertyuiop'), (30, 'asdfghjkl'), (44, 'zxcvbnm')):
+    for code, name in enumerate(row, first):
+        LINUX_KEY_NAMES[code] = name
+for code, name in zip((82, 79, 80, 81, 75, 76, 77, 71, 72, 73),
+                      '0123456789'):
+    LINUX_KEY_NAMES[code] = '[%s]' % name
+# Button boxes often show up as joysticks or gamepads - BTN_0 on
+for code in range(0x100, 0x10a):
+    LINUX_KEY_NAMES[code] = 'btn%d' % (code - 0x100)
+
+
+class EvdevDevice(ResponseDevice):
+    '''Presses (not releases or repeats) from /dev/input/event<something>'''
+    path = None
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self.buffer = ''
+
+    def poll(self):
+        try:
+            while True:
+                data = os.read(self.fd, 64 * INPUT_EVENT.size)
+                if not data:
+                    break
+                self.buffer += data
+        except OSError:
+            # EAGAIN - nothing more to read
+            pass
+
+        presses = []
+        size = INPUT_EVENT.size
+        whole = len(self.buffer) - len(self.buffer) % size
+        for start in range(0, whole, size):
+            sec, usec, ev_type, code, value = \
+                    INPUT_EVENT.unpack_from(self.buffer, start)
+            if ev_type == EV_KEY and value == 1:
+                presses.append((code, sec + usec * 1e-6))
+        self.buffer = self.buffer[whole:]
+
+        return presses
+
+    def name(self, code):
+        return LINUX_KEY_NAMES.get(code, 'key%d' % code)
+
+    def all_codes(self):
+        return range(0x300)
+
+    def close(self):
+        os.close(self.fd)
+
+
+## Serial button boxes
+
+class SerialButtonBox(ResponseDevice):
+    '''A box that sends one byte per press. Printable bytes are named as
+    themselves (so a box that sends "1" for button 1 works with the same
+    limits as the keyboard), anything else as "byte<n>".'''
+    path = None
+    baudrate = 9600
+    # Something to call first thing in the reader thread, like Recording's
+    # child_setup (e.g. cognac.RealTime.RealTime.child_setup)
+    thread_setup = None
+
+    def __init__(self, path, baudrate=None, thread_setup=None):
+        self.path = path
+        if baudrate is not None:
+            self.baudrate = baudrate
+        self.thread_setup = thread_setup
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, 'B%d' % self.baudrate)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+        # The reader thread appends, and poll pops - deques are safe for that
+        self.presses = deque()
+        self.running = True
+        self.thread = threading.Thread(target=self.read_presses)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def read_presses(self):
+        if self.thread_setup is not None:
+            self.thread_setup()
+        while self.running:
+            if not select.select([self.fd], [], [], 0.1)[0]:
+                continue
+            try:
+                data = os.read(self.fd, 64)
+            except OSError:
+                continue
+            now = time.time()
+            for byte in data:
+                self.presses.append((ord(byte), now))
+
+    def poll(self):
+        presses = []
+        while self.presses:
+            presses.append(self.presses.popleft())
+        return presses
+
+    def name(self, code):
+        if 32 < code < 127:
+            return chr(code)
+        return 'byte%d' % code
+
+    def all_codes(self):
+        return range(256)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.fd)
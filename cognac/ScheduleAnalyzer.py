@@ -0,0 +1,237 @@
+"""ScheduleAnalyzer.py works out how a block will play out before we run it.
+
+Each Trial's schedule is a little graph of RelTimes - most events start at a
+fixed offset from trial_start or from some other event, but anything that
+refers to a Response label has to wait for the participant. We walk the
+schedule the same way Trial.activate_events does (in order, one frame at a
+time), and draw the response times from distributions fitted to old logs. We
+do this for many simulated participants at once, so all the times below are
+arrays with one entry per sample.
+
+Usage is something like:
+
+    rts = RTModel()
+    rts.fit(['practice/practice-log.csv'])
+    report = ScheduleAnalyzer(rts).analyze(trials)
+    print report.summary()
+
+Run this on trials that haven't been run yet (or have been reset) - it uses
+Trial.schedule, so it doesn't touch the events themselves."""
+
+from csv import DictReader
+
+import numpy as np
+
+from cognac.StimController import Response
+from cognac.DisplayProfile import default_frame_period
+
+
+class RTModel:
+    '''Log-normal response times for each Response label
+
+    Anything we don't have data for gets the default, which is a median of
+    about 1.6 s.'''
+    # label -> (mean, sd) of log(rt)
+    params = None
+    default = (0.5, 0.5)
+
+    def __init__(self, default=None):
+        self.params = {}
+        if default is not None:
+            self.default = default
+
+    def fit(self, log_files):
+        '''Fit every "<label>.rt" column in a bunch of StimController logs'''
+        rts = {}
+        for fname in log_files:
+            log = open(fname)
+            try:
+                for line in DictReader(log):
+                    for key, val in line.iteritems():
+                        if key.endswith('.rt') and val:
+                            rts.setdefault(key[:-3], []).append(float(val))
+            finally:
+                log.close()
+
+        for label, vals in rts.iteritems():
+            vals = np.log([v for v in vals if v > 0])
+            if len(vals) > 1:
+                self.params[label] = (vals.mean(), vals.std())
+
+        return self
+
+    def sample(self, label, size, rng=np.random):
+        mean, sd = self.params.get(label, self.default)
+        return rng.lognormal(mean, sd, size)
+
+
+class BlockReport:
+    '''What we found out about a block. All the arrays have one entry per
+    sample'''
+    # total time for the block
+    durations = None
+    # a list of arrays - one for each trial
+    trial_durations = None
+    # most events on at once, over all trials
+    peak_active = None
+    # most events activated on a single frame, over all trials
+    peak_activations = None
+    # human readable descriptions of anything that will never happen
+    problems = None
+
+    def __init__(self, samples):
+        self.durations = np.zeros(samples)
+        self.trial_durations = []
+        self.peak_active = np.zeros(samples, dtype=int)
+        self.peak_activations = np.zeros(samples, dtype=int)
+        self.problems = []
+
+    def duration(self, percentile=50):
+        '''Block duration that percentile of samples come in under'''
+        return np.percentile(self.durations, percentile)
+
+    def summary(self):
+        lines = []
+        finite = self.durations[np.isfinite(self.durations)]
+        if len(finite):
+            lines.append('block duration: median %.1f s, 95%% under %.1f s' %
+                         (np.median(finite), np.percentile(finite, 95)))
+        if len(finite) < len(self.durations):
+            lines.append('%d of %d samples never finish!' %
+                         (len(self.durations) - len(finite),
+                          len(self.durations)))
+        lines.append('peak active events: %d' % self.peak_active.max())
+        lines.append('peak activations in one frame: %d' %
+                     self.peak_activations.max())
+        lines.extend(self.problems)
+
+        return '\n'.join(lines)
+
+
+class ScheduleAnalyzer:
+    rt_model = None
+    # Everything happens on a frame, so we round up to the next one. Set it
+    # to None to work in continuous time.
+    frame_period = None
+    samples = 1000
+
+    def __init__(self, rt_model=None, frame_period='machine', samples=None,
+                 rng=np.random):
+        '''frame_period defaults to this machine's (see
+        cognac.DisplayProfile.default_frame_period) - pass None to work in
+        continuous time'''
+        if rt_model is None:
+            rt_model = RTModel()
+        self.rt_model = rt_model
+        if frame_period == 'machine':
+            frame_period = default_frame_period()
+        self.frame_period = frame_period
+        if samples is not None:
+            self.samples = samples
+        self.rng = rng
+
+    def on_frame(self, t):
+        '''The first frame at or after t (inf stays inf)'''
+        if self.frame_period is None:
+            return t
+        # The small fudge stops us from skipping a frame from rounding error
+        return np.ceil(t / self.frame_period - 1e-6) * self.frame_period
+
+    def resolve(self, times, rel_time):
+        '''The (sampled) time that rel_time refers to, or None if nothing in
+        the trial so far can tell us'''
+        try:
+            ref = times[rel_time.ref]
+        except KeyError:
+            return None
+
+        return self.on_frame(ref + rel_time.offset)
+
+    def analyze_trial(self, trial, problems=None):
+        '''Returns (starts, stops) - arrays of samples x events. Anything that
+        never happens is inf.'''
+        n = self.samples
+        times = {'trial_start': np.zeros(n)}
+        never = np.empty(n)
+        never.fill(np.inf)
+        prev_start = np.zeros(n)
+        pending = None
+        starts = []
+        stop_refs = []
+
+        for i, event in enumerate(trial.schedule):
+            start = self.resolve(times, event.start)
+            if start is None:
+                if problems is not None:
+                    problems.append('event %d waits for "%s", which never '
+                                    'happens before it' % (i, event.start.ref))
+                start = never
+            # Events are activated in order
+            start = np.maximum(start, prev_start)
+            prev_start = start
+            starts.append(start)
+
+            if isinstance(event.response, Response):
+                label = event.response.label
+                if pending is not None:
+                    # Only one response at a time - a new one means the old
+                    # one never finishes
+                    times[pending] = np.where(times[pending] > start,
+                                              np.inf, times[pending])
+                rt = self.rt_model.sample(label, n, self.rng)
+                if event.response.timelimit is not None:
+                    rt = np.minimum(rt, event.response.timelimit)
+                times[label] = self.on_frame(start + rt)
+                pending = label
+
+            stop_refs.append(event.stop)
+
+        # Stops can refer to anything in the trial, even later responses
+        stops = []
+        for i, (start, stop_ref) in enumerate(zip(starts, stop_refs)):
+            if times.get(stop_ref.ref) is None:
+                if problems is not None:
+                    problems.append('event %d stops on "%s", which never '
+                                    'happens' % (i, stop_ref.ref))
+                stop = never
+            else:
+                stop = self.resolve(times, stop_ref)
+            # We only deactivate things that are active
+            stops.append(np.maximum(stop, start))
+
+        return np.array(starts).T, np.array(stops).T
+
+    def analyze(self, trials):
+        report = BlockReport(self.samples)
+        for trial_num, trial in enumerate(trials):
+            problems = []
+            starts, stops = self.analyze_trial(trial, problems)
+            report.problems.extend('trial %d: %s' % (trial_num, p)
+                                   for p in problems)
+            if not starts.size:
+                report.trial_durations.append(np.zeros(self.samples))
+                continue
+
+            # The trial is done when the last thing is done
+            duration = np.maximum(starts.max(1), stops.max(1))
+            report.trial_durations.append(duration)
+            report.durations += duration
+
+            # How many events are on at the start of each event?
+            # (samples x event x other event)
+            on = (starts[:, None, :] <= starts[:, :, None]) & \
+                 (stops[:, None, :] > starts[:, :, None])
+            report.peak_active = np.maximum(report.peak_active,
+                                            on.sum(2).max(1))
+
+            # And how many get switched on in the same frame?
+            if self.frame_period is None:
+                frames = starts
+            else:
+                frames = np.round(starts / self.frame_period)
+            same = (frames[:, None, :] == frames[:, :, None]) & \
+                   np.isfinite(frames)[:, None, :]
+            report.peak_activations = np.maximum(report.peak_activations,
+                                                 same.sum(2).max(1))
+
+        return report
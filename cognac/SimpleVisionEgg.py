@@ -2,6 +2,8 @@
 do.  This module serves simply to set things up and keep track of VisionEgg
 related values.  It shouldn't really _do_ anything."""
 
+import logging
+
 import VisionEgg
 from VisionEgg.Core import get_default_screen, Viewport
 from VisionEgg.FlowControl import Presentation, FunctionController
@@ -9,6 +11,8 @@ from VisionEgg.ResponseControl import KeyboardResponseController
 from VisionEgg.DaqKeyboard import KeyboardTriggerInController
 from VisionEgg.ParameterTypes import NoneType
 
+from cognac.KeyState import change_points, key_events
+
 #################################
 # Set some VisionEgg Defaults:  #
 #################################
@@ -48,8 +52,10 @@ class MultiStim:
         self.parameters = MultiStimHelper(stims)
 
     def set(self, **parms):
-        for k, v in parms.items():
-            setattr(self.parameters, k, v)
+        # One set per stimulus, rather than a setattr per parameter per
+        # stimulus through MultiStimHelper
+        for s in self.parameters.stims:
+            s.set(**parms)
 
 class SimpleVisionEgg:
     keyboard_controller = None
@@ -59,12 +65,24 @@ class SimpleVisionEgg:
     keys = None
     presses = None
     releases = None
+    # A cognac.RealTime.RealTime, if we're in real-time mode
+    realtime = None
+    # A cognac.Startup.StartupTrace, if we're timing startup
+    startup = None
 
-    def __init__(self):
+    def __init__(self, display_profile=None, startup=None):
         """We break up initialization a bit as we need to go back and forth with
         some information.  In this case, we need screen size before specifying
-        the stimuli"""
+        the stimuli
+
+        With a display_profile (see cognac.DisplayProfile), we use its
+        settings and skip the configuration dialog."""
+        if display_profile is not None:
+            display_profile.apply(VisionEgg.config)
+        self.startup = startup
         self.screen = get_default_screen()
+        if startup:
+            startup.mark('screen')
         self.keys = []
         self.presses = []
         self.releases = []
@@ -89,18 +107,47 @@ class SimpleVisionEgg:
             self.keyboard_controller = KeyboardResponseController()
             self.presentation.add_controller(None, None, self.keyboard_controller)
 
+        if self.startup:
+            self.startup.mark('stimuli')
 
     def set_functions(self, update=None, pause_update=None):
         """Interface for cognac.StimulusController or similar"""
-        self.presentation.add_controller(None, None,
-                     FunctionController(during_go_func=update, 
+        during_go_func = update
+        if self.startup and update:
+            # Note the first frame, then get out of the way for the rest
+            def during_go_func(t):
+                self.startup.mark('first frame')
+                controller.during_go_func = update
+                return update(t)
+
+        controller = FunctionController(during_go_func=during_go_func,
                                         between_go_func=pause_update,
-                                        return_type=NoneType) )
+                                        return_type=NoneType)
+        self.presentation.add_controller(None, None, controller)
+
+
+    def set_realtime(self, realtime):
+        """Opt in to real-time mode (see cognac.RealTime) - this sets up
+        everything we can, and logs what worked"""
+        self.realtime = realtime
+        logger = logging.getLogger('VisionEgg')
+        for what, ok, details in realtime.setup():
+            if ok:
+                logger.info('Real-time mode: %s (%s)' % (what, details))
+            else:
+                logger.warning('Real-time mode: no %s (%s)' % (what, details))
 
+        return realtime.report
 
     def go(self, go_duration=('forever',)):
         self.presentation.parameters.go_duration = go_duration
-        self.presentation.go()
+        if self.realtime:
+            self.realtime.start_go()
+        try:
+            self.presentation.go()
+        finally:
+            if self.realtime:
+                self.realtime.end_go()
 
     def pause(self):
         self.presentation.parameters.go_duration = (0, 'frames')
@@ -211,35 +258,22 @@ class SimpleVisionEgg:
         goodResp = [response[0]]
         goodRespTime = [responseTime[0]-timeToSubtract]
 
-        # Now step through every other item in the response list to check for unique-ness.
-        for i in range(1,len(responseTime)):
-
-            if (not(response[i] == response[i-1]) or \
-                    (responseTime[i] - responseTime[i-1] > \
-                         min_interval)):
-                # ie, if something changed, or we have a long gap:
-                
-                offsetResp = [] # we might want to save an offset
-                for item in response[i-1]: # loop through last item's data
-                    if (responseTime[i] - responseTime[i-1] < \
-                            min_interval) and \
-                            not(item in response[i]):
-                        # Bit clunky.  Basically, holding down a key while pressing another creates
-                        # a unique response.  So if you only let up one of those keys, code the
-                        # offset just for that key.
-                        offsetResp.append(item+'_Off')
-                    else:
-                        # it's been long enough that everything that was on should be called off.
-                        offsetResp.append(item+'_Off')
-
-                if len(offsetResp) > 0:
-                    # If there's offset stuff to worry about, save it.
-                    goodResp.append(offsetResp)
-                    goodRespTime.append(responseTime[i-1]-timeToSubtract)
-                
-                # Save the new (onset) response.
-                goodResp.append(response[i])
-                goodRespTime.append(responseTime[i]-timeToSubtract)
+        # Find everywhere something changed, or we have a long gap, in one go
+        # (see cognac.KeyState) - then we only visit those samples
+        for i in change_points(response, responseTime, min_interval):
+            # Everything that was on is now off - holding down a key while
+            # pressing another creates a unique response, so even the key
+            # that's still down gets an offset (and a new onset)
+            offsetResp = [item+'_Off' for item in response[i-1]]
+
+            if len(offsetResp) > 0:
+                # If there's offset stuff to worry about, save it.
+                goodResp.append(offsetResp)
+                goodRespTime.append(responseTime[i-1]-timeToSubtract)
+            
+            # Save the new (onset) response.
+            goodResp.append(response[i])
+            goodRespTime.append(responseTime[i]-timeToSubtract)
 
         # The final event should be an offset for whatever was down.
         offsetResp = []
@@ -250,3 +284,10 @@ class SimpleVisionEgg:
 
         return (goodResp, goodRespTime)
 
+    def get_key_events(self, timeToSubtract=0, min_interval=2.0/60):
+        """Like get_responses, but as compact arrays - one entry per key press.
+
+        Returns (key_names, keys, onsets, offsets), see cognac.KeyState"""
+        return key_events(self.keyboard_controller.get_responses_since_go(),
+                    self.keyboard_controller.get_time_responses_since_go(),
+                    timeToSubtract, min_interval)
@@ -0,0 +1,86 @@
+"""Startup.py times how long it takes to get from launching to our first frame.
+
+VisionEgg.log shows 10 seconds or more between "Script started" and
+"Requesting window" on most launches - mostly the configuration dialog, and
+probing GL. With a display profile that's gone (see
+DisplayProfile.apply), and a StartupTrace lets us see that it stays gone. We
+note when each phase finishes:
+
+    import - python, and all our imports (from when the process started)
+    screen - getting the screen (and window) from VisionEgg
+    stimuli - making our stimuli and the Presentation
+    first frame - the first update of the first go
+
+and log them to VisionEgg.log on the first frame, where
+cognac.VisionEggLog picks them up."""
+
+import logging
+import os
+import time
+
+
+def process_start():
+    '''When this process started (as from time.time), or None if we can't
+    tell (i.e., not Linux)'''
+    try:
+        stat = open('/proc/self/stat').read()
+        # The command can have spaces in it, so we count from the end of it
+        start_ticks = int(stat.rsplit(')', 1)[1].split()[19])
+        for line in open('/proc/stat'):
+            if line.startswith('btime'):
+                boot = int(line.split()[1])
+                break
+        else:
+            return None
+    except (IOError, IndexError, ValueError):
+        return None
+
+    return boot + float(start_ticks) / os.sysconf('SC_CLK_TCK')
+
+
+class StartupTrace:
+    phases = ('import', 'screen', 'stimuli', 'first frame')
+
+    start = None
+    logged = False
+
+    def __init__(self, start=None):
+        '''start defaults to when the process started - or now, if we can't
+        find that out'''
+        if start is None:
+            start = process_start()
+        if start is None:
+            start = time.time()
+        self.start = start
+        # phase -> time.time() it finished
+        self.marks = {}
+
+    def mark(self, phase):
+        '''phase is done - the first time we hear about it is the one that
+        counts. The first frame also gets everything logged.'''
+        if phase not in self.marks:
+            self.marks[phase] = time.time()
+            if phase == self.phases[-1]:
+                self.log()
+
+    def durations(self):
+        '''(phase, seconds) for the phases we've got, in order'''
+        durations = []
+        last = self.start
+        for phase in self.phases:
+            if phase in self.marks:
+                durations.append((phase, self.marks[phase] - last))
+                last = self.marks[phase]
+
+        return durations
+
+    def summary(self):
+        durations = self.durations()
+        total = sum(seconds for phase, seconds in durations)
+        return 'Startup: %s (%.3f s in all)' % \
+                (', '.join('%s %.3f s' % d for d in durations), total)
+
+    def log(self):
+        if not self.logged:
+            logging.getLogger('VisionEgg').info(self.summary())
+            self.logged = True
@@ -7,24 +7,31 @@ simply instantiate a new StimulusController for each trial, for example -
 adaptive logic would be out of place here.
 
 Now that things have been made a little more general, you can do adaptive
-stuff... but its not obvious."""
+stuff... but its not obvious. For that, write the trial as a script instead -
+see cognac.CoroutineTrial."""
 
 
 
 from datetime import date
 import time
 from copy import copy
-from csv import DictWriter
+from warnings import warn
 
 import pygame
 
+from cognac.TrialLog import TrialLog
+from cognac.ResponseDevices import keyboard
 
-class RelTime:
+
+class RelTime(object):
+    '''A time relative to something in the Trial log - by default, the start of
+    the Trial'''
+    __slots__ = ('ref', 'offset')
     units = 'seconds'
-    ref = 'trial_start'
-    offset = 0
 
     def __init__(self, t):
+        self.ref = 'trial_start'
+        self.offset = 0
         if isinstance(t, str):
             vals = t.split('+', 1)
             self.ref = vals[0]
@@ -52,36 +59,48 @@ class Response(object):
     '''A generic response class that maintains information about key-presses. 
     
     Can be overridden to handle more complex hardware.
+
+    We use __slots__, so there are no class-level defaults for these - everything
+    is set in __init__ and reset. Subclasses should declare their own
+    __slots__ (even if it's empty) and set their extra state in reset.
     '''
-    ## These are things you can set to affect the Response behavior
-
-    # The name of the response for relative timing
-    label = None
-    # The "correct" keypress
-    expected = None
-    # Acceptable keypresses (the full set, a list), all other keys are ignored
-    limit = None
-    # You might change this to, e.g., pygame.KEYUP
+    __slots__ = (
+        ## These are things you can set to affect the Response behavior
+
+        # The name of the response for relative timing
+        'label',
+        # The "correct" keypress
+        'expected',
+        # Acceptable keypresses (the full set, a list), all other keys are
+        # ignored
+        'limit',
+        # Should maybe shift to derived class
+        'timelimit',
+        # Where presses come from - see cognac.ResponseDevices
+        'device',
+        # limit, as a set of device codes
+        'limit_codes',
+
+        ## These should be set by the Response instance itself!
+
+        # time from start of Trial when response was registered
+        'ref_time',
+        'response',
+        'rt',
+        )
+
+    # You might change this to, e.g., pygame.KEYUP - it's what the default
+    # (keyboard) device listens for
     response_type = pygame.KEYDOWN
 
-    ## These should be set by the Response instance itself!
-
-    # time from start of Trial when response was registered
-    ref_time = None
-    response = None
-    rt = None
-
-    # Should maybe shift to derived class
-    timelimit = None
+    # What goes in the log, and in what order. Subclasses with more to say
+    # should do something like:
+    # log_fields = Response.log_fields + ('my_extra_stuff',)
+    log_fields = ('expected', 'ref_time', 'response', 'rt')
 
-    # You can change this, but that would be an "advanced" maneuver. Do
-    # something like:
-    # unlogged = Response.unlogged + ('my_secret_stuff')
-    unlogged = ('limit', 'label', 'response_type', 'timelimit')
-
-    def __init__(self, label, expected=None, limit=None, timelimit=None):
-        '''We're careful here so that our __dict__ will have only entries we've
-        actually updated
+    def __init__(self, label, expected=None, limit=None, timelimit=None,
+                 device=None):
+        '''Anything left as None won't show up in the log
 
         label : str
             how the response is named in the csv
@@ -90,14 +109,35 @@ class Response(object):
         timelimit : numeric
             is measured from time of response registration, and aborts the
             response.
+        device : cognac.ResponseDevices.ResponseDevice
+            defaults to the pygame keyboard
         '''
         self.label = label
-        if expected is not None:
-            self.expected = expected
+        self.expected = expected
+        self.limit = limit
+        self.timelimit = timelimit
+        if device is None:
+            device = keyboard(self.response_type)
+        self.device = device
+        self.limit_codes = None
         if limit is not None:
-            self.limit = limit
-        if timelimit is not None:
-            self.timelimit = timelimit
+            self.limit_codes = device.codes(limit)
+        self.reset()
+
+    def reset(self):
+        '''Clear out everything from the last time we were used, so we can be
+        re-used for another trial'''
+        self.ref_time = None
+        self.response = None
+        self.rt = None
+
+    def log_items(self):
+        '''(param, value) pairs for each of our log_fields that's actually been
+        set'''
+        for param in self.log_fields:
+            param_value = getattr(self, param)
+            if param_value is not None:
+                yield param, param_value
 
     def record_response(self, t):
         '''The function that's called each time through the event loop
@@ -107,28 +147,43 @@ class Response(object):
             by the StimController event loop
         
         This could be overridden to do extended feedback, like data entry
-        or updating feedback during response collection'''
+        or updating feedback during response collection - though for
+        anything that's just about the keys, override press instead'''
         
-        responses = pygame.event.get(self.response_type)
-        # We're keeping our event queue tidy - which might be bad depending on
-        # your experiment! Subclass if necessary
-        pygame.event.clear()
-
-        for r in responses:
-            r_name = pygame.key.name(r.key)
-            # Just grab the first thing we get if self.limit is not defined
-            if self.limit is None or r_name in self.limit:
-                self.response = r_name
-                self.rt = t - self.ref_time
+        for code, timestamp in self.device.poll():
+            if self.press(t, code, timestamp):
                 return True
 
         if self.timelimit is not None and \
                 t - self.ref_time >= self.timelimit:
-            self.rt = t - self.ref_time
+            self.expire(t)
+            return True
+
+        return False
+
+    def expire(self, t):
+        '''We ran out of time at t without a press - response stays None, and
+        rt is how long we waited'''
+        self.rt = t - self.ref_time
+
+    def press(self, t, code, timestamp):
+        '''Deal with one press from our device - returns True if that's our
+        response'''
+        # Just grab the first thing we get if self.limit is not defined
+        if self.limit_codes is None or code in self.limit_codes:
+            self.response = self.device.name(code)
+            self.rt = self.event_time(t, timestamp) - self.ref_time
             return True
 
         return False
 
+    def event_time(self, t, timestamp):
+        '''Convert a device timestamp (from time.time) to our t - if there
+        isn't one, it happened now'''
+        if timestamp is None:
+            return t
+        return t - (time.time() - timestamp)
+
     def response_time(self):
         '''This is trivial, but might not be with other response types'''
         try:
@@ -137,28 +192,33 @@ class Response(object):
             return None
 
 
-class Event:
+class Event(object):
     """
     Events take:
     first, the stim used, a VisionEgg.Stimulus class instance
     start, duration, stop -- times in seconds since beginning of Trial
     log -- a dict
     response - a Response instance
+    name - what the event is for, in the log (its response label if not)
     """
     '''A thin wrapper around VisionEgg stimuli.  Most of the code is now for
     backwards compatibility'''
 
-    # Usually a VisionEgg stimulus
-    target = None
-
-    # Computed from parms
-    start = None
-    stop = None
-    parms = None
-    # Things to log
-    log = None
-    # Responses to get
-    response = None
+    __slots__ = (
+        # Usually a VisionEgg stimulus
+        'target',
+        # Computed from parms
+        'start',
+        'stop',
+        'parms',
+        # Things to log
+        'log',
+        # Responses to get
+        'response',
+        # What it's for, e.g. 'value' - for logging things that don't have a
+        # response
+        'name',
+        )
 
     @classmethod
     def from_yaml(cls, yaml_event, target_dict=None):
@@ -183,7 +243,7 @@ class Event:
         return cls(target, **parms)
 
     def __init__(self, target, start, stop=None, duration=None,
-                 log=None, response=None, **parms):
+                 log=None, response=None, name=None, **parms):
         '''Currently doesn't check to see that stop or duration is specified.
         This leads to an error in RelTime.'''
         self.target = target
@@ -197,26 +257,127 @@ class Event:
         self.parms = parms
         self.log = log
         self.response = response
+        self.name = name
+
+    def label(self):
+        '''How we show up in the log - our response's label, or our name
+        (None if we have neither)'''
+        if self.response:
+            return self.response.label
+        return self.name
+
+    def prepare(self):
+        '''Give our target a chance to get ready ahead of time - anything with
+        a prepare method gets called with the same parms as set.
+
+        The Text and texture stimuli don't have one: every trial draws with
+        the same few stimuli, so the next trial's text can't go in until this
+        one is done with them, and VisionEgg renders text and uploads
+        textures from the drawing thread anyway.'''
+        try:
+            prepare = self.target.prepare
+        except AttributeError:
+            return self
+
+        prepare(**self.parms)
+        return self
+
+    def cancel(self):
+        '''Let our target give up anything prepare got ready - anything with
+        a cancel method gets it called'''
+        try:
+            cancel = self.target.cancel
+        except AttributeError:
+            return self
+
+        cancel()
+        return self
         
-    def activate(self):
+    def activate(self, batch=None):
+        '''If you give an UpdateBatch, our parms go there instead of straight
+        to the target'''
         if self.target is not None:
-            self.target.set(**self.parms)
+            if batch is None:
+                self.target.set(**self.parms)
+            else:
+                batch.set(self.target, self.parms)
         return self
 
-    def deactivate(self):
+    def deactivate(self, batch=None):
         if self.target is not None:
-            self.target.set(on=False)
+            if batch is None:
+                self.target.set(on=False)
+            else:
+                batch.set(self.target, {'on': False})
         return self
 
 
-class Trial:
-    curr_response = None
-    events = None # stimuli, etc.
-    active_events = None
-    # The actual log of responses and stuff
-    log = None
-    unlogged = False
-    
+class UpdateBatch(object):
+    '''Collects all of the parameter changes for a frame, and sets them just
+    before we draw - once per target, and only the ones that actually change
+    something.
+
+    This means the order of activates and deactivates within a frame doesn't
+    matter for a given parameter (the last one wins), and re-setting something
+    that's already on the screen (like the pause_event) costs nothing.
+
+    Only VisionEgg-style targets (with a .parameters) get batched - anything
+    else, like a Recording, has side effects in set, so it goes straight
+    through.'''
+    __slots__ = ('pending', 'order')
+
+    def __init__(self):
+        # target -> dict of parms
+        self.pending = {}
+        # so we set things in the order they were first touched
+        self.order = []
+
+    def set(self, target, parms):
+        try:
+            self.pending[target].update(parms)
+        except KeyError:
+            if not hasattr(target, 'parameters'):
+                target.set(**parms)
+                return
+            self.pending[target] = dict(parms)
+            self.order.append(target)
+
+    def flush(self):
+        for target in self.order:
+            current = target.parameters
+            changed = {}
+            for name, value in self.pending[target].iteritems():
+                try:
+                    if bool(getattr(current, name) == value):
+                        continue
+                except (AttributeError, ValueError):
+                    # Missing, or something like an array we can't compare
+                    pass
+                changed[name] = value
+            if changed:
+                target.set(**changed)
+
+        self.pending.clear()
+        del self.order[:]
+
+
+class Trial(object):
+    __slots__ = (
+        'curr_response',
+        # The full list of events, in order - we never modify this
+        'schedule',
+        'events', # stimuli, etc., still to be activated
+        'active_events',
+        # The actual log of responses and stuff
+        'log',
+        'unlogged',
+        # If this is set, we schedule in whole frames (see event_ready)
+        'frame_period',
+        # (label, intended time) for events we activated last frame - see
+        # log_flips
+        'onsets',
+        )
+
     @classmethod
     def from_yaml(cls, yaml_events, event_dict=None):
         return cls([Event.from_yaml(y, event_dict) for y in yaml_events])
@@ -229,38 +390,85 @@ class Trial:
         events :
             a list of `Event`s
         '''
-        if unlogged is not None:
-            self.unlogged = unlogged
-        self.events = events
+        self.unlogged = bool(unlogged)
+        self.frame_period = None
+        self.schedule = events
+        self.reset()
+
+    def reset(self):
+        '''Get ready to run (again) from the top - the events we pop off
+        during a run come back from self.schedule'''
+        self.events = list(self.schedule)
         self.active_events = []
-        self.log = {}    
-
-    def event_ready(self, event_time, t):
+        self.curr_response = None
+        self.log = {}
+        self.onsets = []
+        for event in self.schedule:
+            if event.response:
+                event.response.reset()
+
+    def ref_time(self, event_time):
+        '''The time event_time is relative to, or None if that hasn't happened
+        yet'''
         try:
             ref_time = self.log[event_time.ref]
         except KeyError:
             # The ref event hasn't even been registered yet!
-            return False
+            return None
 
         try:
             # Check if this is a class with a response_time, otherwise we assume
             # it's simply a number
-            ref_time = ref_time.response_time()
+            return ref_time.response_time()
         except AttributeError:
-            pass
+            return ref_time
 
+    def event_ready(self, event_time, t):
+        '''With a frame_period, we count whole frames from the reference
+        instead of comparing seconds. Whatever we activate now shows up on the
+        next flip, and so did the reference, so this picks the frame whose
+        flip is closest to the requested time - rather than the first frame
+        after it, which is up to a frame late.'''
+        ref_time = self.ref_time(event_time)
         if ref_time is None:
             return False
-        else:
+        elif self.frame_period is None:
             return t - ref_time >= event_time.offset
-
-    def activate_events(self, t):
+        else:
+            return round((t - ref_time) / self.frame_period) >= \
+                   round(event_time.offset / self.frame_period)
+
+    def log_frame_error(self, event, t):
+        '''Note when event was meant to come on - we log how far off it was
+        on the next frame, in log_flips. Events without a label (see
+        Event.label) don't get logged.'''
+        label = event.label()
+        if label is not None:
+            self.onsets.append((label, self.ref_time(event.start) +
+                                       event.start.offset))
+
+    def log_flips(self, t):
+        '''Log how many frames late (or early) the events we activated last
+        frame came on, as <label>.frame_error.
+
+        t is when this frame started, which is just after the last frame's
+        flip - the one those events first appeared on. Everything shows up a
+        frame after the t it was activated at, references included, so they
+        were meant to appear a frame_period after their intended time.'''
+        for label, intended in self.onsets:
+            error = (t - self.frame_period - intended) / self.frame_period
+            self.log[label + '.frame_error'] = int(round(error))
+        del self.onsets[:]
+
+    def activate_events(self, t, batch=None):
         # We can potentially activate several events if they are all ready
         while self.events:
             if self.event_ready(self.events[0].start,  t):
                 event = self.events.pop(0)
-                event.activate()
+                event.activate(batch)
                 self.active_events.append(event)
+                if self.frame_period is not None:
+                    self.log_frame_error(event, t)
 
                 if event.log:
                     for log_k, log_v in event.log.items():
@@ -268,7 +476,7 @@ class Trial:
                 if event.response:
                     # Make sure we only get inputs after the start of the
                     # response period
-                    pygame.event.clear()
+                    event.response.device.clear()
 
                     event.response.ref_time = t
                     self.log[event.response.label] = event.response
@@ -281,39 +489,141 @@ class Trial:
                 self.curr_response.record_response(t):
             self.curr_response = None
 
-    def deactivate_events(self, t):
+    def deactivate_events(self, t, batch=None):
         # We make a copy so we can modify the real list
         for event in copy(self.active_events):
             if self.event_ready(event.stop, t):
-                event.deactivate()
+                event.deactivate(batch)
                 self.active_events.remove(event)
 
     def done(self):
         return not (self.events or self.active_events)
 
+    def prepare(self):
+        '''Called while the previous trial is still waiting on a response, so
+        that slow setup doesn't land on our first frame'''
+        for event in self.events:
+            event.prepare()
+
+    def cancel(self):
+        '''Undo prepare (and stop anything still going) - for when we won't
+        be running after all'''
+        for event in self.schedule:
+            event.cancel()
+
+    def write_log(self, trial_log, row):
+        '''Copy our log into row of a TrialLog, flattening Responses into
+        "label.param" columns'''
+        for label, obj in self.log.iteritems():
+            if isinstance(obj, Response):
+                for param, param_value in obj.log_items():
+                    trial_log.set(row, label + '.' + param, param_value)
+            else:
+                # It's just a number or string (we hope)
+                trial_log.set(row, label, obj)
+
 
 class StimController:
     # Stimulus related attributes
     trials = None
     pause_event = None
+    # All stimulus changes for a frame go in here (see UpdateBatch)
+    batch = None
 
     # SimpleVisionEgg instance
     vision_egg = None
 
+    # A TrialLog, with a row for each logged trial
+    trial_log = None
+    # Something with a send_row(row, data) - e.g., a
+    # cognac.Collector.CollectorClient - that gets each row as it's done
+    collector = None
+    # A cognac.Telemetry.Telemetry, which hears about every frame
+    telemetry = None
+    # A cognac.Mirror.Mirror, which hears about every frame too
+    mirror = None
+    # From a cognac.DisplayProfile, if we've got one
+    display_profile = None
+    timing_watch = None
+    # A cognac.Checkpoint.Checkpoint, saved after every trial
+    checkpoint = None
+    # Something with a trial_done(trial, row) - e.g., a
+    # cognac.Adaptive.AdaptiveSelector - that hears about each trial as it's
+    # logged, before the next one starts
+    selector = None
+    # A cognac.Profiler.SamplingProfiler, which we tell when trials start and
+    # stop
+    profiler = None
+    curr_trial = None
+    # The trial after curr_trial, which may already be prepared
+    next_trial = None
+    curr_row = 0
+    # Trials finished (logged or not), and the files they made - see
+    # checkpoint
+    trials_done = 0
+    files = None
+    # Added to every t, so a resumed block carries on where it stopped
+    t_offset = 0.0
+
     # Attribs for keeping track of experiment
     go_duration = ('forever', )
+    # Measured seconds per frame, for frame-locked scheduling - if this is
+    # None, we just compare times in seconds
+    frame_period = None
     state = None
     trials_to_run = 0 # == run all of them
+    # Whether the last go stopped after trials_to_run, with more to come
+    between_runs = False
 
 
-    def __init__(self, trials, vision_egg, pause_event=None):
+    def __init__(self, trials, vision_egg, pause_event=None,
+                 frame_period=None, collector=None, telemetry=None,
+                 display_profile=None, checkpoint=None, selector=None,
+                 profiler=None, mirror=None):
         """vision_egg is an instance of SimpleVisionEgg
         pause_event is an Event which will be shown at the beginning of
-        every stim_controller.run_trials loop."""
+        every stim_controller.run_trials loop.
+        frame_period is the measured time between frames - with it, all
+        RelTimes get rounded to whole frames, and each event logs how many
+        frames off it was.
+        collector gets each row of the log as soon as its trial is done.
+        telemetry publishes our progress for monitor_block.py.
+        display_profile is a cognac.DisplayProfile.DisplayProfile - if it
+        says we're vsync locked, its frame_period is the default, and we
+        warn between go's if timing is a lot worse than at calibration.
+        checkpoint gets saved after every trial - see resume.
+        selector hears about each trial as soon as it's logged.
+        profiler samples the trials it wants.
+        mirror publishes snapshots of the screen for mirror_view.py."""
             
         self.trials = trials
         self.vision_egg = vision_egg
         self.pause_event = pause_event
+        self.frame_period = frame_period
+        self.collector = collector
+        self.telemetry = telemetry
+        self.checkpoint = checkpoint
+        self.selector = selector
+        self.profiler = profiler
+        self.mirror = mirror
+        self.files = []
+        if telemetry is not None:
+            telemetry.reset()
+        self.display_profile = display_profile
+        if display_profile is not None:
+            from cognac.DisplayProfile import TimingWatch
+            self.timing_watch = TimingWatch(display_profile)
+            if frame_period is None and display_profile.vsync_locked:
+                self.frame_period = display_profile.frame_period
+        self.batch = UpdateBatch()
+
+        # If we can, make room for all of our rows up front - but we only
+        # look through lists, as other iterables (like an AdaptiveSelector)
+        # can only be gone through once
+        num_rows = 0
+        if isinstance(trials, (list, tuple)):
+            num_rows = len([t for t in trials if not t.unlogged])
+        self.trial_log = TrialLog(num_rows)
 
         self.state = self.state_generator()
         self.state.next()
@@ -323,54 +633,158 @@ class StimController:
 
     def run_trials(self, num=0):
         self.trials_to_run = num
-        self.vision_egg.go()
-
-    def compute_go_duration(self, units='seconds'):
-        """This should run through the trials, find the latest stimulus and add
-        this info up, putting it in go_duration"""
-        go_duration = 0
-        for trial in self.trials:
-            max_time = 0
-            for event in trial.events:
-                if self.stop > max_time:
-                    max_time = self.stop
-
-            go_duration += max_time
+        self.between_runs = False
+        try:
+            self.vision_egg.go()
+        finally:
+            # Unless we stopped after num trials with more to come, the block
+            # is over (finished, quit or crashed) - so nothing we prepared
+            # is going to run
+            if not self.between_runs:
+                self.cancel_prepared()
+
+    def cancel_prepared(self):
+        for trial in (self.curr_trial, self.next_trial):
+            if trial is not None:
+                trial.cancel()
+
+    def compute_go_duration(self, units='seconds', analyzer=None):
+        """This runs through the trials, finding when the last stimulus of each
+        one goes off, and puts a generous (99th percentile) estimate of the
+        total in go_duration.
+
+        Response times come from analyzer, a cognac.ScheduleAnalyzer - give it
+        an RTModel fitted to old logs for better numbers. By default it uses
+        our frame_period (or our display_profile's, or this machine's).
+        Returns the full BlockReport, which also has peak numbers of active
+        events."""
+        # ScheduleAnalyzer needs us, so we import it here
+        from cognac.ScheduleAnalyzer import ScheduleAnalyzer
+
+        if analyzer is None:
+            frame_period = self.frame_period
+            if frame_period is None and self.display_profile is not None:
+                frame_period = self.display_profile.frame_period
+            if frame_period is None:
+                frame_period = 'machine'
+            analyzer = ScheduleAnalyzer(frame_period=frame_period)
+        if units == 'frames' and analyzer.frame_period is None:
+            raise ValueError("Can't count frames with an analyzer that works "
+                             "in continuous time (frame_period is None)")
+        report = analyzer.analyze(self.trials)
+
+        go_duration = report.duration(99)
+        if go_duration == float('inf'):
+            # Something's never going to happen
+            self.go_duration = ('forever', )
+        elif units == 'frames':
+            self.go_duration = (int(round(go_duration / 
+                                          analyzer.frame_period)), units)
+        else:
+            self.go_duration = (go_duration, units)
 
-        self.go_duration = (go_duration, units)
+        return report
 
     def update(self, t):
         """Wrapper to adapt the state generator into a regular function"""
+        # Everything sees the same t as the log (they only differ after
+        # resume)
+        t += self.t_offset
         self.state.send(t)
+        self.batch.flush()
+        if self.telemetry is not None:
+            self.telemetry.frame(self, t)
+        if self.mirror is not None:
+            self.mirror.frame(self, t)
+        if self.timing_watch is not None:
+            self.timing_watch.frame(t)
 
     def pause_update(self):
         """Simple function to set the screen displaying some text"""
         if self.pause_event:
-            self.pause_event.activate()
+            self.pause_event.activate(self.batch)
+            self.batch.flush()
+        if self.profiler is not None:
+            self.profiler.stop_trial()
+        if self.timing_watch is not None:
+            for warning in self.timing_watch.check():
+                warn('Frame timing: ' + warning)
 
     def state_generator(self):
+        # We keep one trial ahead, so we can prepare it while the current
+        # trial is waiting on the participant. The first one gets prepared
+        # right away, before we're presenting anything.
+        trial_iter = iter(self.trials)
+        next_trial = self.next_trial = next(trial_iter, None)
+        if next_trial is not None:
+            next_trial.prepare()
+
         # Initial yeild to get us into accepting "send" calls
         t = yield
 
         trial_num = 0
-        for trial in self.trials:
+        while next_trial is not None:
+            trial = next_trial
+            next_trial = self.next_trial = next(trial_iter, None)
+            prefetched = next_trial is None
+            # The garbage collector's off during go's in real-time mode (see
+            # cognac.RealTime), and a block is usually one go - so once per
+            # trial, it gets a frame where we're only waiting on the
+            # participant
+            realtime = getattr(self.vision_egg, 'realtime', None)
+            collected = realtime is None
             trial_num += 1
+            self.curr_trial = trial
+            trial.frame_period = self.frame_period
             if self.pause_event:
-                self.pause_event.deactivate()
+                self.pause_event.deactivate(self.batch)
             trial.log['trial_start'] = t
+            if self.profiler is not None:
+                self.profiler.start_trial(self.curr_row,
+                        getattr(trial, 'condition', None) or
+                        trial.log.get('condition', '-'))
 
             # Note that the order of activates, deactivates and yields is
             # critical for instantaneous stimuli to appear properly (or at all)
             while True:
-                trial.deactivate_events(t)
+                if trial.onsets:
+                    trial.log_flips(t)
+                trial.deactivate_events(t, self.batch)
                 trial.log_response(t)
-                trial.activate_events(t)
+                trial.activate_events(t, self.batch)
                 if trial.done():
                     break
+                if not prefetched and trial.curr_response is not None:
+                    next_trial.prepare()
+                    prefetched = True
+                elif not collected and trial.curr_response is not None and \
+                        trial.curr_response.ref_time < t:
+                    realtime.between_trials()
+                    collected = True
                 t = yield
 
+            if not trial.unlogged:
+                trial.write_log(self.trial_log, self.curr_row)
+                if self.collector is not None:
+                    self.collector.send_row(self.curr_row,
+                                        self.trial_log.row(self.curr_row))
+                if self.selector is not None:
+                    self.selector.trial_done(trial,
+                                        self.trial_log.row(self.curr_row))
+                self.curr_row += 1
+            self.curr_trial = None
+            if self.profiler is not None:
+                self.profiler.stop_trial()
+            self.trials_done += 1
+            for event in trial.schedule:
+                if 'fname' in event.parms:
+                    self.files.append(event.parms['fname'])
+            if self.checkpoint is not None:
+                self.checkpoint.save(self, t)
+
             if trial_num == self.trials_to_run:
                 trial_num = 0
+                self.between_runs = True
                 self.vision_egg.pause()
                 t = yield
 
@@ -378,54 +792,40 @@ class StimController:
         self.vision_egg.pause()
         yield
 
+    def resume(self, state):
+        '''Carry on from a checkpoint (from Checkpoint.load) - our trials
+        should be the ones that weren't done yet. Call this before
+        run_trials.'''
+        for row, values in enumerate(state['rows']):
+            for name, value in values.iteritems():
+                self.trial_log.set(row, name, value)
+        self.curr_row = len(state['rows'])
+        self.trials_done = state['trials_done']
+        self.files = list(state['files'])
+        self.t_offset = state['t']
+
+    def flush_log(self):
+        '''Trials write their rows when they finish - this gets whatever the
+        current trial has so far, e.g. if we quit in the middle of it'''
+        if self.curr_trial is not None and not self.curr_trial.unlogged:
+            self.curr_trial.write_log(self.trial_log, self.curr_row)
+
     def loglines(self):
-        '''Generator that returns the lines of a log file in list format, this
-        allows for easy programmatic processing, or otherwise feeding to a
-        csv.Writer
+        '''Returns the header and lines of a log file (as dicts), this allows
+        for easy programmatic processing, or otherwise feeding to a
+        csv.DictWriter
         
-        This function takes everything and puts it in one big table - padded
-        with Nones for missing items.  You may want to use something else if
-        your log would be relatively "sparse"'''
-        def conv_log(items):
-            '''This converts our responses to a flat dict'''
-            retval = {} 
-            for label, obj in items:
-                try:
-                    # For greater generality, this could be a method of
-                    # Response...
-                    for param, param_value in obj.__dict__.items():
-                        if param not in obj.unlogged:
-                            comp_key = '.'.join((label, param))
-                            retval[comp_key] = param_value
-                except AttributeError:
-                    # It's just a number or string (we hope)
-                    retval[label] = obj 
-
-            return retval
-
-        log = []
-        header = set()
-        for t in self.trials:
-            if t.unlogged:
-                continue
-            log_line = conv_log(t.log.items())
-            log.append(log_line) 
-            header.update(log_line)
-
-        header = sorted(header)
-
-        return header, log
+        This puts everything in one big table - missing items are just left
+        out of the dicts.  You may want to use something else if your log
+        would be relatively "sparse"'''
+        self.flush_log()
+
+        return self.trial_log.header(), self.trial_log.rows()
 
     def writelog(self, f):
         '''Write log to f - f can be a filename or a file opened for writing'''
-        header, log = self.loglines()
-        try:
-            dw = DictWriter(f, header)
-        except TypeError:
-            dw = DictWriter(open(f, 'w'), header)
-
-        dw.writer.writerow(header)
-        dw.writerows(log)
+        self.flush_log()
+        self.trial_log.to_csv(f)
 
     def getOutputFilename(self, subjectName, experimentname):
         # function to avoid overwriting data
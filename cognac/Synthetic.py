@@ -0,0 +1,174 @@
+"""Synthetic.py makes up participants, so we can run lots of blocks headless
+and see how fast StimController, Trial and the Responses go.
+
+A SyntheticScript plugs into cognac.Replay.ScriptedInput in place of a log.
+Response times come from a cognac.ScheduleAnalyzer.RTModel, keys come from
+each Response's limit, and typed answers (anything that logs a start_time,
+like EstimateResponse) come from a TypingModel - with the odd typo and
+backspace. A FrameTimer wraps the StimController's update and adds up the
+time spent per frame, by condition.
+
+Usage is something like:
+
+    script = SyntheticScript(RTModel().fit(['practice/practice-log.csv']))
+    timer = run_synthetic(trials, HeadlessVisionEgg(), script)
+    print timer.summary()
+
+load_test.py does this for whole subject trees."""
+
+import time
+
+import numpy as np
+
+from cognac.StimController import StimController
+from cognac.ScheduleAnalyzer import RTModel
+from cognac.Replay import ScriptedInput, typed_keys
+
+
+class TypingModel:
+    '''How a synthetic participant types in an answer'''
+    # What they type - something like the estimates in our logs
+    answers = ('6.5b', '300m', '12b', '45', '1.2m', '80 million', '3000')
+    # mean and sd of log(seconds) between keys - a median of about 0.2 s
+    key_interval = (-1.6, 0.4)
+    # Chance of hitting a wrong key (which gets backspaced) on each character
+    typo_rate = 0.05
+    typo_keys = '0123456789.bm'
+    backspace = 'backspace'
+    enter = 'return'
+
+    def __init__(self, answers=None, key_interval=None, typo_rate=None):
+        if answers is not None:
+            self.answers = answers
+        if key_interval is not None:
+            self.key_interval = key_interval
+        if typo_rate is not None:
+            self.typo_rate = typo_rate
+
+    def keys(self, rng=np.random):
+        '''Key names for one answer, ending with enter'''
+        keys = []
+        for key in typed_keys(self.answers[rng.randint(len(self.answers))]):
+            if rng.random_sample() < self.typo_rate:
+                keys.append(self.typo_keys[rng.randint(len(self.typo_keys))])
+                keys.append(self.backspace)
+            keys.append(key)
+
+        return keys + [self.enter]
+
+    def intervals(self, size, rng=np.random):
+        return rng.lognormal(self.key_interval[0], self.key_interval[1], size)
+
+
+class SyntheticScript:
+    '''Makes up key presses for cognac.Replay.ScriptedInput
+
+    For typed responses, the RT model gives the time to the first key, and
+    the typing model does the rest. Anything else presses one of the keys in
+    its limit (or space, if it'll take anything) after an RT.'''
+    rt_model = None
+    typing = None
+    any_key = 'space'
+
+    def __init__(self, rt_model=None, typing=None, rng=np.random):
+        if rt_model is None:
+            rt_model = RTModel()
+        if typing is None:
+            typing = TypingModel()
+        self.rt_model = rt_model
+        self.typing = typing
+        self.rng = rng
+
+    def keys(self, row, response, trial):
+        start = response.ref_time - trial.log['trial_start'] + \
+                self.rt_model.sample(response.label, 1, self.rng)[0]
+
+        if 'start_time' in response.log_fields:
+            keys = self.typing.keys(self.rng)
+            times = start + np.cumsum(np.append(0, self.typing.intervals(
+                                                    len(keys) - 1, self.rng)))
+            return zip(times.tolist(), keys)
+        elif response.limit:
+            return [(start, response.limit[self.rng.randint(
+                                                    len(response.limit))])]
+        else:
+            return [(start, self.any_key)]
+
+
+class FrameTimer:
+    '''Stands in for a StimController's update function, and adds up the
+    time each frame takes, by condition (trials without one are None)'''
+    stim_control = None
+    # condition -> frames, seconds, and the longest frame
+    frames = None
+    seconds = None
+    longest = None
+    # condition -> number of trials we've seen start
+    trials = None
+    last_trial = None
+
+    def __init__(self, stim_control):
+        self.stim_control = stim_control
+        self.frames = {}
+        self.seconds = {}
+        self.longest = {}
+        self.trials = {}
+
+    def __call__(self, t):
+        start = time.time()
+        self.stim_control.update(t)
+        elapsed = time.time() - start
+
+        # Between trials, we count the frame towards the one just starting
+        trial = self.stim_control.curr_trial
+        condition = getattr(trial, 'condition', None)
+        if trial is not None and trial is not self.last_trial:
+            self.last_trial = trial
+            self.trials[condition] = self.trials.get(condition, 0) + 1
+        self.frames[condition] = self.frames.get(condition, 0) + 1
+        self.seconds[condition] = self.seconds.get(condition, 0.0) + elapsed
+        self.longest[condition] = max(self.longest.get(condition, 0.0),
+                                      elapsed)
+
+    def add(self, other):
+        '''Add in the numbers from another FrameTimer'''
+        for condition, frames in other.frames.iteritems():
+            self.frames[condition] = self.frames.get(condition, 0) + frames
+            self.seconds[condition] = self.seconds.get(condition, 0.0) + \
+                                      other.seconds[condition]
+            self.longest[condition] = max(self.longest.get(condition, 0.0),
+                                          other.longest[condition])
+        for condition, trials in other.trials.iteritems():
+            self.trials[condition] = self.trials.get(condition, 0) + trials
+
+    def summary(self):
+        lines = ['%-10s %7s %9s %10s %11s %11s' % ('condition', 'trials',
+                    'frames', 'trials/s', 'us/frame', 'max us')]
+        for condition in sorted(self.frames):
+            seconds = self.seconds[condition]
+            frames = self.frames[condition]
+            trials = self.trials.get(condition, 0)
+            lines.append('%-10s %7d %9d %10.1f %11.1f %11.1f' % (condition,
+                trials, frames, trials / seconds if seconds else 0,
+                1e6 * seconds / frames, 1e6 * self.longest[condition]))
+
+        return '\n'.join(lines)
+
+
+def run_synthetic(trials, vision_egg, script, frame_period=None):
+    '''Run trials on vision_egg (a HeadlessVisionEgg), with keys from script,
+    and return a FrameTimer. The StimController ends up in its
+    stim_control.'''
+    stim_control = StimController(trials, vision_egg,
+                                  frame_period=frame_period)
+    timer = FrameTimer(stim_control)
+    vision_egg.set_functions(update=timer,
+                             pause_update=stim_control.pause_update)
+    hook = ScriptedInput(stim_control, script)
+    vision_egg.frame_hooks.append(hook)
+    try:
+        stim_control.run_trials()
+    finally:
+        vision_egg.frame_hooks.remove(hook)
+
+    return timer
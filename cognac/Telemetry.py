@@ -0,0 +1,179 @@
+"""Telemetry.py lets the experimenter watch a block from another process.
+
+StimController hands its Telemetry each frame, and every few frames (or when
+a trial starts) we write a small fixed-size record into a memory-mapped file -
+usually in /dev/shm, so it never touches the disk. Writing to the mapping is
+just a memory copy, so there are no system calls on any frame, and nothing
+waits on the reader. It's lossy: the reader just sees the latest record.
+
+To keep the reader from seeing half a record, we use a sequence number (a
+"seqlock"): it's odd while we're writing and even when we're done, so the
+reader tries again if it's odd or if it changed while reading.
+
+We also time ourselves, and publish the mean and longest time a publish took,
+so you can see that we aren't messing up the timing. monitor_block.py shows
+what's going on."""
+
+import mmap
+from os.path import exists, join
+import struct
+import tempfile
+import time
+
+from cognac.DisplayProfile import default_frame_period
+
+
+# seq, then the record
+SEQ = struct.Struct('<I')
+RECORD = struct.Struct('<iIIdddd8s16s')
+FIELDS = ('row', 'frames', 'dropped', 't', 'last_rt', 'cost_mean',
+          'cost_max', 'condition', 'last_label')
+SIZE = SEQ.size + RECORD.size
+
+
+def default_path():
+    shm = '/dev/shm'
+    if not exists(shm):
+        shm = tempfile.gettempdir()
+    return join(shm, 'numericvid-telemetry')
+
+
+def _map(path, write):
+    if write:
+        f = open(path, 'w+b')
+        f.write('\0' * SIZE)
+        f.flush()
+        access = mmap.ACCESS_WRITE
+    else:
+        f = open(path, 'rb')
+        access = mmap.ACCESS_READ
+    buf = mmap.mmap(f.fileno(), SIZE, access=access)
+    f.close()
+
+    return buf
+
+
+class Telemetry:
+    '''Give one of these to a StimController
+
+    We publish every interval frames, and at the start of each trial. A frame
+    that comes more than 1.5 frame_periods after the last one counts as
+    dropping however many frames fit in the gap.'''
+    path = None
+    interval = 6
+    # This machine's, unless you give one (see
+    # cognac.DisplayProfile.default_frame_period)
+    frame_period = None
+
+    # What we're keeping track of
+    frames = 0
+    dropped = 0
+    last_t = None
+    last_trial = None
+    last_response = None
+    last_rt = float('nan')
+    last_label = ''
+
+    # How long publishing takes us
+    publishes = 0
+    cost_total = 0.0
+    cost_max = 0.0
+
+    def __init__(self, path=None, interval=None, frame_period=None):
+        if path is None:
+            path = default_path()
+        self.path = path
+        if interval is not None:
+            self.interval = interval
+        if frame_period is None:
+            frame_period = default_frame_period()
+        self.frame_period = frame_period
+        self.buf = _map(path, write=True)
+        self.seq = 0
+
+    def reset(self):
+        '''Call between blocks - go's start t from 0 again'''
+        self.last_t = None
+        self.last_trial = None
+        self.last_response = None
+
+    def frame(self, stim_control, t):
+        self.frames += 1
+        if self.last_t is not None and \
+                t - self.last_t > 1.5 * self.frame_period:
+            self.dropped += int(round((t - self.last_t) /
+                                      self.frame_period)) - 1
+        self.last_t = t
+
+        trial = stim_control.curr_trial
+        if trial is None:
+            return
+        response = trial.curr_response
+        if response is not self.last_response:
+            if self.last_response is not None and \
+                    self.last_response.rt is not None:
+                self.last_rt = self.last_response.rt
+                self.last_label = self.last_response.label
+            self.last_response = response
+
+        if trial is not self.last_trial or not self.frames % self.interval:
+            self.last_trial = trial
+            self.publish(stim_control, trial, t)
+
+    def publish(self, stim_control, trial, t):
+        start = time.time()
+        condition = getattr(trial, 'condition', None) or \
+                    trial.log.get('condition', '')
+        cost_mean = self.cost_total / self.publishes if self.publishes else 0.0
+
+        buf = self.buf
+        self.seq += 1
+        SEQ.pack_into(buf, 0, self.seq)
+        RECORD.pack_into(buf, SEQ.size, stim_control.curr_row, self.frames,
+                         self.dropped, t, self.last_rt, cost_mean,
+                         self.cost_max, condition, self.last_label)
+        self.seq += 1
+        SEQ.pack_into(buf, 0, self.seq)
+
+        cost = time.time() - start
+        self.publishes += 1
+        self.cost_total += cost
+        if cost > self.cost_max:
+            self.cost_max = cost
+
+    def close(self):
+        self.buf.close()
+
+
+class TelemetryReader:
+    '''Reads the latest record that a Telemetry wrote to path'''
+    retries = 100
+
+    def __init__(self, path=None):
+        if path is None:
+            path = default_path()
+        self.path = path
+        self.buf = _map(path, write=False)
+
+    def read(self):
+        '''A dict of FIELDS (plus seq), or None if nothing's been published
+        yet (or we kept catching the writer in the middle)'''
+        buf = self.buf
+        for i in range(self.retries):
+            seq = SEQ.unpack_from(buf, 0)[0]
+            if seq % 2:
+                continue
+            values = RECORD.unpack_from(buf, SEQ.size)
+            if seq and SEQ.unpack_from(buf, 0)[0] == seq:
+                record = dict(zip(FIELDS, values))
+                record['condition'] = record['condition'].rstrip('\0')
+                record['last_label'] = record['last_label'].rstrip('\0')
+                record['seq'] = seq
+                return record
+            elif not seq:
+                return None
+
+        return None
+
+    def close(self):
+        self.buf.close()
@@ -0,0 +1,242 @@
+"""TimingAudit.py checks that things came on when they were supposed to.
+
+Every Event that has a Response logs when it came on, as <label>.ref_time,
+and when it was supposed to come on follows from its schedule: an offset
+from trial_start, or from when some earlier response was made (its ref_time
+plus its rt). So for every logged trial, we can work out each onset's error
+- achieved minus intended - without knowing anything about the machine it
+ran on.
+
+A TimingAudit takes the schedule for each condition (see trial_schedule) and
+as many logs as you like, one at a time. For each row we only keep the few
+numbers the schedule needs, in a list per column per condition. The
+arithmetic happens afterwards, in one go per condition over every session,
+with numpy. So a cohort's worth of logs is one pass over the files, and
+memory is just those columns.
+
+We report the distribution of onset errors for each condition and label,
+and flag sessions whose typical error is far from everyone else's (by a
+robust z score - the median and MAD over sessions)."""
+
+from csv import DictReader
+
+import numpy as np
+
+from cognac.StimController import Response
+from cognac.DisplayProfile import default_frame_period
+
+
+def trial_schedule(trial):
+    '''[(label, ref, offset)] for each event in trial with a Response - label
+    comes on offset seconds after ref (trial_start, or another response)'''
+    schedule = []
+    for event in trial.schedule:
+        if isinstance(event.response, Response):
+            schedule.append((event.response.label, event.start.ref,
+                             float(event.start.offset)))
+
+    return schedule
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class OnsetErrors:
+    '''The errors for one label in one condition - errors is in seconds, with
+    a session index for each'''
+
+    def __init__(self, condition, label, ref, offset, sessions, errors):
+        self.condition = condition
+        self.label = label
+        self.ref = ref
+        self.offset = offset
+        ok = np.isfinite(errors)
+        self.sessions = sessions[ok]
+        self.errors = errors[ok]
+
+    def summary(self, frame_period, tolerance):
+        '''n, median, 5th and 95th percentiles and max (in ms), and the
+        fractions more than tolerance frames late and early'''
+        errors = self.errors
+        if not len(errors):
+            return len(errors), np.nan, np.nan, np.nan, np.nan, np.nan, np.nan
+        p5, median, p95 = 1e3 * np.percentile(errors, [5, 50, 95])
+        limit = tolerance * frame_period
+
+        return (len(errors), median, p5, p95, 1e3 * errors.max(),
+                (errors > limit).mean(), (errors < -limit).mean())
+
+
+class TimingAudit:
+    # This machine's, unless you give one (see
+    # cognac.DisplayProfile.default_frame_period)
+    frame_period = None
+    # Frames off an onset can be before it counts as late (or early)
+    tolerance = 1.5
+    # How far from the cohort a session has to be to get flagged
+    outlier_z = 3.5
+
+    logs = 0
+    skipped = 0
+    trials = 0
+
+    def __init__(self, schedules, frame_period=None):
+        '''schedules is condition -> trial_schedule for that condition'''
+        if frame_period is None:
+            frame_period = default_frame_period()
+        self.frame_period = frame_period
+        self.schedules = schedules
+        # The columns we need for each condition
+        self.needed = {}
+        for condition, schedule in schedules.iteritems():
+            needed = ['trial_start']
+            for label, ref, offset in schedule:
+                needed.append(label + '.ref_time')
+                if ref != 'trial_start':
+                    needed.extend([ref + '.ref_time', ref + '.rt'])
+            self.needed[condition] = sorted(set(needed))
+        # condition -> column -> values, and the session of each row
+        self.columns = dict((condition, dict((name, []) for name in needed))
+                            for condition, needed in self.needed.iteritems())
+        self.rows = dict((condition, []) for condition in schedules)
+        self.sessions = []
+        # Conditions we don't have a schedule for -> how many rows
+        self.unknown = {}
+
+    def add_rows(self, session, rows):
+        '''rows is an iterable of log rows (dicts) from session (a name)'''
+        index = len(self.sessions)
+        self.sessions.append(session)
+        self.logs += 1
+        for row in rows:
+            condition = row.get('condition')
+            try:
+                needed = self.needed[condition]
+            except KeyError:
+                self.unknown[condition] = self.unknown.get(condition, 0) + 1
+                continue
+            columns = self.columns[condition]
+            for name in needed:
+                columns[name].append(to_float(row.get(name)))
+            self.rows[condition].append(index)
+            self.trials += 1
+
+    def add_log(self, fname):
+        '''Add a StimController log - anything that doesn't look like one
+        (no trial_start or condition column) is skipped, and we return
+        False'''
+        f = open(fname)
+        try:
+            reader = DictReader(f)
+            fields = reader.fieldnames or ()
+            if 'trial_start' not in fields or 'condition' not in fields:
+                self.skipped += 1
+                return False
+            self.add_rows(fname, reader)
+        finally:
+            f.close()
+
+        return True
+
+    def onset_errors(self):
+        '''An OnsetErrors for each condition and label'''
+        results = []
+        for condition in sorted(self.schedules):
+            sessions = np.array(self.rows[condition], dtype=int)
+            columns = dict((name, np.array(values, dtype=float))
+                           for name, values in
+                                self.columns[condition].iteritems())
+            for label, ref, offset in self.schedules[condition]:
+                if ref == 'trial_start':
+                    ref_time = columns['trial_start']
+                else:
+                    ref_time = columns[ref + '.ref_time'] + \
+                               columns[ref + '.rt']
+                errors = columns[label + '.ref_time'] - (ref_time + offset)
+                results.append(OnsetErrors(condition, label, ref, offset,
+                                           sessions, errors))
+
+        return results
+
+    def session_stats(self, onset_errors=None):
+        '''(onsets, mean |error|, fraction off by more than tolerance) -
+        arrays with one entry per session'''
+        if onset_errors is None:
+            onset_errors = self.onset_errors()
+        n = len(self.sessions)
+        sessions = np.concatenate([o.sessions for o in onset_errors] +
+                                  [np.zeros(0, dtype=int)])
+        errors = np.concatenate([o.errors for o in onset_errors] +
+                                [np.zeros(0)])
+
+        onsets = np.bincount(sessions, minlength=n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_abs = np.bincount(sessions, np.abs(errors), n) / onsets
+            off = np.bincount(sessions, np.abs(errors) >
+                              self.tolerance * self.frame_period, n) / onsets
+
+        return onsets, mean_abs, off
+
+    def outliers(self, onset_errors=None):
+        '''[(session, mean |error|, fraction off, z)] for sessions whose mean
+        |error| is unusually big, worst first.
+
+        The scale is the MAD over sessions, but at least a quarter of a
+        frame - otherwise a cohort that's almost all perfect would flag a
+        session for being a few ms out.'''
+        onsets, mean_abs, off = self.session_stats(onset_errors)
+        has = onsets > 0
+        if not has.any():
+            return []
+        median = np.median(mean_abs[has])
+        mad = 1.4826 * np.median(np.abs(mean_abs[has] - median))
+        scale = max(mad, 0.25 * self.frame_period)
+        z = np.where(has, (mean_abs - median) / scale, 0)
+
+        flagged = np.flatnonzero(z > self.outlier_z)
+        flagged = flagged[np.argsort(-z[flagged])]
+
+        return [(self.sessions[i], mean_abs[i], off[i], z[i])
+                    for i in flagged]
+
+    def report(self):
+        '''The whole thing, as lines of text'''
+        onset_errors = self.onset_errors()
+        onsets = sum(len(o.errors) for o in onset_errors)
+        lines = ['%d logs (%d skipped), %d trials, %d onsets' %
+                    (self.logs, self.skipped, self.trials, onsets)]
+        for condition, count in sorted(self.unknown.items()):
+            lines.append('%d rows with condition %r have no schedule' %
+                         (count, condition))
+
+        lines.append('')
+        lines.append('%-4s %-14s %-22s %6s %9s %9s %9s %9s %6s %6s' %
+                     ('cond', 'label', 'intended', 'n', 'median', 'p5',
+                      'p95', 'max', 'late', 'early'))
+        for o in onset_errors:
+            n, median, p5, p95, longest, late, early = \
+                    o.summary(self.frame_period, self.tolerance)
+            lines.append('%-4s %-14s %-22s %6d %6.1f ms %5.1f ms %5.1f ms '
+                         '%5.1f ms %5.1f%% %5.1f%%' %
+                         (o.condition, o.label,
+                          '%s + %.2f s' % (o.ref, o.offset), n, median, p5,
+                          p95, longest, 100 * late, 100 * early))
+        lines.append('(late and early are more than %.1f frames of %.2f ms)'
+                     % (self.tolerance, 1e3 * self.frame_period))
+
+        outliers = self.outliers(onset_errors)
+        lines.append('')
+        if outliers:
+            lines.append('%d sessions stand out:' % len(outliers))
+            for session, mean_abs, off, z in outliers:
+                lines.append('    %s: mean |error| %.1f ms, %.1f%% off '
+                             '(z %.1f)' % (session, 1e3 * mean_abs,
+                                           100 * off, z))
+        else:
+            lines.append('no sessions stand out')
+
+        return lines
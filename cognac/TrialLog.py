@@ -0,0 +1,234 @@
+"""TrialLog.py keeps the log of a block as one column per "label.param",
+rather than a dict per Trial full of floats, strings and live Responses.
+
+StimController makes one of these for each block, with a row for every logged
+Trial, and each Trial copies its log into its row when it's done. Missing
+entries are NaN for float columns, MISSING_INT for int columns and None for
+everything else, and they come out as empty cells in the csv - just like the
+old DictWriter based log.
+
+Because everything is already in columns, writing out a block (csv, NumPy or
+Parquet) is a bulk operation, and we keep running totals so that things like
+the mean RT so far are cheap to get in the middle of a session."""
+
+from csv import writer
+
+import numpy as np
+
+
+MISSING_INT = np.iinfo(np.int64).min
+
+
+class TrialLog:
+    # Rows we'll write out, whether or not anything has been put in them
+    num_rows = 0
+    # Rows we've got room for in each column
+    capacity = 0
+    # column name -> numpy array
+    columns = None
+    # numeric column name -> [sum, count]
+    totals = None
+    # other column name -> {value: count}
+    tallies = None
+
+    def __init__(self, num_rows=0):
+        self.num_rows = num_rows
+        self.capacity = max(num_rows, 1)
+        self.columns = {}
+        self.totals = {}
+        self.tallies = {}
+
+    def _new_column(self, kind):
+        if kind == 'f':
+            col = np.empty(self.capacity)
+            col.fill(np.nan)
+        elif kind == 'i':
+            col = np.empty(self.capacity, dtype=np.int64)
+            col.fill(MISSING_INT)
+        else:
+            col = np.empty(self.capacity, dtype=object)
+
+        return col
+
+    def _kind(self, value):
+        # bools are ints too, but they look silly as 0/1 in the csv
+        if isinstance(value, bool):
+            return 'O'
+        elif isinstance(value, (int, long)):
+            return 'i'
+        elif isinstance(value, float):
+            return 'f'
+        else:
+            return 'O'
+
+    def _promote(self, name, kind):
+        '''Change the type of column name so that it can also hold kind'''
+        col = self.columns[name]
+        if col.dtype.kind == 'i' and kind == 'f':
+            new_col = col.astype(float)
+            new_col[col == MISSING_INT] = np.nan
+        else:
+            new_col = self._new_column('O')
+            tally = self.tallies[name] = {}
+            for row, value in enumerate(self._export(name, self.capacity)):
+                if value is not None:
+                    new_col[row] = value
+                    tally[value] = tally.get(value, 0) + 1
+            del self.totals[name]
+
+        self.columns[name] = new_col
+        return new_col
+
+    def _grow(self, row):
+        '''Make room for at least row + 1 rows in all columns'''
+        old_capacity = self.capacity
+        self.capacity = max(row + 1, 2 * old_capacity)
+        for name, col in self.columns.items():
+            new_col = self._new_column(col.dtype.kind)
+            new_col[:old_capacity] = col
+            self.columns[name] = new_col
+
+    def set(self, row, name, value):
+        '''Put value in the cell at row, name - making the column if need be'''
+        if row >= self.capacity:
+            self._grow(row)
+        if row >= self.num_rows:
+            self.num_rows = row + 1
+
+        kind = self._kind(value)
+        try:
+            col = self.columns[name]
+        except KeyError:
+            col = self.columns[name] = self._new_column(kind)
+            if kind == 'O':
+                self.tallies[name] = {}
+            else:
+                self.totals[name] = [0.0, 0]
+        else:
+            col_kind = col.dtype.kind
+            if col_kind != kind and col_kind != 'O' and \
+                    not (col_kind == 'f' and kind == 'i'):
+                col = self._promote(name, kind)
+
+        self.clear(row, name)
+        col[row] = value
+        if col.dtype.kind == 'O':
+            tally = self.tallies[name]
+            tally[value] = tally.get(value, 0) + 1
+        else:
+            self.totals[name][0] += value
+            self.totals[name][1] += 1
+
+    def clear(self, row, name):
+        '''Back to missing, keeping our running totals straight'''
+        col = self.columns[name]
+        old = col[row]
+        if col.dtype.kind == 'O':
+            if old is not None:
+                self.tallies[name][old] -= 1
+                if not self.tallies[name][old]:
+                    del self.tallies[name][old]
+            col[row] = None
+        elif col.dtype.kind == 'i':
+            if old != MISSING_INT:
+                self.totals[name][0] -= old
+                self.totals[name][1] -= 1
+            col[row] = MISSING_INT
+        else:
+            if not np.isnan(old):
+                self.totals[name][0] -= old
+                self.totals[name][1] -= 1
+            col[row] = np.nan
+
+    ## In-session summaries
+
+    def mean(self, name):
+        '''e.g. mean('estimate.rt') - None if we've got nothing yet'''
+        try:
+            total, count = self.totals[name]
+        except KeyError:
+            return None
+
+        if count:
+            return total / count
+
+    def count(self, name):
+        '''How many rows have something in this column'''
+        try:
+            return self.totals[name][1]
+        except KeyError:
+            return sum(self.tallies.get(name, {}).values())
+
+    def counts(self, name):
+        '''e.g. counts('surprise.response') -> {'1': 4, '3': 2}'''
+        return dict(self.tallies.get(name, {}))
+
+    ## Bulk export
+
+    def header(self):
+        return sorted(self.columns)
+
+    def _export(self, name, num_rows=None):
+        '''A column as a list of python values, with None for missing'''
+        if num_rows is None:
+            num_rows = self.num_rows
+        col = self.columns[name][:num_rows]
+        values = col.tolist()
+        if col.dtype.kind == 'f':
+            return [None if v != v else v for v in values]
+        elif col.dtype.kind == 'i':
+            return [None if v == MISSING_INT else v for v in values]
+        else:
+            return values
+
+    def row(self, row):
+        '''A dict of the non-missing entries in one row'''
+        values = {}
+        for name, col in self.columns.iteritems():
+            value = col[row]
+            if col.dtype.kind == 'f':
+                if value == value:
+                    values[name] = float(value)
+            elif col.dtype.kind == 'i':
+                if value != MISSING_INT:
+                    values[name] = int(value)
+            elif value is not None:
+                values[name] = value
+
+        return values
+
+    def rows(self):
+        '''dicts, containing only the non-missing entries of each row'''
+        header = self.header()
+        columns = [self._export(name) for name in header]
+        return [dict((k, v) for k, v in zip(header, row) if v is not None)
+                    for row in zip(*columns)]
+
+    def to_csv(self, f):
+        '''f can be a filename or a file opened for writing'''
+        header = self.header()
+        columns = [self._export(name) for name in header]
+        try:
+            w = writer(f)
+        except TypeError:
+            w = writer(open(f, 'w'))
+
+        w.writerow(header)
+        # csv already writes None as an empty cell
+        w.writerows(zip(*columns))
+
+    def to_numpy(self):
+        '''A structured array with a field for each column'''
+        header = self.header()
+        return np.rec.fromarrays([self.columns[name][:self.num_rows]
+                                    for name in header], names=header)
+
+    def to_parquet(self, fname):
+        '''Needs pyarrow, which we only import if you actually want this'''
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        header = self.header()
+        table = pa.Table.from_arrays([pa.array(self._export(name))
+                                        for name in header], header)
+        pq.write_table(table, fname)
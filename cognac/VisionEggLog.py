@@ -0,0 +1,234 @@
+"""VisionEggLog.py gets the frame timing out of VisionEgg.log.
+
+VisionEgg appends to VisionEgg.log every time anything starts, and at the end
+of each go it logs how many frames were drawn, the mean and longest IFI and a
+little histogram - plus warnings when the frame rate isn't what
+VISIONEGG_MONITOR_REFRESH_HZ says, or a frame took far too long. Nobody reads
+it, and it just keeps growing.
+
+We read it an entry at a time (an entry is a line starting with a timestamp
+and a process id, plus whatever lines follow it - histograms and tracebacks).
+Each "Script ... started" starts a run, and everything that process logs
+afterwards goes with it. A LogIndex remembers the runs and how far into the
+file it got, so next time we only parse what's been added since. The machine
+is the OpenGL renderer line, as the log has nothing better. If the script
+logged a "Startup:" line (see cognac.Startup), the run gets how long each
+phase took, so we can see whether starting up is getting slower."""
+
+import json
+import re
+from os.path import exists, getsize
+
+
+entry_re = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d+ \((\d+)\) '
+                      r'([A-Z]+): (.*)$')
+entry_start_re = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d+ \(\d+\) ',
+                            re.M)
+started_re = re.compile(r'^Script (.*) started Vision Egg (\S+) with process')
+frames_re = re.compile(r'^(\d+) frames were drawn\.')
+ifi_re = re.compile(r'Mean IFI was ([\d.]+) msec \(([\d.]+) fps\), '
+                    r'longest IFI was ([\d.]+) msec')
+startup_re = re.compile(r'(\w[\w ]*?) ([\d.]+) s(?:,|$| \()')
+fps_warning_re = re.compile(r'^Calculated frames per second was ([\d.]+), '
+                            r'while the VISIONEGG_MONITOR_REFRESH_HZ variable '
+                            r'is ([\d.]+)')
+long_frame_re = re.compile(r'^One or more frames took ([\d.]+) msec')
+
+
+def entries(lines):
+    '''(time, pid, level, message, continuation lines) for each entry in
+    lines. Anything before the first entry is ignored.'''
+    entry = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = entry_re.match(line)
+        if match:
+            if entry is not None:
+                yield entry
+            when, pid, level, message = match.groups()
+            entry = (when, int(pid), level, message, [])
+        elif entry is not None:
+            entry[4].append(line)
+
+    if entry is not None:
+        yield entry
+
+
+def histogram(lines):
+    '''The (bin start in msec, count) pairs from the Time: and Total: lines of
+    a histogram. The biggest bin is printed as +++ - we give that None, and
+    leave it to the caller to work it out.'''
+    times = totals = None
+    for line in lines:
+        if line.startswith(' Time:'):
+            times = line.split()[1:-1]
+        elif line.startswith('Total:'):
+            totals = line.split()[1:]
+    if times is None or totals is None:
+        return []
+
+    # The last bin is everything from its start up
+    return [(int(start), None if count == '+++' else int(count))
+                for start, count in zip(times, totals)]
+
+
+def new_run(when, pid, script, version):
+    return {'started': when, 'pid': pid, 'script': script,
+            'version': version, 'machine': None, 'vsync': True,
+            'goes': [], 'fps_warnings': [], 'long_frames': [],
+            'crashed': False, 'startup': None}
+
+
+def go_stats(message, lines):
+    '''A dict for a "frames were drawn" entry'''
+    go = {'frames': int(frames_re.match(message).group(1)),
+          'mean_ifi': None, 'fps': None, 'longest_ifi': None}
+    for line in lines:
+        match = ifi_re.search(line)
+        if match:
+            go['mean_ifi'], go['fps'], go['longest_ifi'] = \
+                    [float(x) for x in match.groups()]
+            break
+
+    bins = histogram(lines)
+    missing = [i for i, (start, count) in enumerate(bins) if count is None]
+    if len(missing) == 1:
+        known = sum(count for start, count in bins if count is not None)
+        # VisionEgg doesn't count the first frame
+        bins[missing[0]] = (bins[missing[0]][0],
+                            max(go['frames'] - 1 - known, 0))
+    go['histogram'] = bins
+
+    return go
+
+
+class LogIndex:
+    '''Everything we've found in a VisionEgg.log, and how far we've read.
+
+    update() parses whatever's been added since last time, and save() keeps
+    it in a json file (next to the log, by default) - all but the last
+    entry, which might not be finished yet. If the log got shorter or its
+    first line changed, it's a new log, and we start over.'''
+    log_path = None
+    index_path = None
+    offset = 0
+    first_line = None
+    # What save writes - everything up to offset
+    saved = None
+
+    def __init__(self, log_path='VisionEgg.log', index_path=None):
+        self.log_path = log_path
+        if index_path is None:
+            index_path = log_path + '.index'
+        self.index_path = index_path
+        # Every run we've seen, in order, and which of them each pid is in
+        # the middle of
+        self.runs = []
+        self.current = {}
+
+        if exists(index_path):
+            self.load(open(index_path).read())
+
+    def load(self, saved):
+        self.saved = saved
+        saved = json.loads(saved)
+        self.offset = saved['offset']
+        self.first_line = saved['first_line']
+        self.runs = saved['runs']
+        self.current = dict((int(pid), i)
+                            for pid, i in saved['current'].items())
+
+    def reset(self):
+        self.offset = 0
+        self.first_line = None
+        self.runs = []
+        self.current = {}
+
+    def update(self):
+        '''Parse what's new - returns how many bytes we read'''
+        if not exists(self.log_path):
+            return 0
+        if self.saved is not None:
+            # Forget the last entry from the last update
+            self.load(self.saved)
+        log = open(self.log_path, 'rb')
+        first_line = log.readline()
+        if getsize(self.log_path) < self.offset or \
+                (self.first_line is not None and
+                 first_line != self.first_line):
+            self.reset()
+        self.first_line = first_line
+
+        log.seek(self.offset)
+        data = log.read()
+        log.close()
+        # We only take whole lines, and we can't be sure the last entry is
+        # all there (its histogram or traceback might still be coming), so
+        # what we save stops just before it, and we read it again next time
+        end = data.rfind('\n') + 1
+        if not end:
+            return 0
+        data = data[:end]
+        last = 0
+        for match in entry_start_re.finditer(data):
+            last = match.start()
+        for entry in entries(data[:last].splitlines()):
+            self.add(*entry)
+        self.offset += last
+        self.saved = self.state()
+        for entry in entries(data[last:].splitlines()):
+            self.add(*entry)
+
+        return end
+
+    def add(self, when, pid, level, message, lines):
+        match = started_re.match(message)
+        if match:
+            self.current[pid] = len(self.runs)
+            self.runs.append(new_run(when, pid, *match.groups()))
+            return
+
+        try:
+            run = self.runs[self.current[pid]]
+        except KeyError:
+            # From before the start of the log (or a process that never
+            # said hello)
+            self.current[pid] = len(self.runs)
+            run = new_run(when, pid, None, None)
+            self.runs.append(run)
+
+        if message.startswith('OpenGL '):
+            run['machine'] = message[len('OpenGL '):]
+        elif message.startswith('Startup: '):
+            run['startup'] = [[phase, float(seconds)] for phase, seconds in
+                              startup_re.findall(message[len('Startup: '):])]
+        elif message.startswith('Could not sync buffer swapping to vblank'):
+            run['vsync'] = False
+        elif frames_re.match(message):
+            go = go_stats(message, lines)
+            go['ended'] = when
+            run['goes'].append(go)
+        elif fps_warning_re.match(message):
+            run['fps_warnings'].append(
+                    float(fps_warning_re.match(message).group(1)))
+        elif long_frame_re.match(message):
+            run['long_frames'].append(
+                    float(long_frame_re.match(message).group(1)))
+        elif level == 'CRITICAL':
+            run['crashed'] = True
+
+    def state(self):
+        return json.dumps({'log': self.log_path, 'offset': self.offset,
+                           'first_line': self.first_line, 'runs': self.runs,
+                           'current': self.current})
+
+    def save(self):
+        if self.saved is None:
+            self.saved = self.state()
+        open(self.index_path, 'w').write(self.saved)
+
+    def goes(self):
+        '''(run, go) for every go we know about'''
+        for run in self.runs:
+            for go in run['goes']:
+                yield run, go
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+'''collect_logs.py
+
+Run the log collector (see cognac.Collector) that our testing stations send
+their trial rows to, or ask a running one how everybody's getting on.
+
+Point a station at it with, e.g.:
+
+    NUMERICVID_COLLECTOR=labserver:8642 NUMERICVID_COHORT=spring \\
+        ./numeric_questions_fast.py subject01/day1/block1-E.yaml
+
+Stores go in <store_dir>/<cohort>.jsonl. For testing, run it on localhost.'''
+
+import json
+import socket
+import time
+
+from cognac.Collector import Collector, DEFAULT_PORT
+
+
+def parse_address(address):
+    '''"host:port", "host" or ":port" -> (host, port)'''
+    host, sep, port = address.partition(':')
+    return (host or 'localhost', int(port or DEFAULT_PORT))
+
+
+def status(address):
+    '''{station: what we last heard from it} from a running collector'''
+    sock = socket.create_connection(address, 5)
+    sock.sendall(json.dumps({'type': 'status'}) + '\n')
+    received = ''
+    while not received.endswith('\n'):
+        data = sock.recv(4096)
+        if not data:
+            break
+        received += data
+    sock.close()
+
+    return json.loads(received)
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    if len(argv) == 3 and argv[1] == '--status':
+        now = time.time()
+        for station, info in sorted(status(parse_address(argv[2])).items()):
+            print '%-16s %-10s %-36s %4d rows, last %s %.0f s ago' % \
+                    (station, info['cohort'], info['block'], info['rows'],
+                     info['last_type'], now - (info['last_time'] or now))
+        exit(0)
+
+    if len(argv) not in (2, 3):
+        print "usage: ./collect_logs.py <store_dir> [<host>:<port>]"
+        print "       ./collect_logs.py --status <host>:<port>"
+        exit(1)
+
+    host, port = parse_address(argv[2] if len(argv) == 3 else '')
+    collector = Collector(argv[1], host, port)
+    print 'collecting into %s on %s:%d' % (argv[1], host, port)
+    try:
+        collector.serve()
+    except KeyboardInterrupt:
+        collector.shutdown()
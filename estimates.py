@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+'''estimates.py
+
+Turn typed estimates like "12b", "300m", "6.5 billion" or "50,000" into
+numbers.
+
+Estimates are typed for a kernel with a Format like "$x", "x%", "1 in x" or
+"x gallons" (block_compiler keeps it with each trial), and
+people sometimes type the decoration too ("464 gallons"), so we allow it.
+Multipliers follow format_num - thousand, million, billion and trillion, or
+the first letter of any of them. Values are worked out exactly (with
+Decimal), and only then turned into floats.
+
+EstimateResponse uses parse_estimate as each estimate comes in, giving us an
+estimate.value column. parse_estimates does a whole column at once - it only
+parses each distinct (estimate, format) once, and does the rest with numpy.
+Run this as a script to do it for old logs - as many blocks as you like, in
+one pass.'''
+
+import re
+from decimal import Decimal
+from csv import DictReader, writer
+from os import walk
+from os.path import dirname, exists, join
+from sys import stderr
+
+import numpy as np
+
+from block_compiler import load_block, BlockError
+
+
+# multiplier word -> power of 10
+MULTIPLIERS = {'': 0,
+               'h': 2, 'hundred': 2,
+               'k': 3, 'thousand': 3,
+               'm': 6, 'mil': 6, 'million': 6,
+               'b': 9, 'bn': 9, 'bil': 9, 'billion': 9,
+               't': 12, 'tril': 12, 'trillion': 12}
+
+# Other ways to type the decoration in a Format
+UNIT_ALIASES = {'%': ('percent', 'pct')}
+
+# a number (commas are OK, as long as they separate thousands), then maybe a
+# multiplier word
+estimate_re = re.compile(r'^(-?)\s*(\d{1,3}(?:,\d{3})+(?:\.\d*)?|'
+                         r'\d+(?:\.\d*)?|\.\d+)\s*([a-z]*)$')
+
+
+def format_affixes(fmt):
+    '''"$x" -> ("$", ["x"...]) - what can come before and after the number,
+    lower case'''
+    prefix, x, suffix = (fmt or '').lower().partition('x')
+    if not x:
+        return '', []
+    prefix, suffix = prefix.strip(), suffix.strip()
+
+    # Longest first, so "years old" goes before "years"
+    suffixes = []
+    words = suffix.split()
+    for n in range(len(words), 0, -1):
+        part = ' '.join(words[:n])
+        suffixes.append(part)
+        suffixes.extend(UNIT_ALIASES.get(part, ()))
+        if part.endswith('s'):
+            suffixes.append(part[:-1])
+
+    return prefix, suffixes
+
+
+def parse_exact(text, fmt=''):
+    '''text as a Decimal, or None if we can't make sense of it'''
+    s = text.strip().lower()
+    prefix, suffixes = format_affixes(fmt)
+    if prefix and s.startswith(prefix):
+        s = s[len(prefix):].strip()
+    for suffix in suffixes:
+        if s.endswith(suffix):
+            s = s[:-len(suffix)].strip()
+            break
+
+    match = estimate_re.match(s)
+    if match is None:
+        return None
+    sign, number, word = match.groups()
+    try:
+        exponent = MULTIPLIERS[word]
+    except KeyError:
+        return None
+
+    return Decimal(sign + number.replace(',', '')).scaleb(exponent)
+
+
+_parsed = {}
+
+def parse_estimate(text, fmt=''):
+    '''text as a float, or None - we remember everything we've parsed'''
+    try:
+        return _parsed[text, fmt]
+    except KeyError:
+        value = parse_exact(text, fmt)
+        if value is not None:
+            value = float(value)
+        _parsed[text, fmt] = value
+        return value
+
+
+def parse_estimates(texts, formats=''):
+    '''Parse a whole column of estimates - formats can be a column too, or
+    one format for everything. Returns a float array, with NaN for anything
+    missing or that we can't parse.'''
+    texts = np.asarray([t or '' for t in texts], dtype=str)
+    if isinstance(formats, basestring):
+        formats = np.repeat(np.array([formats], dtype=str), len(texts))
+    else:
+        formats = np.asarray([f or '' for f in formats], dtype=str)
+    if not len(texts):
+        return np.zeros(0)
+
+    # Case and spaces don't matter, so we take them out before looking for
+    # duplicates
+    texts = np.char.strip(np.char.lower(texts))
+    keys = np.char.add(np.char.add(formats, '\x01'), texts)
+    unique, inverse = np.unique(keys, return_inverse=True)
+
+    values = np.empty(len(unique))
+    for i, key in enumerate(unique):
+        fmt, text = key.split('\x01', 1)
+        value = parse_estimate(text, fmt)
+        values[i] = np.nan if value is None else value
+
+    return values[inverse]
+
+
+def block_logs(paths):
+    '''(block yaml, log, trials) for every block with a log under paths (which
+    can also just be block yamls)'''
+    blocks = []
+    for path in paths:
+        if path.endswith('.yaml'):
+            blocks.append(path)
+        for dirpath, dirnames, filenames in walk(path):
+            dirnames.sort()
+            blocks.extend(join(dirpath, f) for f in sorted(filenames)
+                            if f.endswith('.yaml'))
+
+    pairs = []
+    for block_file in blocks:
+        log_file, trials = load_block(block_file)
+        log_path = join(dirname(block_file), log_file)
+        if exists(log_path):
+            pairs.append((block_file, log_path, trials))
+
+    return pairs
+
+
+def normalize_logs(paths, out):
+    '''Write a csv to out with a row for each estimate in the logs under
+    paths. Returns (estimates, parsed).'''
+    blocks = []
+    rows = []
+    texts = []
+    formats = []
+    for block_file, log_path, trials in block_logs(paths):
+        log = list(DictReader(open(log_path)))
+        # Blocks can share a log (like the practice blocks do), so we make
+        # sure it's really this block's
+        if [line['condition'] for line in log] != \
+                [trial[0] for trial in trials]:
+            print >> stderr, "%s doesn't match %s - skipped" % \
+                    (log_path, block_file)
+            continue
+        for row, (line, trial) in enumerate(zip(log, trials)):
+            text = line.get('estimate.response')
+            if text:
+                blocks.append(block_file)
+                rows.append((row, line['condition']))
+                texts.append(text)
+                formats.append(trial[4])
+
+    values = parse_estimates(texts, formats)
+
+    w = writer(out)
+    w.writerow(['block', 'row', 'condition', 'estimate.response', 'format',
+                'estimate.value'])
+    for block_file, (row, condition), text, fmt, value in \
+            zip(blocks, rows, texts, formats, values.tolist()):
+        w.writerow([block_file, row, condition, text, fmt,
+                    '' if value != value else repr(value)])
+
+    return len(values), int(np.isfinite(values).sum())
+
+
+if __name__ == '__main__':
+    from sys import argv, exit, stdout
+
+    if len(argv) < 2:
+        print "usage: ./estimates.py <tree or block>.yaml [...] > estimates.csv"
+        print "   e.g. ./estimates.py subject*/ practice"
+        exit(1)
+
+    try:
+        estimates, parsed = normalize_logs(argv[1:], stdout)
+    except BlockError, e:
+        print >> stderr, e
+        exit(1)
+    print >> stderr, 'parsed %d of %d estimates' % (parsed, estimates)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+'''frame_stats.py
+
+How good has our frame timing been? Goes through VisionEgg.log (only the new
+bits - see cognac.VisionEggLog) and prints, for each machine and week, how
+many runs and goes there were, the mean and worst IFIs, how many frames
+were long (more than 1.5 frames, going by this machine's display profile -
+see cognac.DisplayProfile), and how often VisionEgg complained.
+
+With -r, you get every run instead.'''
+
+import time
+
+from cognac.VisionEggLog import LogIndex
+from cognac.DisplayProfile import default_frame_period
+
+
+def week(when):
+    '''"2011-05-02 15:42:57" -> "2011-W18"'''
+    return time.strftime('%Y-W%W', time.strptime(when, '%Y-%m-%d %H:%M:%S'))
+
+
+def long_frames(histogram, frame_period):
+    '''How many frames in a go's histogram took more than 1.5 frame_periods -
+    the bin that straddles that counts too'''
+    limit = 1.5e3 * frame_period
+    ends = [start for start, count in histogram[1:]] + [float('inf')]
+
+    return sum(count for (start, count), end in zip(histogram, ends)
+                    if end > limit)
+
+
+def summarize(goes, frame_period):
+    '''Stats for a list of (run, go)'''
+    goes = [(run, go) for run, go in goes if go['mean_ifi'] is not None]
+    frames = sum(go['frames'] for run, go in goes)
+    if not frames:
+        return None
+
+    long = sum(long_frames(go['histogram'], frame_period)
+                    for run, go in goes)
+
+    return {'goes': len(goes), 'frames': frames,
+            'mean_ifi': sum(go['mean_ifi'] * go['frames']
+                            for run, go in goes) / frames,
+            'longest_ifi': max(go['longest_ifi'] for run, go in goes),
+            'long_rate': float(long) / frames}
+
+
+def trends(index, frame_period):
+    '''[(machine, week, runs, crashed, stats)], in order'''
+    groups = {}
+    for run in index.runs:
+        key = (run['machine'] or 'unknown', week(run['started']))
+        groups.setdefault(key, []).append(run)
+
+    rows = []
+    for (machine, when), runs in sorted(groups.items()):
+        goes = [(run, go) for run in runs for go in run['goes']]
+        rows.append((machine, when, len(runs),
+                     sum(run['crashed'] for run in runs),
+                     summarize(goes, frame_period)))
+
+    return rows
+
+
+def print_trends(index, frame_period):
+    machine = None
+    for this_machine, when, runs, crashed, stats in \
+            trends(index, frame_period):
+        if this_machine != machine:
+            machine = this_machine
+            print machine
+        line = '  %s  %3d runs %3d crashed' % (when, runs, crashed)
+        if stats:
+            line += '  %3d goes %7d frames  mean IFI %5.2f ms  ' \
+                    'longest %6.1f ms  %5.2f%% long' % \
+                    (stats['goes'], stats['frames'], stats['mean_ifi'],
+                     stats['longest_ifi'], 100 * stats['long_rate'])
+        print line
+
+
+def print_runs(index):
+    for run in index.runs:
+        print '%s %6d %s%s%s' % (run['started'], run['pid'], run['script'],
+                                 '' if run['vsync'] else ' [no vsync]',
+                                 ' [crashed]' if run['crashed'] else '')
+        if run.get('startup'):
+            print '    startup: ' + ', '.join('%s %.2f s' % tuple(phase)
+                                           for phase in run['startup'])
+        for go in run['goes']:
+            if go['mean_ifi'] is None:
+                continue
+            print '    %6d frames  mean IFI %5.2f ms  longest %6.1f ms' % \
+                    (go['frames'], go['mean_ifi'], go['longest_ifi'])
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    args = argv[1:]
+    show_runs = '-r' in args
+    if show_runs:
+        args.remove('-r')
+    if len(args) > 1 or [a for a in args if a.startswith('-')]:
+        print "usage: ./frame_stats.py [-r] [<VisionEgg.log>]"
+        exit(1)
+
+    index = LogIndex(*args)
+    start = time.time()
+    parsed = index.update()
+    index.save()
+    print 'read %d bytes of log in %.3f s (%d runs so far)\n' % \
+            (parsed, time.time() - start, len(index.runs))
+
+    if show_runs:
+        print_runs(index)
+    else:
+        print_trends(index, default_frame_period())
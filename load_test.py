@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+'''load_test.py
+
+Run every block in some subject trees with synthetic participants (see
+cognac.Synthetic), headless and as fast as we can go, and report trials/sec
+and time per frame for each condition. Nothing gets written - the logs just
+get thrown away.
+
+Response times are fitted to any block logs that are already in the trees
+(e.g., practice/practice-log.csv), or a generic log-normal otherwise.'''
+
+from os import environ, walk
+from os.path import join
+import time
+
+# This has to happen before numeric_questions_fast sets up its stimuli
+environ['NUMERICVID_HEADLESS'] = '1'
+
+import numpy as np
+
+import numeric_questions_fast as nqf
+from block_compiler import BlockError
+from cognac.ScheduleAnalyzer import RTModel
+from cognac.Synthetic import SyntheticScript, FrameTimer, run_synthetic
+
+
+def find_files(trees, suffix):
+    found = []
+    for tree in trees:
+        for dirpath, dirnames, filenames in walk(tree):
+            dirnames.sort()
+            found.extend(join(dirpath, f) for f in sorted(filenames)
+                            if f.endswith(suffix))
+
+    return found
+
+
+def load_test(trees, participants=1, kern_file='shorter-kernels.csv',
+              seed=None):
+    '''Runs each block in trees participants times, and returns the total
+    FrameTimer and how many blocks we ran'''
+    script = SyntheticScript(RTModel().fit(find_files(trees, 'log.csv')),
+                             rng=np.random.RandomState(seed))
+    total = FrameTimer(None)
+    blocks = 0
+    for block_file in find_files(trees, '.yaml'):
+        for i in range(participants):
+            log_path, trials = nqf.load_trials(block_file, kern_file)
+            total.add(run_synthetic(trials, nqf.vision_egg, script))
+            nqf.trial_pool.release(trials)
+            blocks += 1
+
+    return total, blocks
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    if len(argv) < 2:
+        print "usage: ./load_test.py [-n <participants>] <tree> [<tree> ...]"
+        print "   e.g. ./load_test.py -n 10 subject01"
+        exit(1)
+
+    participants = 1
+    if argv[1] == '-n':
+        participants = int(argv[2])
+        del argv[1:3]
+
+    start = time.time()
+    try:
+        total, blocks = load_test(argv[1:], participants)
+    except BlockError, e:
+        print e
+        exit(1)
+    elapsed = time.time() - start
+
+    print total.summary()
+    print '%d blocks, %d trials in %.2f s (%.1f trials/s overall)' % \
+            (blocks, sum(total.trials.values()), elapsed,
+             sum(total.trials.values()) / elapsed)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+'''mirror_view.py
+
+Show the experimenter what the participant's seeing - the screen, the trial
+they're on and the camera - for a block that's running with
+NUMERICVID_MIRROR set (see cognac.Mirror). This is its own process with its
+own window, and only ever reads, so none of this drawing comes out of the
+participant's frames.'''
+
+import time
+
+import pygame
+
+from cognac.Mirror import MirrorReader
+
+
+# How often we look for something new
+poll_interval = 0.05
+# Space for the state lines under the images
+text_height = 60
+# Images count as stale if they haven't changed for this long
+stale_after = 2.0
+
+
+def format_state(state, stale):
+    if state is None:
+        return ['waiting for the block to start...']
+
+    lines = ['row %3d  %-3s  t %7.1f s  trial %5.1f s' %
+                (state['row'], state['condition'], state['t'],
+                 state['trial_t'])]
+    if state['label']:
+        lines[0] += '  %s: %s' % (state['label'], state['response'])
+    if state['interval'] == float('inf'):
+        lines.append('no screen snapshots (see VisionEgg.log)')
+    else:
+        lines.append('snapshot every %.2f s, %.0f us (max %.0f)' %
+                     (state['interval'], 1e6 * state['cost_mean'],
+                      1e6 * state['cost_max']))
+    if stale:
+        lines[-1] += '  [not updating]'
+
+    return lines
+
+
+def to_surface(pixels):
+    # pygame wants columns first
+    return pygame.surfarray.make_surface(pixels.swapaxes(0, 1))
+
+
+class MirrorWindow:
+    reader = None
+    window = None
+    font = None
+    # (seq, when it changed) for the screen and the camera
+    screen_seen = (None, 0.0)
+    camera_seen = (None, 0.0)
+
+    def __init__(self, reader):
+        self.reader = reader
+        pygame.init()
+        pygame.display.set_caption('NumericVid mirror')
+        self.font = pygame.font.Font(None, 20)
+
+    def size_for(self, screen, camera):
+        width = height = 0
+        for got in (screen, camera):
+            if got is not None:
+                h, w = got[1].shape[:2]
+                width += w
+                height = max(height, h)
+
+        return max(width, 400), height + text_height
+
+    def seen(self, last, got, now):
+        seq = got and got[0]['seq']
+        if seq != last[0]:
+            return seq, now
+        return last
+
+    def show(self):
+        screen = self.reader.read_screen()
+        camera = self.reader.read_camera()
+        now = time.time()
+        self.screen_seen = self.seen(self.screen_seen, screen, now)
+        self.camera_seen = self.seen(self.camera_seen, camera, now)
+
+        size = self.size_for(screen, camera)
+        if self.window is None or self.window.get_size() != size:
+            self.window = pygame.display.set_mode(size)
+        window = self.window
+        window.fill((64, 64, 64))
+
+        x = 0
+        for got in (screen, camera):
+            if got is not None:
+                window.blit(to_surface(got[1]), (x, 0))
+                x += got[1].shape[1]
+
+        y = size[1] - text_height + 5
+        lines = format_state(screen and screen[0],
+                             now - self.screen_seen[1] > stale_after)
+        if camera is None:
+            lines.append('no camera yet')
+        elif now - self.camera_seen[1] > stale_after:
+            lines.append('camera not updating')
+        for line in lines:
+            window.blit(self.font.render(line, True, (255, 255, 255)), (5, y))
+            y += 18
+
+        pygame.display.flip()
+
+    def run(self):
+        while True:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN
+                        and event.key == pygame.K_ESCAPE):
+                    return
+            self.show()
+            time.sleep(poll_interval)
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    if len(argv) > 3:
+        print "usage: ./mirror_view.py [<mirror file> [<camera file>]]"
+        exit(1)
+
+    reader = MirrorReader(*argv[1:])
+    try:
+        MirrorWindow(reader).run()
+    except KeyboardInterrupt:
+        pass
+    reader.close()
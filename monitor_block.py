@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+'''monitor_block.py
+
+Watch a block that's running with NUMERICVID_TELEMETRY set (see
+cognac.Telemetry) - from another terminal, or another process on the same
+machine. This only ever reads, so it can't slow the block down.'''
+
+import sys
+import time
+
+from cognac.Telemetry import TelemetryReader
+
+
+def format_record(record, stale):
+    if record is None:
+        return 'waiting for the block to start...'
+
+    line = 'row %3d  %-3s  t %7.1f s  last RT %5.2f (%s)' % \
+            (record['row'], record['condition'], record['t'],
+             record['last_rt'], record['last_label'])
+    line += '  dropped %d/%d frames  publish %.0f us (max %.0f)' % \
+            (record['dropped'], record['frames'], 1e6 * record['cost_mean'],
+             1e6 * record['cost_max'])
+    if stale:
+        line += '  [not updating]'
+
+    return line
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    if len(argv) > 2:
+        print "usage: ./monitor_block.py [<telemetry file>]"
+        exit(1)
+
+    try:
+        reader = TelemetryReader(argv[1] if len(argv) == 2 else None)
+    except IOError, e:
+        print "Can't find any telemetry (is NUMERICVID_TELEMETRY set?):", e
+        exit(1)
+
+    last_seq = None
+    last_change = time.time()
+    try:
+        while True:
+            record = reader.read()
+            now = time.time()
+            seq = record and record['seq']
+            if seq != last_seq:
+                last_seq = seq
+                last_change = now
+            sys.stdout.write('\r' + format_record(record,
+                                                  now - last_change > 2.0))
+            sys.stdout.write('\033[K')
+            sys.stdout.flush()
+            time.sleep(0.25)
+    except KeyboardInterrupt:
+        print
@@ -2,74 +2,50 @@
 
 ### Std Lib Imports
 
-from csv import reader
-from textwrap import wrap
-from os.path import dirname, join
-
-# Installed libs
+from os import environ
+from os.path import dirname, join, normpath
 
 import yaml
-import pygame
-from VisionEgg.Text import Text
 
 # Our libs
 
-from cognac.SimpleVisionEgg import SimpleVisionEgg
 from cognac.StimController import StimController, Trial, Event, Response
-
-from visionegg_cam_capture import Recording
-
-
-### Utility function
-
-# TODO: would be nice if this could also handle scientific notation
-def format_num(x):
-    '''Take a number, put commas for a number in the millions, otherwise write
-    "Trillions", "Billions", etc.
-    
-    x - a STRING of 0-9's'''
-    def float_num(x, exponent):
-        '''Format a big number to look nice
-        
-        x: the number
-        exponent: e.g. 12 for trillion'''
-        units = x[:-exponent]
-        if len(units) < 3:
-            # Get a few digits after the decimal point
-            frac = x[-exponent:(-exponent + 3 - len(units))]
-            frac = frac.rstrip('0')
-            if len(frac) > 0:
-                units = units + '.' + frac
-
-        return units
-
-    if x.lower().find('e') != -1:
-        # Get rid of scientific notation
-        x = str(int(float(x)))
-    elif x.find('.') != -1:
-        # This is a reasonable decimal number...
-        return x
-
-    if len(x) > 12:
-        return float_num(x, 12) + ' Trillion'
-    if len(x) > 9:
-        return float_num(x, 9) + ' Billion'
-
-    i = 3
-    final = x[-i:]
-    while i < len(x):
-        final = x[-(i+3):-i] + ',' + final
-        i += 3
-
-    return final
-    
+from cognac.DisplayProfile import DisplayProfile
+from cognac.Checkpoint import Checkpoint
+from cognac.Adaptive import AdaptiveSelector, SurpriseModel
+from cognac.Profiler import SamplingProfiler
+from cognac.Startup import StartupTrace
+
+if environ.get('NUMERICVID_HEADLESS'):
+    # No window, no camera and a simulated clock - for replay_block.py and
+    # friends. Set this before importing us!
+    from cognac.Headless import HeadlessVisionEgg as SimpleVisionEgg, \
+                                NullStim as Text, NullStim as Recording
+else:
+    from VisionEgg.Text import Text
+    from cognac.SimpleVisionEgg import SimpleVisionEgg
+    from visionegg_cam_capture import Recording
+
+from block_compiler import format_num, wrap_description, open_and_check, \
+                           open_block, cached_block, read_kernels, \
+                           BlockError, CONDITIONS
+from estimates import parse_estimate
+
+# How long each bit of getting started takes goes in VisionEgg.log (see
+# cognac.Startup) - frame_stats.py -r shows them
+startup = StartupTrace()
+startup.mark('import')
+
+# From calibrate_display.py, if it's been run on this machine - if so, we use
+# the VisionEgg settings it measured with, and don't ask
+display_profile = DisplayProfile.load()
 
 
 ### Presentation Classes
 
 # This seems "wrong," instantiating classes before declaring others but it gets
 # the job done!
-vision_egg = SimpleVisionEgg()
+vision_egg = SimpleVisionEgg(display_profile=display_profile, startup=startup)
 
 xlim, ylim = vision_egg.screen.size
 
@@ -95,17 +71,68 @@ vision_egg.set_stimuli([instruction, value, answer] + description)
 
 recording = Recording()
 
+# Set NUMERICVID_REALTIME=1 to keep the garbage collector and the OS out of the
+# way of our frames (see cognac.RealTime) - what worked ends up in the log
+realtime = None
+if environ.get('NUMERICVID_REALTIME'):
+    from cognac.RealTime import RealTime
+    realtime = RealTime()
+    vision_egg.set_realtime(realtime)
+    recording.child_setup = realtime.child_setup
+    print realtime.summary()
+
+# Set NUMERICVID_COLLECTOR=host:port to send our logs to collect_logs.py as we
+# go, and NUMERICVID_COHORT to say whose they are
+collector = None
+if environ.get('NUMERICVID_COLLECTOR'):
+    from cognac.Collector import CollectorClient
+    host, port = environ['NUMERICVID_COLLECTOR'].rsplit(':', 1)
+    collector = CollectorClient((host, int(port)),
+                                cohort=environ.get('NUMERICVID_COHORT',
+                                                   'default'),
+                                thread_setup=realtime and
+                                                realtime.child_setup)
+
+# Set NUMERICVID_TELEMETRY=1 (or a file to use instead of the default in
+# /dev/shm) and run monitor_block.py to watch how the block's going
+telemetry = None
+if environ.get('NUMERICVID_TELEMETRY'):
+    from cognac.Telemetry import Telemetry
+    telemetry_path = environ['NUMERICVID_TELEMETRY']
+    telemetry = Telemetry(None if telemetry_path == '1' else telemetry_path)
+
+# Set NUMERICVID_MIRROR=1 and run mirror_view.py to see the participant's
+# screen (a few times a second), the trial they're on and the camera (see
+# cognac.Mirror)
+mirror = None
+if environ.get('NUMERICVID_MIRROR'):
+    from cognac.Mirror import Mirror, GPUGrabber
+    mirror = Mirror(vision_egg.screen.size)
+    # Headless, there's no screen to read back - just the trial state
+    if not environ.get('NUMERICVID_HEADLESS'):
+        mirror.grabber = GPUGrabber(vision_egg.screen.size, mirror.small_size)
+    recording.mirror = True
+
+# Set NUMERICVID_PROFILE (or profile: in a block's YAML) to "all", or to the
+# conditions and rows you want, e.g. "EI,0-4" - we sample where the time goes
+# during those trials, and write it next to the log as <log>.folded (see
+# cognac.Profiler)
+profile_spec = environ.get('NUMERICVID_PROFILE')
+
 class ReadResponse(Response):
-    limit = ('return', 'enter', 'space')
+    __slots__ = ()
+
+    def __init__(self, label):
+        Response.__init__(self, label, limit=('return', 'enter', 'space'))
+
 
 class SurpriseResponse(Response):
-    limit = ('1', '2', '3', '[1]', '[2]', '[3]')
+    __slots__ = ()
+    keys = ('1', '2', '3', '[1]', '[2]', '[3]')
     target = answer
-    label = 'surprise'
 
-    def __init__(self):
-        '''Simply here to avoid calling the superclass __init__'''
-        pass
+    def __init__(self, label='surprise'):
+        Response.__init__(self, label, limit=self.keys)
 
     def record_response(self, t):
         '''Updated to give timing feedback'''
@@ -117,75 +144,115 @@ class SurpriseResponse(Response):
 
 
 class MemoryResponse(SurpriseResponse):
-    limit = ('1', '2', '3', '4', '[1]', '[2]', '[3]', '[4]')
-    label = 'memory'
+    __slots__ = ()
+    keys = ('1', '2', '3', '4', '[1]', '[2]', '[3]', '[4]')
+
+    def __init__(self, label='memory'):
+        SurpriseResponse.__init__(self, label)
 
 
 class EstimateResponse(Response):
-    response = ''
+    '''A typed estimate - value is what we make of it as a number (see
+    estimates.py), given the kernel's format'''
+    __slots__ = ('start_time', 'timeout', 'format', 'value')
+    log_fields = Response.log_fields + ('start_time', 'timeout', 'value')
     target = answer
-    label = 'estimate'
-    start_time = None
-    timeout = 5.0
 
     def __init__(self, timeout=5.0):
-        '''Bypass Response.__init__'''
-
         self.timeout = timeout
+        self.format = ''
+        Response.__init__(self, 'estimate')
+
+    def reset(self):
+        Response.reset(self)
+        self.response = ''
+        self.start_time = None
+        self.value = None
 
     def record_response(self, t):
         """obtain a textual answer typed from the keyboard"""
-        responses = pygame.event.get(pygame.KEYDOWN)
-        pygame.event.clear()
+        responses = self.device.poll()
 
+        # We only take one key a frame
         if responses:
-            key = pygame.key.name(responses[0].key)
-            if key in ('return', 'enter'):
-                if self.response:
-                    self.rt = t - self.ref_time
-                    return True
-            else:
-                if key == 'space':
-                    self.response += ' '
-                elif key in ('backspace', 'delete'):
-                    self.response = self.response[:-1]
-                else:
-                    # Code our time to start
-                    if self.start_time is None:
-                        self.start_time = t - self.ref_time
-
-                    if len(key) > 1:
-                        self.response += key[1]
-                    else:
-                        self.response += key
-
-                self.target.set(text = self.response)
+            code, timestamp = responses[0]
+            return self.press(t, code, timestamp)
 
         # if self.start_time is None and t - self.ref_time > self.timeout:
         #     self.target.set(text="Don't think too hard!", color=(1, 0, 0))
 
         return False
 
+    def press(self, t, code, timestamp):
+        key = self.device.name(code)
+        if key in ('return', 'enter'):
+            if self.response:
+                self.rt = self.event_time(t, timestamp) - self.ref_time
+                self.value = parse_estimate(self.response, self.format)
+                return True
+        else:
+            if key == 'space':
+                self.response += ' '
+            elif key in ('backspace', 'delete'):
+                self.response = self.response[:-1]
+            else:
+                # Code our time to start
+                if self.start_time is None:
+                    self.start_time = self.event_time(t, timestamp) - \
+                                      self.ref_time
+
+                if len(key) > 1:
+                    self.response += key[1]
+                else:
+                    self.response += key
+
+            self.target.set(text = self.response)
+
+        return False
+
 
 class PresentKernel(Trial):
-    def __init__(self, condition, value_text, desc_text, fname):
+    __slots__ = ('condition', 'template', 'value_events', 'desc_events',
+                 'record_event', 'estimate')
+
+    def __init__(self, condition, value_text=None, desc_text=None, fname=None,
+                 fmt=''):
         '''All we need to present a single trial of our experiment
 
         So far, only integrated recording into 'EI'
 
+        If you only give a condition, you get an empty template for that
+        condition - use fill to put a kernel in it (this is what TrialPool
+        does).
+
+        value_text :
+            already run through format_num (block_compiler does this for us)
+        desc_text :
+            the description, either as text or already wrapped into lines
+
         fname :
             the name of the avi where we'll store subject face images
+        fmt :
+            the kernel's Format (e.g. "$x"), for parsing the estimate
         '''
+        self.condition = condition
+        # These are the events that change from kernel to kernel
+        self.value_events = []
+        self.desc_events = []
+        self.record_event = None
+        self.estimate = None
+
         # Chunks of stuff that get done in different trials
         def generic_E(desc_stop): 
+            self.estimate = EstimateResponse(timeout=5.0)
             return [ Event(instruction, 0.5, 'start_reading', text='ESTIMATE',
                            log={'condition': condition},
                            response=ReadResponse('start_reading')) ] + \
-                   self.display_description(desc_text, 'start_reading', 
+                   self.display_description(None, 'start_reading', 
                                             desc_stop) + \
                    [ Event(answer, 'start_reading', desc_stop, 
                            text='<>', color=(0,0,0), 
-                           response=EstimateResponse(timeout=5.0)) ]
+                           response=self.estimate) ]
 
         def surprise(surp_start):
             # return [ Event(answer, surp_start, 'surprise', text='<>',
@@ -194,15 +261,14 @@ class PresentKernel(Trial):
                            text='SURPRISED?', response=SurpriseResponse() )]
 
         # Now define our actual conditions
-        value_text = format_num(value_text)
-
         if condition == 'I':
+            self.value_events = [ Event(value, 'start_reading', 'surprise',
+                                        name='value') ]
             events = [ Event(instruction, 0.5, 'start_reading', text='READ',
                              log={'condition': 'I'},
-                             response=ReadResponse('start_reading')),
-                       Event(value, 'start_reading', 'surprise', 
-                             text=value_text) ] + \
-                     self.display_description(desc_text, 
+                             response=ReadResponse('start_reading')) ] + \
+                     self.value_events + \
+                     self.display_description(None, 
                                               ('start_reading', 2.0), 
                                               'surprise') + \
                      surprise(('start_reading', 2.0))
@@ -212,10 +278,13 @@ class PresentKernel(Trial):
             # Note that we set the first 'value' to offset after 'surprise' to
             # prevent this from deactivating the second value prompt ('<>')
             # right at 'read_num'
-            events = [ Event(recording, 0.0, 'surprise', fname=fname) ] + \
+            self.record_event = Event(recording, 0.0, 'surprise',
+                                      name='recording')
+            self.value_events = [ Event(value, ('estimate', 0.5), 'surprise',
+                                        name='value') ]
+            events = [ self.record_event ] + \
                      generic_E('surprise') + \
-                     [ Event(value, ('estimate', 0.5), 'surprise', 
-                             text=value_text)] + \
+                     self.value_events + \
                      surprise(('estimate', 2.5))
         elif condition == 'EM':
             #         [ Event(answer, 'estimate', 'memory', text='<>',
@@ -224,69 +293,253 @@ class PresentKernel(Trial):
                      [ Event(instruction, 'estimate', 'memory',
                              text='MEMORY?', response=MemoryResponse() ) ]
 
-
+        self.template = events
         Trial.__init__(self, events)
 
+        if value_text is not None:
+            self.fill(value_text, desc_text, fname, fmt)
+
     def display_description(self, desc_text, first_start, stop, line_width=53):
-        desc_lines = wrap(desc_text, line_width)
-        if len(desc_lines) > 4:
-            desc_lines = desc_lines[0:4]
-            print "description doesn't wrap to 4 lines:\n***"
-            print desc_text, '\n***'
-        
+        '''Events for each line of desc_text - if desc_text is None, we get
+        (empty) events for all of our description stimuli'''
+        if desc_text is None:
+            desc_lines = [''] * len(description)
+        elif isinstance(desc_text, basestring):
+            desc_lines = wrap_description(desc_text, line_width)
+        else:
+            desc_lines = desc_text
+
         labels = ('read0', 'read1', 'read2', 'read3')
         start_times = (first_start, 'read0', 'read1', 'read2')
-        return [Event(desc_stim, first_start, stop, text=line) 
-                    for desc_stim, line in zip(description, desc_lines)]
-
-
-def open_and_check(fname, expected_header):
-    csv_iter = reader(open(fname))
-    csv_header = csv_iter.next()
-    if csv_header != expected_header:
-        print "%s header should be: %s" % (fname, expected_header)
-        exit(1)
+        events = [Event(desc_stim, first_start, stop, text=line,
+                        name='description%d' % i)
+                    for i, (desc_stim, line) in
+                        enumerate(zip(description, desc_lines))]
+        if desc_text is None:
+            self.desc_events = events
+
+        return events
+
+    def fill(self, value_text, desc_text, fname, fmt=''):
+        '''Put a kernel into our template, and get ready to run'''
+        if isinstance(desc_text, basestring):
+            desc_text = wrap_description(desc_text)
+
+        for event in self.value_events:
+            event.parms['text'] = value_text
+        for event, line in zip(self.desc_events, desc_text):
+            event.parms['text'] = line
+        if self.record_event:
+            self.record_event.parms['fname'] = fname
+        if self.estimate:
+            self.estimate.format = fmt
+
+        # Descriptions with fewer lines leave some description stimuli unused
+        unused = self.desc_events[len(desc_text):]
+        self.schedule = [e for e in self.template if e not in unused]
+        self.reset()
+
+
+class TrialPool:
+    '''Hands out PresentKernels, only building a new one when we don't have a
+    spare for that condition. Once a block's log is written, release its
+    trials and they'll be re-used for the next block.'''
+    spares = None
 
-    return csv_iter
-                    
-def main(yaml_file, kern_file='shorter-kernels.csv'):
-    try:
-        parms = yaml.load(open(yaml_file))
-        base = dirname(yaml_file)
-        if not base:
-            base = '.'
-    except:
-        print "Problem with the YAML file!"
-        exit(1)
-
-    kernels_in = open_and_check(kern_file, 
-                     ['Item.code', 'Value', 'Description', 'Format'] )
-
-    kernels = {}
-    for code, value, desc_text, format in kernels_in:
-        if format:
-            desc_text = '%s [%s]' % (desc_text, format)
-        kernels[code] = (value, desc_text)
-
-    order_in = open_and_check(join(base, parms['subj_order_file']), 
-                                ['Item.code', 'Condition'])
-
-    trials = []
-    for code, cond in order_in:
-        value, desc_text = kernels[code]
-        fname = join(base, 'trial%02d.avi' % len(trials))
-        trials.append( PresentKernel(cond, value, desc_text, fname) )
-
-    stim_control = StimController(trials, vision_egg)
+    def __init__(self):
+        self.spares = {}
+
+    def get(self, condition, value_text, desc_text, fname, fmt=''):
+        try:
+            trial = self.spares[condition].pop()
+        except (KeyError, IndexError):
+            trial = PresentKernel(condition)
+
+        trial.fill(value_text, desc_text, fname, fmt)
+        return trial
+
+    def release(self, trials):
+        for trial in trials:
+            self.spares.setdefault(trial.condition, []).append(trial)
+
+trial_pool = TrialPool()
+
+
+def load_trials(block_file, kern_file='shorter-kernels.csv'):
+    '''Returns (log path, trials) for block_file, which is either the block's
+    YAML, or the .blk that block_compiler.py made from it. Either way, we
+    use the .blk (much quicker to get going) - it gets compiled first if
+    there isn't one, or if the YAML, order or kernels have changed since.
+    Give the trials back to trial_pool when you're done with them.'''
+    base = dirname(block_file)
+    if not base:
+        base = '.'
+
+    if block_file.endswith('.blk'):
+        block = open_block(block_file)
+    else:
+        block = cached_block(block_file, kern_file)
+    log_file = block.log_file
+
+    trials = [trial_pool.get(cond, value_text, desc_lines, join(base, avi_name),
+                             fmt)
+                for cond, value_text, desc_lines, avi_name, fmt in block]
+
+    return join(base, log_file), trials
+
+
+# What you can put after adaptive: in a block's YAML
+adaptive_models = {'surprise': SurpriseModel}
+
+def load_adaptive(block_file, kern_file='shorter-kernels.csv'):
+    '''Returns (log path, selector) for a block whose YAML has an adaptive:
+    model (and maybe an adaptive_seed:). We use the same kernels as the
+    order file, each in the condition it gives, but the model picks the
+    order as we go (see cognac.Adaptive). Without an adaptive_seed, the
+    block file's path is the seed, so each subject's block makes the same
+    choices every time it's run.
+
+    Like load_block, any codes the kernel file doesn't have (or unknown
+    conditions) are a BlockError, before anything gets presented.'''
+    base = dirname(block_file)
+    if not base:
+        base = '.'
+    parms = yaml.load(open(block_file))
+    kernels = read_kernels(kern_file)
+    order = list(open_and_check(join(base, parms['subj_order_file']),
+                                ['Item.code', 'Condition']))
+
+    problems = []
+    for code, cond in order:
+        if cond not in CONDITIONS:
+            problems.append('unknown condition %s for %s' % (cond, code))
+        if code not in kernels:
+            problems.append('missing code %s' % code)
+    if problems:
+        raise BlockError('\n    '.join(["%s doesn't match %s:" %
+                                            (block_file, kern_file)] +
+                                          problems))
+
+    codes = dict(order)
+    conditions = [cond for code, cond in order]
+
+    model = adaptive_models[parms['adaptive']](
+                dict((code, float(kernels[code][0])) for code in codes))
+
+    def make(condition, n):
+        return trial_pool.get(condition, '', [''],
+                              join(base, 'trial%02d.avi' % n))
+
+    def fill(trial, code, n):
+        value_text, desc_text, fmt = kernels[code]
+        trial.fill(format_num(value_text), wrap_description(desc_text),
+                   join(base, 'trial%02d.avi' % n), fmt)
+
+    selector = AdaptiveSelector(model, codes, conditions, make, fill,
+                                seed=parms.get('adaptive_seed',
+                                               normpath(block_file)))
+    selector.child_setup = getattr(recording, 'child_setup', None)
+
+    return join(base, parms['log_file']), selector
+
+
+def main(block_file, kern_file='shorter-kernels.csv', resume=False):
+    '''If resume, we pick up from the checkpoint that the last run of this
+    block left behind (if it didn't finish)'''
+    # The YAML can switch on extras - compiled blocks don't have any
+    parms = {}
+    if block_file.endswith('.yaml'):
+        parms = yaml.load(open(block_file))
+
+    selector = None
+    if 'adaptive' in parms:
+        log_path, selector = load_adaptive(block_file, kern_file)
+        trials = selector
+        if resume:
+            print "Adaptive blocks can't be resumed - starting from the" \
+                  " beginning"
+            resume = False
+    else:
+        log_path, trials = load_trials(block_file, kern_file)
+
+    # Adaptive blocks can't be resumed, so there's no point saving them
+    checkpoint = None
+    if selector is None:
+        checkpoint = Checkpoint(log_path + '.checkpoint', block_file,
+                                len(trials))
+    state = None
+    if resume:
+        try:
+            state = checkpoint.load()
+        except ValueError, e:
+            # The block's changed since - we can't tell which trials are done
+            raise BlockError("Can't resume - %s. Move it out of the way to "
+                             "start from the beginning." % e)
+        if state is None:
+            print "No checkpoint for %s - starting from the beginning" % \
+                    block_file
+        else:
+            print "Resuming %s after trial %d of %d" % \
+                    (block_file, state['trials_done'], len(trials))
+    spec = profile_spec or parms.get('profile')
+    profiler = None
+    if spec:
+        profiler = SamplingProfiler(spec)
+
+    to_run = trials
+    if state is not None:
+        to_run = trials[state['trials_done']:]
+
+    if collector is not None:
+        collector.start_block(block_file)
+    stim_control = StimController(to_run, vision_egg,
+                                  collector=collector, telemetry=telemetry,
+                                  display_profile=display_profile,
+                                  checkpoint=checkpoint, selector=selector,
+                                  profiler=profiler, mirror=mirror)
+    if state is not None:
+        stim_control.resume(state)
     stim_control.run_trials()
 
-    stim_control.writelog(join(base, parms['log_file']))
+    stim_control.writelog(log_path)
+    if checkpoint is not None and stim_control.trials_done == len(trials):
+        checkpoint.remove()
+    if profiler is not None:
+        profiler.write(log_path + '.folded')
+        print "Profiled %d samples into %s" % (profiler.samples,
+                                               log_path + '.folded')
+    if selector is not None:
+        # Just the trials we actually got to
+        trials = selector.trials
+        selector.close()
+
+    if collector is not None:
+        for row, trial in enumerate(trials):
+            if trial.record_event:
+                collector.send_recording(trial.record_event.parms['fname'],
+                                         row=row, condition=trial.condition)
+        collector.send('done', {'log_file': log_path,
+                                'rows': stim_control.curr_row})
+        if not collector.close(timeout=10):
+            print "Couldn't get everything to the collector - the log's" \
+                  " still in", log_path
+
+    trial_pool.release(trials)
 
 if __name__ == '__main__':
     from sys import argv, exit
 
-    if len(argv) != 2:
-        print "usage: ./numeric_questions.py <desc_file>.yaml"
+    args = argv[1:]
+    resume = '--resume' in args
+    if resume:
+        args.remove('--resume')
+    if len(args) != 1:
+        print "usage: ./numeric_questions.py [--resume] " \
+              "<desc_file>.yaml|<desc_file>.blk"
         exit(1)
 
-    main(argv[1])
+    try:
+        main(args[0], resume=resume)
+    except BlockError, e:
+        print e
+        exit(1)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+'''replay_block.py
+
+Play blocks back from their logs, with no display and as fast as we can go
+(see cognac.Replay), and print anything in the new log that doesn't match the
+original. Use this to check changes to StimController and friends against
+real sessions.
+
+Times are allowed to be off by a couple of frames, as we only run on a
+simulated 60 Hz clock. With --skip-new, columns the original log doesn't have
+at all (because it's from before we logged them) aren't counted as
+differences.'''
+
+from os import environ
+from csv import DictReader
+import time
+
+# This has to happen before numeric_questions_fast sets up its stimuli
+environ['NUMERICVID_HEADLESS'] = '1'
+
+import numeric_questions_fast as nqf
+from block_compiler import BlockError
+from cognac.Replay import replay, compare_logs
+
+
+def replay_block(block_file, kern_file='shorter-kernels.csv', frames=2,
+                 skip_new=False):
+    '''Returns (original log, replayed log, differences, gave_up) - see
+    cognac.Replay.replay and compare_logs. Times within frames of each other
+    match.'''
+    log_path, trials = nqf.load_trials(block_file, kern_file)
+    try:
+        original = list(DictReader(open(log_path)))
+        replayed, gave_up = replay(trials, nqf.vision_egg, original)
+    finally:
+        nqf.trial_pool.release(trials)
+
+    tolerance = frames * nqf.vision_egg.frame_period
+    return original, replayed, compare_logs(original, replayed, tolerance,
+                                            skip_new), gave_up
+
+
+def session_time(rows):
+    '''The latest time in the log - from the last row that has any, as a
+    replay that stopped early leaves empty rows at the end'''
+    for row in reversed(rows):
+        times = [float(v) for k, v in row.iteritems()
+                    if v and (k == 'trial_start' or k.endswith('.ref_time'))]
+        if times:
+            return max(times)
+
+    return 0.0
+
+
+def main(block_files, skip_new=False):
+    '''Returns the number of blocks that didn't match (or that we had to give
+    up on)'''
+    mismatched = 0
+    for block_file in block_files:
+        start = time.time()
+        try:
+            original, replayed, diffs, gave_up = \
+                    replay_block(block_file, skip_new=skip_new)
+        except (IOError, BlockError), e:
+            print '%s: skipped (%s)' % (block_file, e)
+            continue
+        elapsed = time.time() - start
+
+        print '%s: %d trials, %.1f s of session in %.2f s, %d differences' % \
+                (block_file, len(replayed), session_time(replayed), elapsed,
+                 len(diffs))
+        if gave_up:
+            print '    gave up waiting for a response the log has no keys ' \
+                  'for - the replay stopped early'
+        for row, name, orig, new in diffs:
+            print '    row %d, %s: %s -> %s' % (row, name, orig, new)
+        if diffs or gave_up:
+            mismatched += 1
+
+    return mismatched
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    args = argv[1:]
+    skip_new = '--skip-new' in args
+    if skip_new:
+        args.remove('--skip-new')
+    if not args:
+        print "usage: ./replay_block.py [--skip-new] " \
+              "<block>.yaml|<block>.blk [...]"
+        print "   e.g. ./replay_block.py practice/block2-EI.yaml"
+        exit(1)
+
+    exit(main(args, skip_new) and 1)
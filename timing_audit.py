@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+'''timing_audit.py
+
+Check how well onsets kept to their schedule, over every log you've got (see
+cognac.TimingAudit). The schedules come straight from PresentKernel, so
+they're always the ones the code actually runs.
+
+Give it log files, collector stores (<cohort>.jsonl, see collect_logs.py)
+or directories to look through for either - anything that isn't a
+StimController log is skipped. A log that several blocks share (like the
+practice blocks') only counts once. Frames are as long as this machine's
+display profile says (see cognac.DisplayProfile), unless you give -r.'''
+
+from os import environ, walk
+from os.path import join, realpath
+from sys import stderr
+import time
+
+# This has to happen before numeric_questions_fast sets up its stimuli
+environ['NUMERICVID_HEADLESS'] = '1'
+
+import numeric_questions_fast as nqf
+from block_compiler import CONDITIONS
+from cognac.Collector import store_logs
+from cognac.TimingAudit import TimingAudit, trial_schedule
+
+
+def schedules():
+    '''condition -> the schedule PresentKernel uses for it'''
+    return dict((condition, trial_schedule(nqf.PresentKernel(condition)))
+                    for condition in CONDITIONS)
+
+
+def find_logs(paths):
+    '''Every .csv and .jsonl under paths (which can also just be files), each
+    only once'''
+    seen = set()
+    for path in paths:
+        if path.endswith(('.csv', '.jsonl')):
+            found = [path]
+        else:
+            found = []
+            for dirpath, dirnames, filenames in walk(path):
+                dirnames.sort()
+                found.extend(join(dirpath, f) for f in sorted(filenames)
+                                if f.endswith(('.csv', '.jsonl')))
+        for fname in found:
+            if realpath(fname) not in seen:
+                seen.add(realpath(fname))
+                yield fname
+
+
+def audit(paths, frame_period=None):
+    timing_audit = TimingAudit(schedules(), frame_period)
+    for fname in find_logs(paths):
+        if fname.endswith('.jsonl'):
+            for (station, block, session), rows in \
+                    sorted(store_logs(fname).iteritems()):
+                name = '%s:%s/%s/%s' % (fname, station, block, session)
+                timing_audit.add_rows(name, rows)
+        else:
+            timing_audit.add_log(fname)
+
+    return timing_audit
+
+
+if __name__ == '__main__':
+    from sys import argv, exit
+
+    args = argv[1:]
+    frame_period = None
+    if args[:1] == ['-r'] and len(args) > 1:
+        frame_period = 1.0 / float(args[1])
+        args = args[2:]
+    if not args or [a for a in args if a.startswith('-')]:
+        print "usage: ./timing_audit.py [-r <refresh Hz>] <tree or log> [...]"
+        print "   e.g. ./timing_audit.py subject*/ practice store/spring.jsonl"
+        exit(1)
+
+    start = time.time()
+    timing_audit = audit(args, frame_period)
+    print >> stderr, 'audited %d logs in %.2f s' % (timing_audit.logs,
+                                                   time.time() - start)
+    for line in timing_audit.report():
+        print line
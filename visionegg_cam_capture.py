@@ -238,22 +238,87 @@ class Recording:
     '''A simple class that works kind of like a VisionEgg stimulus, but
     recording from the camera as opposed to showing an image.
 
+    Starting a process is slow, so StimController calls prepare while the
+    previous trial is still going. That forks a child, which gets everything
+    imported and then waits - set(on=True) tells it to go. It only opens the
+    camera (and the writer) once it's told to go, as until then the last
+    trial's child still has the camera, and two processes can't have it open
+    at once.
+
+    Anything prepared that never gets to go has to be cancelled - otherwise
+    its child waits forever, and we hang on exit waiting for it.
+    StimController does this when a block ends (or we quit).
+
     Man would this be a job for Traits!
     '''
+    # Each of these is a (process, go, stop) tuple
+    child = None
+    ready = None
+    # The file the ready child is set up for
+    ready_fname = None
+    # Called first thing in each child, e.g., RealTime.child_setup
+    child_setup = None
+    # Whether to show what the camera sees in mirror_view.py (see
+    # cognac.Mirror)
+    mirror = False
 
     def __init__(self):
-        self.on = mp.Event()
+        pass
+
+    def spawn(self, fname):
+        go = mp.Event()
+        stop = mp.Event()
+        child = mp.Process(target=self.record, args=(fname, go, stop))
+        child.start()
+
+        return child, go, stop
 
+    def prepare(self, fname=None, on=True):
+        '''Get a child ready to record to fname, if we haven't already'''
+        if self.ready is not None:
+            if self.ready_fname == fname:
+                return
+            # We got ready for the wrong file
+            self.cancel_ready()
+
+        self.ready = self.spawn(fname)
+        self.ready_fname = fname
 
     def set(self, on, fname=None):
         '''General purpose, but should just be using 'on' as a key for now'''
         if on:
-            self.on.set()
-            self.child = mp.Process(target=self.record, args=(on, fname))
-            self.child.start()
-        else:
-            self.on.clear()
-            self.child.join()
+            self.prepare(fname)
+            self.child = self.ready
+            self.ready = self.ready_fname = None
+            child, go, stop = self.child
+            go.set()
+        elif self.child is not None:
+            self.finish(self.child)
+            self.child = None
+
+    def finish(self, child_info):
+        '''Stop (or cancel) a child, and wait for it to close its file'''
+        child, go, stop = child_info
+        stop.set()
+        go.set()
+        child.join()
+
+    def cancel_ready(self):
+        '''Get rid of the child we prepared - it doesn't open its file until
+        it's told to go, so there's nothing on disk to clean up (and
+        ready_fname might be a recording we made earlier)'''
+        if self.ready is None:
+            return
+        self.finish(self.ready)
+        self.ready = self.ready_fname = None
+
+    def cancel(self):
+        '''Stop recording, and cancel anything we prepared - call this when
+        the block's over, however it ended'''
+        if self.child is not None:
+            self.finish(self.child)
+            self.child = None
+        self.cancel_ready()
 
     def open(self, fname):
         '''Prepare a MovieWriter with fname'''
@@ -261,18 +326,38 @@ class Recording:
     def finalize(self):
         del self.writer
 
-    def record(self, on, fname):
+    def record(self, fname, go, stop):
         '''Can be run as a separate process to continuously grab frames, while
         allowing the parent process to carry on'''
+        if self.child_setup:
+            self.child_setup()
+        if self.mirror:
+            from cognac.Mirror import CameraMirror
+
+        go.wait()
+        if stop.is_set():
+            # We were cancelled
+            return
+
         print 'creating writer for %s' % fname
         camera = CVCam()
         size = camera.width, camera.height
         writer = CVWriter(fname, size)
-        while self.on.is_set():
+        camera_mirror = None
+        if self.mirror:
+            camera_mirror = CameraMirror(size)
+
+        while not stop.is_set():
             im = camera.get_image()
             # arr = self.camera.conv2array(im)
             writer.write_im(im)
+            if camera_mirror is not None and camera_mirror.due():
+                # conv2array flips it for OpenGL - we want it the right way
+                # up
+                camera_mirror.frame(camera.conv2array(im)[::-1])
 
+        if camera_mirror is not None:
+            camera_mirror.close()
         del writer
         del camera
 